@@ -0,0 +1,220 @@
+import os
+import random
+
+from openpyxl import Workbook
+from openpyxl.styles import PatternFill
+
+from typing import List, Dict, Union, Any
+
+
+# Fill color of the input cells in the "Klimatbokslut - Datainsamling" template
+KEY_FILL = PatternFill(start_color = 'FFDDEBF7', end_color = 'FFDDEBF7', fill_type = 'solid')
+
+SCOPE_1_LABELS = [
+    'Diesel (liter)', 'Bensin (liter)', 'HVO100 (liter)', 'Eldningsolja (liter)', 'Naturgas (m3)',
+    'Gasol (kg)', 'Köldmedia R410A (kg)', 'Köldmedia R32 (kg)', 'Egna fordon, antal'
+]
+SCOPE_2_LABELS = [
+    'Källa inköpt el', 'kWh elanvändning', 'Källa värme', 'kWh värme', 'Källa kyla', 'kWh kyla'
+]
+SCOPE_3_LABELS = [
+    'Flygresor inrikes (km)', 'Flygresor utrikes (km)', 'Tågresor (km)', 'Hotellnätter', 'Taxi (kr)',
+    'Hyrbil (km)', 'Tjänsteresor med privat bil (km)', 'Papper (kg)', 'Restavfall (kg)', 'Diesel (liter)'
+]
+# Special case write locations in the summary sheets, see scope_2_dict.json
+SCOPE_2_SUMMARY_LABELS = ['Verksamhetsel', 'Fjärrvärme', 'Fjärrkyla']
+
+COMPANY_WORDS = [
+    'Nordic', 'Svea', 'Bygg', 'Teknik', 'Energi', 'Logistik', 'Fastighet', 'Industri', 'Konsult', 'Service',
+    'Miljö', 'El', 'Data', 'System', 'Transport', 'Verkstad', 'Handel', 'Projekt', 'Invest', 'Gruppen'
+]
+
+
+def generate_corpus(root: str, subsidiaries: int, summary_sheets: Union[int, None] = None, extra_labels: int = 0,
+                    offices: int = 1, seed: int = 0, settings: Union[Dict[str, Any], None] = None) -> Dict[str, Any]:
+    '''
+    Summary:
+        Generate a synthetic working folder with the same structure as the real one:
+        - root/<Input file folder name>/<subsidiary>/Klimatbokslut <subsidiary> - Datainsamling.xlsx
+        - root/<Output file folder name>/<Summary file name>, with one sheet per subsidiary
+        The subsidiary workbooks use the key-colored (FFDDEBF7) layout that _get_scope_data reads
+
+    Args:
+        root (str): Folder to generate the corpus in
+        subsidiaries (int): Number of subsidiary folders
+        summary_sheets (int, optional): Number of subsidiary sheets in the summary workbook. Defaults to
+        one per subsidiary. Subsidiaries without a sheet are left unmatched
+        extra_labels (int): Number of additional entries per scope sheet, to make the sheets larger
+        offices (int): Number of offices (repeated scope 2 blocks) per subsidiary
+        seed (int): Random seed, the same arguments always give the same corpus
+        settings (Dict, optional): Script settings dictionary, for the folder and file names
+
+    Returns:
+        Dict[str, Any]: {
+            'input folder path': path to the input folder,
+            'output folder path': path to the output folder,
+            'summary file': path to the summary workbook,
+            'subsidiaries': list of subsidiary folder names,
+            'summary sheets': list of subsidiary sheet names in the summary workbook
+        }
+    '''
+    rng = random.Random(seed)
+    settings = settings or {}
+    input_folder_path = os.path.join(root, settings.get("Input file folder name", "Arbetsmapp datainsamling"))
+    output_folder_path = os.path.join(root, settings.get("Output file folder name", "Arbetsmapp datainsamling"))
+    os.makedirs(input_folder_path, exist_ok = True)
+    os.makedirs(output_folder_path, exist_ok = True)
+
+    names = _company_names(rng, subsidiaries)
+    extra = [f'Övrig post {i} (st)' for i in range(extra_labels)]
+
+    for name in names:
+        folder = os.path.join(input_folder_path, name)
+        os.makedirs(folder, exist_ok = True)
+        generate_subsidiary_workbook(
+            os.path.join(folder, f'Klimatbokslut {name} - Datainsamling.xlsx'),
+            rng = rng,
+            extra_labels = extra,
+            offices = offices
+        )
+
+    # Sheet names are shortened folder names, like in the real summary file
+    sheet_count = subsidiaries if summary_sheets is None else summary_sheets
+    sheet_names = [name.replace(' AB', '') for name in names[:sheet_count]]
+    summary_file = os.path.join(output_folder_path, settings.get("Summary file name", "Aktivitetsdata Klimatbokslut.xlsx"))
+    generate_summary_workbook(summary_file, sheet_names = sheet_names, extra_labels = extra)
+
+    return {
+        'input folder path': input_folder_path,
+        'output folder path': output_folder_path,
+        'summary file': summary_file,
+        'subsidiaries': names,
+        'summary sheets': sheet_names
+    }
+
+
+def generate_subsidiary_workbook(save_name: str, rng: random.Random, extra_labels: List[str] = [], offices: int = 1) -> None:
+    '''
+    Summary:
+        Generate one subsidiary workbook with a "Scope 1 & 2" and a "Scope 3" sheet, plus an
+        instruction sheet that is not read. Mixes the o-x-o (key to the left of the value) and
+        o-x-x (key colored, to the right of the value) layouts, and leaves some values empty
+
+    Args:
+        save_name (str): Path to save the workbook to
+        rng (random.Random): Random number generator
+        extra_labels (List[str]): Additional entries for every scope sheet
+        offices (int): Number of scope 2 blocks
+    '''
+    wb = Workbook()
+    instructions = wb.active
+    instructions.title = 'Instruktioner'
+    instructions.cell(row = 1, column = 1).value = 'Fyll i de blå cellerna'
+
+    scope_1_2 = wb.create_sheet('Scope 1 & 2')
+    row = _write_block(scope_1_2, 2, 'Scope 1', SCOPE_1_LABELS + extra_labels, rng)
+    for office in range(offices):
+        row = _write_block(scope_1_2, row + 1, f'Scope 2 - kontor {office + 1}', SCOPE_2_LABELS, rng)
+
+    scope_3 = wb.create_sheet('Scope 3')
+    _write_block(scope_3, 2, 'Scope 3', SCOPE_3_LABELS + extra_labels, rng)
+
+    wb.save(save_name)
+
+
+def generate_summary_workbook(save_name: str, sheet_names: List[str], extra_labels: List[str] = []) -> None:
+    '''
+    Summary:
+        Generate the summary workbook with one sheet per subsidiary. Each sheet lists the entry
+        names (with the surrounding spaces often found in the real file) and leaves the column to
+        the right of them empty for the values. The scope 2 rows follow scope_2_dict.json
+
+    Args:
+        save_name (str): Path to save the workbook to
+        sheet_names (List[str]): Subsidiary sheet names
+        extra_labels (List[str]): Additional entries for the scope 1 and scope 3 blocks
+    '''
+    wb = Workbook()
+    wb.active.title = 'Sammanställning'
+
+    for sheet_name in sheet_names:
+        ws = wb.create_sheet(sheet_name)
+        ws.cell(row = 1, column = 1).value = sheet_name
+        # Rows 7, 9 and 10 are the scope 2 special case locations
+        for row, label in zip([7, 9, 10], SCOPE_2_SUMMARY_LABELS):
+            ws.cell(row = row, column = 2).value = label
+        ws.cell(row = 6, column = 1).value = 'Scope 2'
+
+        row = 12
+        ws.cell(row = row, column = 1).value = 'Scope 1'
+        for label in SCOPE_1_LABELS + extra_labels:
+            row += 1
+            ws.cell(row = row, column = 2).value = f' {label} '
+        row += 2
+        ws.cell(row = row, column = 1).value = 'Scope 3'
+        # 'Papper (kg)' and 'Restavfall (kg)' are left out to produce mismatches, and 'Diesel (liter)'
+        # is listed under both scope 1 and scope 3 to exercise the multiple match rules
+        for label in SCOPE_3_LABELS[:-3] + ['Diesel (liter)'] + extra_labels:
+            row += 1
+            ws.cell(row = row, column = 2).value = f' {label} '
+
+    wb.save(save_name)
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _write_block(ws: Any, row: int, title: str, labels: List[str], rng: random.Random) -> int:
+    '''
+    Write a titled block of key-value entries to a subsidiary sheet
+
+    Args:
+        ws (Worksheet): Sheet to write to
+        row (int): First row of the block
+        title (str): Block title, written in the first column
+        labels (List[str]): Entry names
+        rng (random.Random): Random number generator
+
+    Returns:
+        int: The row after the block
+    '''
+    ws.cell(row = row, column = 1).value = title
+    for label in labels:
+        row += 1
+        value = rng.choice([rng.randint(1, 100000), round(rng.uniform(0, 5000), 2), None])
+        if rng.random() < 0.8:
+            # o x o: key, value, unit note
+            ws.cell(row = row, column = 2).value = label
+            ws.cell(row = row, column = 3).value = value
+            ws.cell(row = row, column = 3).fill = KEY_FILL
+            ws.cell(row = row, column = 4).value = 'Kommentar' if rng.random() < 0.3 else None
+        else:
+            # o x x: value, key (both colored)
+            ws.cell(row = row, column = 3).value = value
+            ws.cell(row = row, column = 3).fill = KEY_FILL
+            ws.cell(row = row, column = 4).value = label
+            ws.cell(row = row, column = 4).fill = KEY_FILL
+    return row + 1
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _company_names(rng: random.Random, count: int) -> List[str]:
+    '''
+    Generate unique company names like 'Svea Bygg Teknik AB'
+
+    Args:
+        rng (random.Random): Random number generator
+        count (int): Number of names
+
+    Returns:
+        List[str]: Company names
+    '''
+    names = []
+    seen = set()
+    while len(names) < count:
+        name = ' '.join(rng.sample(COMPANY_WORDS, 3)) + ' AB'
+        if name in seen:
+            name = name.replace(' AB', f' {len(names)} AB')
+        seen.add(name)
+        names.append(name)
+    return names
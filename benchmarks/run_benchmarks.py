@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+
+from typing import List, Dict, Any, Union
+
+# Allows imports from sibling directories
+# Source: https://stackoverflow.com/questions/70395407/import-module-from-a-sibling-directory-in-python3-10/73081295#73081295
+sys.path.insert(0, '.')
+
+import utils.util as utils
+from utils.log import configure_logging
+from utils.pipeline import run_pipeline
+from benchmarks.corpus import generate_corpus
+
+
+def run_benchmark(root: str, subsidiaries: int, extra_labels: int, offices: int, settings: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Summary:
+        Generate a corpus in root and time each stage of the pipeline on it.
+        With settings["Pipelined run"], reading and writing overlap and are timed together as the 'pipeline' stage
+
+    Args:
+        root (str): Folder to generate the corpus in
+        subsidiaries (int): Number of subsidiary folders
+        extra_labels (int): Number of additional entries per scope sheet
+        offices (int): Number of scope 2 blocks per subsidiary
+        settings (Dict[str, Any]): Script settings dictionary
+
+    Returns:
+        Dict[str, Any]: Benchmark record with the corpus parameters and the seconds spent per stage
+    '''
+    corpus = generate_corpus(root, subsidiaries = subsidiaries, extra_labels = extra_labels, offices = offices, settings = settings)
+    settings = dict(settings)
+    settings["Input file folder path"] = corpus['input folder path']
+    settings["Output file folder path"] = corpus['output folder path']
+
+    stages = {}
+
+    # Console output would be measured as well, so only errors are logged during a run
+    configure_logging({"Log level": "ERROR"})
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        input_files = utils.discover_input_files(path = settings["Input file folder path"], settings = settings)
+        input_folder_names = list(input_files.keys())
+        input_file_paths = [file_path for file_paths in input_files.values() for file_path in file_paths]
+        stages['discovery'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        summary_wb = utils.excel_to_workbook(corpus['summary file'])
+        summary_mismatches = summary_wb.create_sheet("Mismatched Data")
+        for column, header in enumerate(["Input folder name", "Scope", "Entry name", "Value", "Suggestions"], start = 1):
+            summary_mismatches.cell(row = 1, column = column).value = header
+        stages['load summary'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        matches = utils.match_lists(input_folder_names, summary_wb.sheetnames, filter_doubles = True)
+        stages['match_lists'] = time.perf_counter() - start
+
+        if settings.get("Pipelined run", False):
+            start = time.perf_counter()
+            run_pipeline(input_file_paths, matches, wb = summary_wb, settings = settings)
+            stages['pipeline'] = time.perf_counter() - start
+            input_data_dict = None
+        else:
+            start = time.perf_counter()
+            input_data_dict = utils.get_input_data(input_file_paths, matches, settings = settings)
+            stages['get_input_data'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            writes = utils.compute_summary_writes(data_dict = input_data_dict, wb = summary_wb, matches = matches, settings = settings)
+            stages['write_data_to_summary'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            utils.apply_summary_writes(writes = writes, wb = summary_wb, settings = settings)
+            stages['save'] = time.perf_counter() - start
+
+    stages['total'] = sum(stages.values())
+
+    return {
+        'subsidiaries': subsidiaries,
+        'extra labels': extra_labels,
+        'offices': offices,
+        'matched': len(matches),
+        # The pipelined run does not keep the input data around to count
+        'entries': None if input_data_dict is None else sum(len(scope) for sheets in input_data_dict.values() for scope in sheets.values()),
+        'input bytes': sum(os.path.getsize(file_path) for file_path in input_file_paths),
+        'stages': stages
+    }
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description = 'Time each stage of the pipeline on generated corpora of several sizes.')
+    parser.add_argument('--scales', type = int, nargs = '+', default = [10, 50, 200], help = 'Numbers of subsidiaries to benchmark')
+    parser.add_argument('--extra-labels', type = int, default = 20, help = 'Additional entries per scope sheet')
+    parser.add_argument('--offices', type = int, default = 1, help = 'Scope 2 blocks per subsidiary')
+    parser.add_argument('--repeat', type = int, default = 1, help = 'Runs per scale')
+    parser.add_argument('--workers', type = int, default = 1, help = 'Value for "Ingestion workers"')
+    parser.add_argument('--streaming', action = 'store_true', help = 'Enable "Streaming reads"')
+    parser.add_argument('--reader-backend', choices = list(utils.READER_BACKENDS), default = 'openpyxl', help = 'Value for "Reader backend"')
+    parser.add_argument('--output-mode', choices = ['openpyxl', 'patch'], default = 'openpyxl', help = 'Value for "Output mode"')
+    parser.add_argument('--pipelined', action = 'store_true', help = 'Enable "Pipelined run"')
+    parser.add_argument('--output', default = os.path.join('benchmarks', 'results.jsonl'), help = 'JSON lines file to append the results to')
+    parser.add_argument('--keep', action = 'store_true', help = 'Keep the generated corpora')
+    args = parser.parse_args(argv)
+
+    settings = utils.load_json(json_path = "settings.json")
+    settings["Ingestion workers"] = args.workers
+    settings["Streaming reads"] = args.streaming
+    settings["Reader backend"] = args.reader_backend
+    settings["Output mode"] = args.output_mode
+    settings["Pipelined run"] = args.pipelined
+    # Every run should parse every file
+    settings["Use parse cache"] = False
+
+    run_info = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu count': os.cpu_count(),
+        'workers': args.workers,
+        'streaming': args.streaming,
+        'reader backend': args.reader_backend,
+        'output mode': args.output_mode,
+        'pipelined': args.pipelined,
+        'startup': _measure_startup()
+    }
+    if run_info['startup'] is not None:
+        print(f'[run_benchmarks] Startup (import main): {run_info["startup"]:.3f}s')
+
+    with open(args.output, 'a') as f:
+        for scale in args.scales:
+            for run in range(args.repeat):
+                root = tempfile.mkdtemp(prefix = f'excel-env-bench-{scale}-')
+                try:
+                    record = run_benchmark(root, subsidiaries = scale, extra_labels = args.extra_labels, offices = args.offices, settings = settings)
+                finally:
+                    if not args.keep:
+                        shutil.rmtree(root, ignore_errors = True)
+                record.update(run_info)
+                record['run'] = run
+                f.write(json.dumps(record) + '\n')
+                f.flush()
+
+                stages = ', '.join(f'{stage}: {seconds:.3f}s' for stage, seconds in record['stages'].items())
+                print(f'[run_benchmarks] {scale} subsidiaries (run {run + 1}/{args.repeat}): {stages}')
+
+    print(f'[run_benchmarks] Results appended to {args.output}')
+    return 0
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _measure_startup(repeat: int = 5) -> Union[float, None]:
+    '''
+    Time how long it takes to import main.py in a fresh interpreter, which is also paid by every worker process
+    that imports the package. Measured inside the interpreter, so the interpreter start itself is left out
+
+    Args:
+        repeat (int): Number of interpreters to start, the fastest one is reported
+
+    Returns:
+        float or None: Seconds to import main.py, or None if it could not be imported
+    '''
+    code = 'import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)'
+    timings = []
+    for _ in range(repeat):
+        try:
+            result = subprocess.run([sys.executable, '-c', code], capture_output = True, text = True, check = True)
+        except subprocess.CalledProcessError:
+            return None
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return min(timings)
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _git_commit() -> str:
+    '''
+    Get the current git commit, so that results can be compared between versions
+
+    Returns:
+        str: Commit hash, or 'unknown' outside of a git checkout
+    '''
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True, check = True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
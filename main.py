@@ -1,65 +1,114 @@
 import os
 import sys
+import logging
 
-import numpy as np
-import openpyxl
+import utils.util as utils
+from utils.log import configure_logging, log_warning_summary
+from utils.pipeline import run_pipeline
+from utils.export import build_activity_table, export_activity_data
+from utils.history import save_run_history, get_reporting_period
+from utils.match_store import load_match_store, save_match_store
+from utils.watch import run_watch
+from utils.memory import start_memory_report, measure_stage, save_memory_report
+from utils.profiling import start_run_report, profile_stage, save_run_report
 
-import itertools
+logger = logging.getLogger(__name__)
 
-import utils.util as utils
 
-# Setup - script settings:
-settings = utils.load_json(json_path="settings.json")
-
-# Add some additional parameters to settings:
-settings["Current working directory"] = os.getcwd()
-settings["Parent directory"] = os.path.dirname(settings["Current working directory"])
-settings["Input file folder path"] = os.path.join(settings["Parent directory"], settings["Input file folder name"])
-settings["Output file folder path"] = os.path.join(settings["Parent directory"], settings["Output file folder name"])
-
-# Setup - scope 2 handling settings:
-scope_2_dict = utils.load_json(json_path="scope_2_dict.json")
-
-# Setup - Load relevant folder and file paths and extract their names
-# Input files and folders
-input_folder_paths = utils.__get_input_folders(path = settings["Input file folder path"], settings = settings)
-input_file_paths = utils.__get_input_files(path = settings["Input file folder path"], settings = settings)
-input_folder_names = [file.split("\\")[-1] for file in input_folder_paths]
-input_file_names = [file.split("\\")[-1] for file in input_file_paths]
-
-# Setup - Load summary file and sheets
-summary_file = os.path.join(settings["Output file folder path"], settings["Summary file name"])
-summary_wb = utils.excel_to_workbook(summary_file)
-summary_sheets = summary_wb.sheetnames
-if "Mismatched Data" not in summary_sheets:
-    summary_mismatches = summary_wb.create_sheet("Mismatched Data")
-    summary_mismatches.cell(row = 1, column = 1).value = "Input folder name"
-    summary_mismatches.cell(row = 1, column = 2).value = "Scope"
-    summary_mismatches.cell(row = 1, column = 3).value = "Entry name"
-    summary_mismatches.cell(row = 1, column = 4).value = "Value"
-else:
-    pass # TODO - decide whether new sheet should be created or if starting row for mismatches 
-         # should be set to max_row + 1 or similar
+def main() -> int:
+    '''
+    Summary:
+        Run the script: load the settings and the summary file, find the input files and write their data to the summary file.
+        Nothing happens when this module is imported, so that importing it (e.g. from worker processes) stays cheap
 
-if __name__ == '__main__':
+    Returns:
+        int: Status code, 0 if successful
+    '''
+    # Setup - script settings:
+    settings = utils.load_json(json_path="settings.json")
+    configure_logging(settings)
+
+    # Add some additional parameters to settings:
+    settings["Current working directory"] = os.getcwd()
+    settings["Parent directory"] = os.path.dirname(settings["Current working directory"])
+    settings["Input file folder path"] = os.path.join(settings["Parent directory"], settings["Input file folder name"])
+    settings["Output file folder path"] = os.path.join(settings["Parent directory"], settings["Output file folder name"])
+
+    # Setup - the period that the history store files the data under has to be known before anything is read
+    if settings.get("Use history store", False):
+        get_reporting_period(settings)
+
+    # Setup - Time and memory use per stage, see utils/memory.py, and time and counters per stage, file and subsidiary, see utils/profiling.py
+    memory_report = start_memory_report(settings)
+    run_report = start_run_report(settings)
+
+    # Setup - Find the input files and group them by the name of their folder
+    with measure_stage(memory_report, 'discovery'), profile_stage(run_report, 'discovery'):
+        input_files = utils.discover_input_files(path = settings["Input file folder path"], settings = settings)
+    input_folder_names = list(input_files.keys())
+    input_file_paths = [file_path for file_paths in input_files.values() for file_path in file_paths]
+
+    # Setup - Load summary file and sheets
+    summary_file = os.path.join(settings["Output file folder path"], settings["Summary file name"])
+    with measure_stage(memory_report, 'load summary'), profile_stage(run_report, 'load summary'):
+        summary_wb = utils.excel_to_workbook(summary_file)
+    summary_sheets = summary_wb.sheetnames
+    if "Mismatched Data" not in summary_sheets:
+        summary_mismatches = summary_wb.create_sheet("Mismatched Data")
+        summary_mismatches.cell(row = 1, column = 1).value = "Input folder name"
+        summary_mismatches.cell(row = 1, column = 2).value = "Scope"
+        summary_mismatches.cell(row = 1, column = 3).value = "Entry name"
+        summary_mismatches.cell(row = 1, column = 4).value = "Value"
+        summary_mismatches.cell(row = 1, column = 5).value = "Suggestions"
+    else:
+        pass # TODO - decide whether new sheet should be created or if starting row for mismatches 
+             # should be set to max_row + 1 or similar
 
     # Match input file names to summary file sheet names
-    matches = utils.match_lists(input_folder_names, summary_sheets, filter_doubles = True)
+    match_store = load_match_store(settings["Match store file name"]) if settings.get("Use match store", False) else None
+    with measure_stage(memory_report, 'match'), profile_stage(run_report, 'match'):
+        matches = utils.match_lists(input_folder_names, summary_sheets, filter_doubles = True, store = match_store)
+    if match_store is not None:
+        save_match_store(match_store, settings["Match store file name"])
 
-    print("\nProcessing input files...\n")
+    if settings.get("Watch mode", False):
+        logger.info("Processing input files and writing data to summary file, then watching for changes...")
 
-    input_data_dict = utils.get_input_data(input_file_paths, matches)
+        with measure_stage(memory_report, 'watch'), profile_stage(run_report, 'watch'):
+            run_watch(settings, wb = summary_wb, summary_sheets = summary_sheets, input_folder_names = input_folder_names, matches = matches, store = match_store)
+    elif settings.get("Pipelined run", False):
+        logger.info("Processing input files and writing data to summary file...")
 
-    print("\nWriting data to summary file...\n")
+        with measure_stage(memory_report, 'pipeline'), profile_stage(run_report, 'pipeline'):
+            run_pipeline(input_file_paths, matches, wb = summary_wb, settings = settings, report = memory_report, run_report = run_report)
+    else:
+        logger.info("Processing input files...")
 
-    utils.write_data_to_summary(data_dict = input_data_dict, wb = summary_wb, matches = matches, settings = settings)
+        input_sources = {}
+        with measure_stage(memory_report, 'read input'), profile_stage(run_report, 'read input'):
+            input_data_dict = utils.get_input_data(input_file_paths, matches, settings = settings, sources = input_sources, report = memory_report, run_report = run_report)
 
-    print("\nData write successful. Exiting script...\n")
+        logger.info("Writing data to summary file...")
 
-    #summary_wb.save(os.path.join(settings['Output file folder path'], settings["Output file name"]))
-    '''
-    for key in input_data_dict.keys():
-        # use 'matches' dict to find where to write the data
-        print(f"Writing data from input folder '{key}' to sheet '{matches[key]['match']}'")
-    '''
-    
\ No newline at end of file
+        summary_targets = {}
+        # The run report stages of this step are 'summary writes' and 'save summary', see write_data_to_summary
+        with measure_stage(memory_report, 'write summary'):
+            utils.write_data_to_summary(data_dict = input_data_dict, wb = summary_wb, matches = matches, settings = settings, targets = summary_targets, run_report = run_report)
+
+        if settings.get("Export format", "none") != "none" or settings.get("Use history store", False):
+            with profile_stage(run_report, 'export'):
+                activity_table = build_activity_table(input_data_dict, input_sources, summary_targets)
+                export_activity_data(activity_table, settings)
+                save_run_history(activity_table, settings)
+
+    save_memory_report(memory_report, settings)
+    save_run_report(run_report, settings)
+
+    logger.info("Data write successful. Exiting script...")
+    log_warning_summary(logger)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
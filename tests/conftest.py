@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Allows imports of the utils package when pytest is run from another directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,94 @@
+import os
+import pickle
+
+from utils.cache import load_parse_cache, save_parse_cache, get_cached_scope_data, put_cached_scope_data, CACHE_VERSION
+
+
+def write_file(file_path, content):
+    file_path.write_bytes(content)
+    return str(file_path)
+
+
+def test_unchanged_file_is_served_from_the_cache(tmp_path):
+    file_path = write_file(tmp_path / 'data.xlsx', b'content')
+    cache_path = str(tmp_path / 'cache.pkl')
+    cache = load_parse_cache(cache_path)
+    put_cached_scope_data(cache, file_path, {'Scope 1': {'Diesel (liter)': 10}})
+    save_parse_cache(cache, cache_path)
+
+    cache = load_parse_cache(cache_path)
+
+    assert get_cached_scope_data(cache, file_path) == {'Scope 1': {'Diesel (liter)': 10}}
+
+
+def test_changed_file_is_a_miss(tmp_path):
+    file_path = write_file(tmp_path / 'data.xlsx', b'content')
+    cache = load_parse_cache(str(tmp_path / 'cache.pkl'))
+    put_cached_scope_data(cache, file_path, {'Scope 1': {}})
+    stat = os.stat(file_path)
+
+    # Same size, newer modification time
+    write_file(tmp_path / 'data.xlsx', b'CONTENT')
+    os.utime(file_path, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert get_cached_scope_data(cache, file_path) is None
+
+    # Different size
+    put_cached_scope_data(cache, file_path, {'Scope 1': {}})
+    write_file(tmp_path / 'data.xlsx', b'longer content')
+    assert get_cached_scope_data(cache, file_path) is None
+
+
+def test_content_hash_ignores_touched_files(tmp_path):
+    file_path = write_file(tmp_path / 'data.xlsx', b'content')
+    cache = load_parse_cache(str(tmp_path / 'cache.pkl'))
+    put_cached_scope_data(cache, file_path, {'Scope 1': {}}, content_hash = True)
+    stat = os.stat(file_path)
+
+    os.utime(file_path, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert get_cached_scope_data(cache, file_path, content_hash = True) == {'Scope 1': {}}
+
+    write_file(tmp_path / 'data.xlsx', b'CONTENT')
+    assert get_cached_scope_data(cache, file_path, content_hash = True) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache_path = str(tmp_path / 'cache.pkl')
+    cache = load_parse_cache(cache_path)
+    file_paths = [write_file(tmp_path / f'data {index}.xlsx', b'content') for index in range(3)]
+    for file_path in file_paths:
+        put_cached_scope_data(cache, file_path, {'Scope 1': {'Diesel (liter)': file_path}})
+    for last_used, file_path in enumerate([file_paths[1], file_paths[0], file_paths[2]]):
+        cache['entries'][os.path.abspath(file_path)]['last_used'] = last_used
+    entry_bytes = max(entry['nbytes'] for entry in cache['entries'].values())
+
+    save_parse_cache(cache, cache_path, max_bytes = 2 * entry_bytes)
+
+    cache = load_parse_cache(cache_path)
+    assert get_cached_scope_data(cache, file_paths[1]) is None
+    assert get_cached_scope_data(cache, file_paths[0]) is not None
+    assert get_cached_scope_data(cache, file_paths[2]) is not None
+
+
+def test_entries_of_deleted_files_are_dropped(tmp_path):
+    cache_path = str(tmp_path / 'cache.pkl')
+    cache = load_parse_cache(cache_path)
+    kept = write_file(tmp_path / 'kept.xlsx', b'content')
+    deleted = write_file(tmp_path / 'deleted.xlsx', b'content')
+    put_cached_scope_data(cache, kept, {})
+    put_cached_scope_data(cache, deleted, {})
+    os.remove(deleted)
+
+    save_parse_cache(cache, cache_path)
+
+    assert list(load_parse_cache(cache_path)['entries']) == [os.path.abspath(kept)]
+
+
+def test_unreadable_or_outdated_cache_is_empty(tmp_path):
+    cache_path = tmp_path / 'cache.pkl'
+    empty_cache = {'version': CACHE_VERSION, 'entries': {}}
+
+    cache_path.write_bytes(b'not a pickle')
+    assert load_parse_cache(str(cache_path)) == empty_cache
+
+    cache_path.write_bytes(pickle.dumps({'version': CACHE_VERSION - 1, 'entries': {'data.xlsx': {}}}))
+    assert load_parse_cache(str(cache_path)) == empty_cache
@@ -0,0 +1,94 @@
+import sys
+import logging
+
+import pytest
+
+from utils.export import build_activity_table, export_activity_data, ACTIVITY_COLUMNS
+from utils.util import ScopeData
+
+
+def scope_data(entries, cells, repeats = None):
+    data = ScopeData(entries)
+    data.cells.update(cells)
+    data.repeats.update(repeats or {})
+    return data
+
+
+def build_table():
+    input_data = {
+        'Bolag A AB': {
+            'Scope 1 & 2': scope_data({'Diesel (liter)': 10, 'Källa el': 'Vattenfall', 'Okänd': None, 'Ja/nej': True},
+                                      {'Diesel (liter)': 'C2', 'Källa el': 'C3', 'Okänd': 'C4', 'Ja/nej': 'C5'}),
+        },
+        'Bolag B AB': {
+            'Scope 2': scope_data({'El (kWh)': 2.5}, {'El (kWh)': 'C12'}, repeats = {'El (kWh)': [(1, 'C5'), (2.5, 'C12')]})
+        }
+    }
+    sources = {'Bolag A AB': 'a.xlsx', 'Bolag B AB': 'b.xlsx'}
+    targets = {('Bolag A AB', 'Scope 1 & 2', 'Diesel (liter)'): ('Bolag A', 13, 3), ('Bolag B AB', 'Scope 2', 'El (kWh)'): ('Bolag B', 7, 3)}
+    return build_activity_table(input_data, sources, targets)
+
+
+def test_build_activity_table():
+    table = build_table()
+
+    rows = list(zip(*(table[column] for column in ACTIVITY_COLUMNS)))
+    assert rows == [
+        ('Bolag A AB', 'Scope 1 & 2', 'Diesel (liter)', '10', 10.0, 'a.xlsx', 'C2', 'Bolag A', 'C13'),
+        ('Bolag A AB', 'Scope 1 & 2', 'Källa el', 'Vattenfall', None, 'a.xlsx', 'C3', None, None),
+        ('Bolag A AB', 'Scope 1 & 2', 'Okänd', None, None, 'a.xlsx', 'C4', None, None),
+        ('Bolag A AB', 'Scope 1 & 2', 'Ja/nej', 'True', None, 'a.xlsx', 'C5', None, None),
+        # One row per occurrence of a repeated key
+        ('Bolag B AB', 'Scope 2', 'El (kWh)', '1', 1.0, 'b.xlsx', 'C5', 'Bolag B', 'C7'),
+        ('Bolag B AB', 'Scope 2', 'El (kWh)', '2.5', 2.5, 'b.xlsx', 'C12', 'Bolag B', 'C7')
+    ]
+
+
+def test_table_can_be_built_one_subsidiary_at_a_time():
+    input_data = {'Bolag A AB': {'Scope 1': scope_data({'Diesel (liter)': 10}, {})}, 'Bolag B AB': {'Scope 1': scope_data({'Bensin (liter)': 3}, {})}}
+
+    table = build_activity_table({}, {}, {})
+    for key in input_data:
+        build_activity_table({key: input_data[key]}, {}, {}, table)
+
+    assert table == build_activity_table(input_data, {}, {})
+
+
+@pytest.mark.parametrize('file_format', ['parquet', 'arrow'])
+def test_export_round_trip(tmp_path, file_format):
+    pa = pytest.importorskip('pyarrow')
+    table = build_table()
+    settings = {"Export format": file_format, "Export file name": 'activity', "Output file folder path": str(tmp_path)}
+
+    file_path = export_activity_data(table, settings)
+
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        exported = pq.read_table(file_path)
+    else:
+        import pyarrow.ipc
+        exported = pyarrow.ipc.open_file(pa.memory_map(file_path)).read_all()
+    assert file_path == str(tmp_path / f'activity.{file_format}')
+    assert exported.to_pydict() == table
+    assert exported.schema.field('numeric value').type == pa.float64()
+    assert not (tmp_path / f'activity.{file_format}.tmp').exists()
+
+
+def test_no_export(tmp_path):
+    settings = {"Export format": "none", "Export file name": 'activity', "Output file folder path": str(tmp_path)}
+
+    assert export_activity_data(build_table(), settings) is None
+    assert list(tmp_path.iterdir()) == []
+
+    with pytest.raises(ValueError):
+        export_activity_data(build_table(), dict(settings, **{"Export format": "csv"}))
+
+
+def test_export_without_pyarrow(tmp_path, monkeypatch, caplog):
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    settings = {"Export format": "parquet", "Export file name": 'activity', "Output file folder path": str(tmp_path)}
+
+    with caplog.at_level(logging.ERROR, logger = 'utils.export'):
+        assert export_activity_data(build_table(), settings) is None
+
+    assert 'pyarrow is not installed' in caplog.text
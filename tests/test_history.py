@@ -0,0 +1,137 @@
+import json
+import sqlite3
+import logging
+
+import pytest
+
+from utils.history import save_history, save_run_history, get_reporting_period, list_periods, scope_totals, year_over_year, missing_entries, main
+
+
+def activity_table(rows):
+    # (subsidiary, scope, label, value, source cell) per row, see build_activity_table
+    table = {column: [] for column in ['subsidiary', 'scope', 'label', 'value', 'numeric value', 'source file', 'source cell', 'summary sheet', 'summary cell']}
+    for subsidiary, scope, label, value, source_cell in rows:
+        table['subsidiary'].append(subsidiary)
+        table['scope'].append(scope)
+        table['label'].append(label)
+        table['value'].append(None if value is None else str(value))
+        table['numeric value'].append(float(value) if isinstance(value, (int, float)) else None)
+        table['source file'].append(f'{subsidiary}.xlsx')
+        table['source cell'].append(source_cell)
+        table['summary sheet'].append(None)
+        table['summary cell'].append(None)
+    return table
+
+
+def stored_entries(store_path):
+    with sqlite3.connect(store_path) as conn:
+        return conn.execute('SELECT period, subsidiary, scope, label, source_cell, value, numeric_value FROM entries ORDER BY 1, 2, 3, 4, 5').fetchall()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store_path = str(tmp_path / 'history.sqlite')
+    save_history(activity_table([
+        ('Bolag A AB', 'Scope 1', 'Diesel (liter)', 100, 'C2'),
+        ('Bolag A AB', 'Scope 3', 'Flygresor (km)', 1000, 'C5'),
+        ('Bolag A AB', 'Scope 3', 'Taxi (kr)', 500, 'C6'),
+        ('Bolag B AB', 'Scope 1', 'Diesel (liter)', 40, 'C2')
+    ]), store_path, '2024')
+    save_history(activity_table([
+        ('Bolag A AB', 'Scope 1', 'Diesel (liter)', 80, 'C2'),
+        ('Bolag A AB', 'Scope 1', 'Bensin (liter)', None, 'C3'),
+        ('Bolag A AB', 'Scope 3', 'Flygresor (km)', 1500, 'C5'),
+        ('Bolag B AB', 'Scope 1', 'Diesel (liter)', 50, 'C2')
+    ]), store_path, '2025')
+    return store_path
+
+
+def test_save_history_upserts_and_removes_stale_entries(tmp_path):
+    store_path = str(tmp_path / 'history.sqlite')
+    save_history(activity_table([
+        ('Bolag A AB', 'Scope 1', 'Diesel (liter)', 100, 'C2'),
+        ('Bolag A AB', 'Scope 1', 'Bensin (liter)', 5, 'C3'),
+        ('Bolag B AB', 'Scope 1', 'Diesel (liter)', 40, 'C2')
+    ]), store_path, '2025')
+    save_history(activity_table([('Bolag A AB', 'Scope 1', 'Diesel (liter)', 100, 'C2')]), store_path, '2024')
+
+    # Bolag A AB is run again: its Diesel entry is updated and the Bensin entry it no longer has is removed.
+    # Bolag B AB and the other period are left untouched
+    assert save_history(activity_table([('Bolag A AB', 'Scope 1', 'Diesel (liter)', 120, 'C2')]), store_path, '2025') == 1
+
+    assert stored_entries(store_path) == [
+        ('2024', 'Bolag A AB', 'Scope 1', 'Diesel (liter)', 'C2', '100', 100.0),
+        ('2025', 'Bolag A AB', 'Scope 1', 'Diesel (liter)', 'C2', '120', 120.0),
+        ('2025', 'Bolag B AB', 'Scope 1', 'Diesel (liter)', 'C2', '40', 40.0)
+    ]
+
+
+def test_repeated_labels_are_kept_per_source_cell(tmp_path):
+    store_path = str(tmp_path / 'history.sqlite')
+
+    save_history(activity_table([('Bolag A AB', 'Scope 2', 'kWh elanvändning', 10, 'C5'), ('Bolag A AB', 'Scope 2', 'kWh elanvändning', 20, 'C12'),
+                                 ('Bolag A AB', 'Scope 2', 'Okänd', 1, None)]), store_path, '2025')
+
+    assert [entry[3:5] for entry in stored_entries(store_path)] == [('Okänd', ''), ('kWh elanvändning', 'C12'), ('kWh elanvändning', 'C5')]
+
+
+def test_reporting_period_is_required(tmp_path):
+    settings = {"Use history store": True, "History store file name": str(tmp_path / 'history.sqlite'), "Reporting period": " "}
+
+    with pytest.raises(ValueError, match = 'Reporting period'):
+        get_reporting_period(settings)
+    with pytest.raises(ValueError):
+        save_run_history(activity_table([]), settings)
+    assert get_reporting_period(dict(settings, **{"Reporting period": 2025})) == '2025'
+    assert save_run_history(activity_table([]), dict(settings, **{"Use history store": False})) is None
+    assert not (tmp_path / 'history.sqlite').exists()
+
+
+def test_unwritable_store_is_reported(tmp_path, caplog):
+    settings = {"Use history store": True, "History store file name": str(tmp_path / 'missing' / 'history.sqlite'), "Reporting period": "2025"}
+
+    with caplog.at_level(logging.ERROR, logger = 'utils.history'):
+        assert save_run_history(activity_table([('Bolag A AB', 'Scope 1', 'Diesel (liter)', 1, 'C2')]), settings) is None
+
+    assert 'Could not save the history' in caplog.text
+
+
+def test_queries(store):
+    assert [(row['period'], row['subsidiaries'], row['entries']) for row in list_periods(store)] == [('2024', 2, 4), ('2025', 2, 4)]
+    assert scope_totals(store, period = '2025', subsidiary = 'Bolag A AB') == [
+        {'period': '2025', 'scope': 'Scope 1', 'total': 80.0, 'entries': 2, 'numeric entries': 1},
+        {'period': '2025', 'scope': 'Scope 3', 'total': 1500.0, 'entries': 1, 'numeric entries': 1}
+    ]
+    assert year_over_year(store, '2025') == [
+        {'scope': 'Scope 1', 'current': 130.0, 'previous': 140.0, 'delta': -10.0, 'change': pytest.approx(-10 / 140)},
+        {'scope': 'Scope 3', 'current': 1500.0, 'previous': 1500.0, 'delta': 0.0, 'change': 0.0}
+    ]
+    assert [(row['subsidiary'], row['current'], row['previous']) for row in year_over_year(store, '2025', by = 'subsidiary') if row['scope'] == 'Scope 1'] == \
+        [('Bolag A AB', 80.0, 100.0), ('Bolag B AB', 50.0, 40.0)]
+    assert year_over_year(store, '2024') == []
+    assert missing_entries(store, '2025') == [
+        {'subsidiary': 'Bolag A AB', 'scope': 'Scope 1', 'label': 'Bensin (liter)', 'reason': 'empty'},
+        {'subsidiary': 'Bolag A AB', 'scope': 'Scope 3', 'label': 'Taxi (kr)', 'reason': 'not reported'}
+    ]
+    assert missing_entries(store, '2025', subsidiary = 'Bolag B AB') == []
+    with pytest.raises(ValueError):
+        year_over_year(store, '2025', by = 'office')
+
+
+def test_command_line(store, tmp_path, capsys):
+    assert main(['--store', store, '--json', 'yoy', '2025', '--by', 'label']) == 0
+    rows = json.loads(capsys.readouterr().out)
+    assert {'subsidiary': 'Bolag A AB', 'scope': 'Scope 3', 'label': 'Taxi (kr)', 'current': None, 'previous': 500.0, 'delta': None, 'change': None} in rows
+
+    assert main(['--store', store, 'totals', '--period', '2024']) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split() == ['period', 'scope', 'total', 'entries', 'numeric', 'entries']
+    assert lines[1].split() == ['2024', 'Scope', '1', '140.000', '2', '2']
+
+    assert main(['--store', store, 'missing', '2024']) == 0
+    assert capsys.readouterr().out == '(no rows)\n'
+
+    # A query never creates the store
+    assert main(['--store', str(tmp_path / 'missing.sqlite'), 'periods']) == 1
+    assert 'No history store' in capsys.readouterr().err
+    assert not (tmp_path / 'missing.sqlite').exists()
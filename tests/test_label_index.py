@@ -0,0 +1,122 @@
+import random
+
+import pytest
+
+from openpyxl import Workbook
+
+from utils.label_index import build_label_index, build_label_index_from_rows, find_label_matches, build_trigram_index, suggest_labels, _trigrams
+
+
+def naive_matches(rows, labels):
+    # What write_data_to_summary used to do: scan every cell for every label
+    matches = {}
+    for label in labels:
+        cells = [
+            (row, col) for row, values in enumerate(rows, start = 1) for col, value in enumerate(values, start = 1)
+            if value is not None and str(label) in (value.strip() if isinstance(value, str) else str(value))
+        ]
+        if len(cells) > 0:
+            matches[label] = {'count': len(cells), 'first': cells[0], 'last': cells[-1]}
+    return matches
+
+
+def test_build_label_index():
+    wb = Workbook()
+    ws = wb.active
+    ws['B2'] = ' Diesel (liter) '
+    ws['B5'] = 'Diesel (liter)'
+    ws['C5'] = 12
+    ws['A7'] = 'Diesel (liter)'
+
+    label_index = build_label_index(ws)
+
+    assert label_index == {
+        'Diesel (liter)': {'positions': [(2, 2), (5, 2), (7, 1)], 'first': (2, 2), 'last': (7, 1)},
+        '12': {'positions': [(5, 3)], 'first': (5, 3), 'last': (5, 3)}
+    }
+
+
+def test_find_label_matches_overlapping_labels():
+    rows = [
+        [None, 'El (kWh)', None],
+        [None, 'Förnybar el (kWh)', 'El'],
+        ['Diesel (liter)', 2025, None]
+    ]
+    labels = ['El', 'el (kWh)', 'Diesel (liter)', 2025, 'Saknas', '']
+
+    matches = find_label_matches(build_label_index_from_rows(rows), labels)
+
+    assert matches == naive_matches(rows, labels)
+    assert matches['El'] == {'count': 2, 'first': (1, 2), 'last': (2, 3)}
+    assert 'Saknas' not in matches
+    assert matches[''] == {'count': 5, 'first': (1, 2), 'last': (3, 2)}
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_find_label_matches_matches_naive_scan(seed):
+    rng = random.Random(seed)
+    words = ['el', 'El', 'gas', 'Gasol', 'kWh', '(liter)', 'diesel', 'HVO', '1', '10']
+    rows = [
+        [rng.choice([None, None, ' '.join(rng.sample(words, rng.randint(1, 3))), rng.randint(0, 20)]) for _ in range(rng.randint(0, 5))]
+        for _ in range(rng.randint(1, 15))
+    ]
+    labels = [' '.join(rng.sample(words, rng.randint(1, 2))) for _ in range(8)] + [rng.randint(0, 20) for _ in range(3)]
+
+    assert find_label_matches(build_label_index_from_rows(rows), labels) == naive_matches(rows, labels)
+
+
+def dice_suggestions(label_index, label, top_k, min_score):
+    # Score every text label of the sheet that shares a trigram with the label, without the postings and the overlap bound
+    trigrams = _trigrams(str(label).strip())
+    suggestions = []
+    for text, entry in label_index.items():
+        if not any(char.isalpha() for char in text) or len(trigrams & _trigrams(text)) == 0:
+            continue
+        score = 2 * len(trigrams & _trigrams(text)) / (len(trigrams) + len(_trigrams(text)))
+        if score >= min_score:
+            suggestions.append((text, round(score, 3), entry['first']))
+    suggestions.sort(key = lambda suggestion: (-suggestion[1], suggestion[2]))
+    return suggestions[:top_k]
+
+
+def test_build_trigram_index():
+    rows = [
+        ['Diesel (liter)', 12, '2025'],
+        [None, 'Bensin (liter)', 'Diesel (liter)']
+    ]
+
+    trigram_index = build_trigram_index(build_label_index_from_rows(rows))
+
+    # Cells without letters are left out
+    assert trigram_index['labels'] == ['Diesel (liter)', 'Bensin (liter)']
+    assert trigram_index['positions'] == [(1, 1), (2, 2)]
+    assert trigram_index['trigrams'][0] == _trigrams('diesel liter')
+    assert sorted(trigram_index['postings'][' li']) == [0, 1]
+    assert trigram_index['postings'][' di'] == [0]
+
+
+def test_suggest_labels():
+    rows = [['Diesel (liter)'], ['Bensin (liter)'], ['Dieselolja (m3)'], ['Naturgas (m3)']]
+    trigram_index = build_trigram_index(build_label_index_from_rows(rows))
+
+    suggestions = suggest_labels(trigram_index, 'Diesel liter', top_k = 2, min_score = 0.3)
+
+    assert [text for text, _, _ in suggestions] == ['Diesel (liter)', 'Bensin (liter)']
+    assert suggestions[0][1:] == (1.0, (1, 1))
+    assert suggest_labels(trigram_index, 'Diesel liter', top_k = 0) == []
+    assert suggest_labels(trigram_index, ' (12) ') == []
+    assert suggest_labels(trigram_index, 'Flygresor (km)') == []
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_suggest_labels_matches_scoring_every_label(seed):
+    rng = random.Random(seed)
+    words = ['el', 'El', 'gas', 'Gasol', 'kWh', '(liter)', 'diesel', 'HVO', 'Fjärrvärme', 'Köldmedia', 'R410A', '10']
+    rows = [[rng.choice([None, ' '.join(rng.sample(words, rng.randint(1, 3))), rng.randint(0, 20)]) for _ in range(3)] for _ in range(10)]
+    label_index = build_label_index_from_rows(rows)
+    trigram_index = build_trigram_index(label_index)
+
+    for _ in range(5):
+        label = ' '.join(rng.sample(words, rng.randint(1, 3)))
+        top_k, min_score = rng.randint(1, 5), rng.choice([0.0, 0.2, 0.3, 0.5, 0.8])
+        assert suggest_labels(trigram_index, label, top_k = top_k, min_score = min_score) == dice_suggestions(label_index, label, top_k, min_score)
@@ -0,0 +1,84 @@
+import json
+import logging
+
+import pytest
+
+from utils.log import configure_logging, log_warning_summary, RepeatedWarningFilter, TextFormatter
+
+
+@pytest.fixture
+def run_logger():
+    root_logger = logging.getLogger()
+    level = root_logger.level
+    yield logging.getLogger('tests.run')
+    for handler in list(root_logger.handlers):
+        if getattr(handler, '_excel_env_handler', False):
+            root_logger.removeHandler(handler)
+    root_logger.setLevel(level)
+
+
+def make_record(msg, args = (), level = logging.WARNING, **extra):
+    record = logging.LogRecord('tests', level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_filter_shows_exactly_max_repeats():
+    repeated_warning_filter = RepeatedWarningFilter(3)
+    formatter = TextFormatter('%(message)s', notes = repeated_warning_filter)
+    records = [make_record('No match for %s', (index,)) for index in range(5)]
+
+    shown = [formatter.format(record) for record in records if repeated_warning_filter.filter(record)]
+
+    assert shown[:2] == ['No match for 0', 'No match for 1']
+    assert shown[2].startswith('No match for 2 (further "No match for %s" warnings are only counted')
+    assert len(shown) == 3
+    # The record is not changed, and the note is only added once
+    assert records[2].getMessage() == 'No match for 2'
+    assert formatter.format(records[2]) == 'No match for 2'
+
+
+def test_filter_counts_per_kind():
+    repeated_warning_filter = RepeatedWarningFilter(1)
+
+    assert repeated_warning_filter.filter(make_record('first %s', ('a',), event = 'mismatch'))
+    assert not repeated_warning_filter.filter(make_record('second %s', ('b',), event = 'mismatch'))
+    assert repeated_warning_filter.filter(make_record('first %s', ('a',)))
+    assert repeated_warning_filter.filter(make_record('other'))
+    # Other levels and the summary are always shown
+    assert repeated_warning_filter.filter(make_record('error', level = logging.ERROR, event = 'mismatch'))
+    assert repeated_warning_filter.filter(make_record('info', level = logging.INFO, event = 'mismatch'))
+    assert repeated_warning_filter.counts == {'mismatch': 2, 'first %s': 1, 'other': 1}
+
+
+def test_text_log_and_summary(run_logger, capsys):
+    configure_logging({"Log level": "INFO", "Repeated warnings shown": 2})
+    for index in range(4):
+        run_logger.warning('No match for %s', index, extra = {'event': 'mismatch'})
+    run_logger.debug('not shown')
+
+    counts = log_warning_summary(run_logger)
+
+    lines = capsys.readouterr().err.splitlines()
+    assert counts == {'mismatch': 4}
+    assert lines[0] == 'WARNING [test_text_log_and_summary] No match for 0'
+    assert lines[1].startswith('WARNING [test_text_log_and_summary] No match for 1 (further "mismatch" warnings')
+    assert lines[2] == 'WARNING [log_warning_summary] Run finished with 4 warnings (mismatch: 4)'
+    assert len(lines) == 3
+
+
+def test_json_log(run_logger, capsys):
+    configure_logging({"Log format": "json", "Repeated warnings shown": 1})
+    run_logger.warning('Could not read %s', 'a.xlsx', extra = {'event': 'unreadable input file', 'data': {'file': 'a.xlsx'}})
+    run_logger.warning('Could not read %s', 'b.xlsx', extra = {'event': 'unreadable input file', 'data': {'file': 'b.xlsx'}})
+    log_warning_summary(run_logger)
+
+    entries = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+
+    assert len(entries) == 2
+    assert entries[0]['message'] == 'Could not read a.xlsx'
+    assert entries[0]['event'] == 'unreadable input file'
+    assert entries[0]['data'] == {'file': 'a.xlsx'}
+    assert 'only counted' in entries[0]['note']
+    assert entries[1]['data'] == {'warnings': {'unreadable input file': 2}}
+    assert 'note' not in entries[1]
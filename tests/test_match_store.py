@@ -0,0 +1,134 @@
+import logging
+
+import pytest
+
+from utils.match_store import load_match_store, save_match_store, get_match_candidates, get_pins, MATCH_STORE_VERSION, TOP_K, MARGIN
+from utils.util import match_lists
+
+
+ITEMS = ['Bolag A AB', 'Bolag B AB', 'Energi Norr AB', 'Fastighet Syd AB', 'Holding AB']
+SHEETS = ['Bolag A', 'Bolag B', 'Energi Norr', 'Fastighet Syd', 'Holding', 'Övrigt']
+
+
+def fresh_candidates(items, sheets):
+    from utils.matching import find_top_candidates
+    sorted_sheets = sorted(set(sheets))
+    return {
+        item: [(sorted_sheets[j], pytest.approx(score)) for j, score in item_candidates]
+        for item, item_candidates in zip(items, find_top_candidates(items, sorted_sheets, top_k = TOP_K, margin = MARGIN))
+    }
+
+
+def empty_store(tmp_path):
+    return load_match_store(str(tmp_path / 'missing.json'))
+
+
+def no_matching(*args, **kwargs):
+    raise AssertionError('find_top_candidates should not be called')
+
+
+def test_store_round_trip(tmp_path, monkeypatch):
+    store_path = str(tmp_path / 'match_store.json')
+    store = load_match_store(store_path)
+    store['pins']['Holding AB'] = 'Övrigt'
+    candidates = get_match_candidates(store, ITEMS, SHEETS)
+    save_match_store(store, store_path)
+
+    loaded = load_match_store(store_path)
+
+    assert loaded == store
+    assert loaded['version'] == MATCH_STORE_VERSION
+    assert candidates == fresh_candidates(ITEMS, SHEETS)
+    # Unchanged items and sheets are served from the store without any matching
+    monkeypatch.setattr('utils.matching.find_top_candidates', no_matching)
+    assert get_match_candidates(loaded, ITEMS, SHEETS) == candidates
+    assert not (tmp_path / 'match_store.json.tmp').exists()
+
+
+def test_outdated_store_keeps_pins(tmp_path, caplog):
+    store_path = tmp_path / 'match_store.json'
+    store_path.write_text('{"version": %d, "pins": {"Holding AB": "Övrigt"}, "sheets": ["Bolag A"], "candidates": {"Bolag A AB": [["Bolag A", 0.9]]}}'
+                          % (MATCH_STORE_VERSION - 1), encoding = 'utf-8')
+
+    assert load_match_store(str(store_path)) == {'version': MATCH_STORE_VERSION, 'pins': {'Holding AB': 'Övrigt'}, 'sheets': [], 'candidates': {}}
+
+    store_path.write_text('{not json', encoding = 'utf-8')
+    with caplog.at_level(logging.WARNING, logger = 'utils.match_store'):
+        assert load_match_store(str(store_path))['pins'] == {}
+    assert 'Could not read' in caplog.text
+
+
+def test_added_sheets_are_only_matched_against_the_stored_items(tmp_path, monkeypatch):
+    store = empty_store(tmp_path)
+    get_match_candidates(store, ITEMS, SHEETS[:4])
+
+    added = []
+    from utils import matching
+    find_top_candidates = matching.find_top_candidates
+
+    def recording_find_top_candidates(list_1, list_2, **kwargs):
+        added.append(list(list_2))
+        return find_top_candidates(list_1, list_2, **kwargs)
+    monkeypatch.setattr(matching, 'find_top_candidates', recording_find_top_candidates)
+
+    candidates = get_match_candidates(store, ITEMS, SHEETS)
+
+    assert added == [['Holding', 'Övrigt']]
+    assert candidates == fresh_candidates(ITEMS, SHEETS)
+    assert store['sheets'] == sorted(SHEETS)
+
+
+def test_removed_sheet_recomputes_its_items(tmp_path):
+    store = empty_store(tmp_path)
+    get_match_candidates(store, ITEMS, SHEETS)
+    sheets = [sheet for sheet in SHEETS if sheet != 'Energi Norr'] + ['Energi Nord']
+
+    candidates = get_match_candidates(store, ITEMS, sheets)
+
+    assert candidates == fresh_candidates(ITEMS, sheets)
+    assert candidates['Energi Norr AB'][0][0] == 'Energi Nord'
+
+
+def test_items_not_asked_for_are_dropped_when_the_sheets_change(tmp_path):
+    store = empty_store(tmp_path)
+    get_match_candidates(store, ITEMS, SHEETS)
+
+    get_match_candidates(store, ITEMS[:2], SHEETS[:3])
+
+    assert sorted(store['candidates']) == ITEMS[:2]
+
+
+def test_invalid_pins_are_reported(tmp_path, caplog):
+    store = empty_store(tmp_path)
+    store['pins'] = {'Bolag A AB': 'Saknas', 'Bolag B AB': 'Holding', 'Holding AB': 'Holding', 'Energi Norr AB': 'Energi Norr'}
+
+    with caplog.at_level(logging.WARNING, logger = 'utils.match_store'):
+        pins = get_pins(store, ITEMS, SHEETS)
+
+    assert pins == {'Bolag B AB': 'Holding', 'Energi Norr AB': 'Energi Norr'}
+    assert [record.event for record in caplog.records] == ['invalid pin', 'invalid pin']
+    assert 'does not exist' in caplog.records[0].getMessage()
+    assert 'already pinned' in caplog.records[1].getMessage()
+
+
+def test_match_lists_with_a_store_matches_without_one(tmp_path):
+    expected = match_lists(ITEMS, SHEETS, filter_doubles = True)
+    store = empty_store(tmp_path)
+
+    # First run, the same run again, and a run with changed sheets
+    assert match_lists(ITEMS, SHEETS, filter_doubles = True, store = store) == expected
+    assert match_lists(ITEMS, SHEETS, filter_doubles = True, store = store) == expected
+    sheets = SHEETS[1:] + ['Bolag  A']
+    assert match_lists(ITEMS, sheets, filter_doubles = True, store = store) == match_lists(ITEMS, sheets, filter_doubles = True)
+
+
+def test_pinned_items_are_matched_to_their_sheet(tmp_path):
+    store = empty_store(tmp_path)
+    store['pins'] = {'Holding AB': 'Övrigt'}
+
+    matches = match_lists(ITEMS, SHEETS, filter_doubles = True, store = store)
+
+    assert matches['Holding AB'] == {'match': 'Övrigt', 'score': 1.0}
+    assert 'Övrigt' not in [matches[item]['match'] for item in ITEMS if item != 'Holding AB']
+    # The other items are assigned among the remaining sheets
+    assert {item: matches[item] for item in ITEMS[:4]} == match_lists(ITEMS[:4], SHEETS[:5], filter_doubles = True)
@@ -0,0 +1,83 @@
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+from utils.matching import assign_matches, _linear_sum_assignment
+from utils.util import match_lists
+
+
+def best_total(weights):
+    # Brute force over every one-to-one assignment of the smaller side
+    n, m = weights.shape
+    if n <= m:
+        return max(sum(weights[i, j] for i, j in enumerate(cols)) for cols in itertools.permutations(range(m), n))
+    return best_total(weights.T)
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_linear_sum_assignment_is_optimal(seed):
+    rng = np.random.default_rng(seed)
+    n, m = rng.integers(1, 7, size = 2)
+    # Few distinct values, so that there are ties
+    weights = rng.integers(0, 5, size = (n, m)).astype(float) / 4
+
+    rows, cols = _linear_sum_assignment(-weights)
+
+    assert len(rows) == min(n, m)
+    assert len(set(rows)) == len(rows) and len(set(cols)) == len(cols)
+    assert weights[rows, cols].sum() == pytest.approx(best_total(weights))
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_linear_sum_assignment_matches_scipy(seed):
+    scipy_optimize = pytest.importorskip('scipy.optimize')
+    rng = np.random.default_rng(seed)
+    cost = rng.random(size = tuple(rng.integers(1, 9, size = 2)))
+
+    rows, cols = _linear_sum_assignment(cost)
+    expected_rows, expected_cols = scipy_optimize.linear_sum_assignment(cost)
+
+    assert cost[rows, cols].sum() == pytest.approx(cost[expected_rows, expected_cols].sum())
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_assign_matches_is_optimal(seed):
+    rng = random.Random(seed)
+    n, m = rng.randint(1, 6), rng.randint(1, 6)
+    min_score = 0.3
+    candidates = [
+        [(j, round(rng.random(), 2)) for j in sorted(rng.sample(range(m), rng.randint(0, m)))]
+        for _ in range(n)
+    ]
+
+    assignment = assign_matches(candidates, min_score = min_score)
+
+    weights = np.zeros((n, m))
+    for i, candidate in enumerate(candidates):
+        for j, score in candidate:
+            if score >= min_score:
+                weights[i, j] = score
+    assert len({j for j, _ in assignment.values()}) == len(assignment)
+    assert all(dict(candidates[i])[j] == score and score >= min_score for i, (j, score) in assignment.items())
+    assert sum(score for _, score in assignment.values()) == pytest.approx(best_total(weights))
+
+
+def test_assign_matches_beats_greedy():
+    # Greedy in input order gives item 0 the sheet that item 1 needs, the assignment does not
+    candidates = [[(0, 0.9), (1, 0.8)], [(0, 0.85), (1, 0.1)]]
+
+    assert assign_matches(candidates) == {0: (1, 0.8), 1: (0, 0.85)}
+
+
+def test_match_lists_does_not_depend_on_order():
+    folders = ['Nordic Bygg AB', 'Nordic Bygg Data AB', 'Miljö Handel AB', 'Verkstad Teknik AB']
+    sheets = ['Nordic Bygg', 'Nordic Bygg Data', 'Miljö Handel', 'Verkstad Teknik', 'Summering']
+    expected = match_lists(folders, sheets, filter_doubles = True)
+
+    for seed in range(5):
+        rng = random.Random(seed)
+        shuffled_folders = rng.sample(folders, len(folders))
+        shuffled_sheets = rng.sample(sheets, len(sheets))
+        assert match_lists(shuffled_folders, shuffled_sheets, filter_doubles = True) == expected
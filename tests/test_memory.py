@@ -0,0 +1,96 @@
+import json
+import logging
+import tracemalloc
+
+import pytest
+
+from utils.memory import plan_reads, estimate_read_memory, start_memory_report, measure_stage, measure_file_read, add_file_stats, save_memory_report, \
+    MEMORY_OVERHEAD
+
+
+def write_file(file_path, size):
+    file_path.write_bytes(b'x' * size)
+    return str(file_path)
+
+
+@pytest.fixture
+def memory_report():
+    # tracemalloc slows everything down, so it is stopped again if the test started it
+    tracing = tracemalloc.is_tracing()
+    yield start_memory_report({"Memory report": True, "Memory budget (MB)": 1})
+    if not tracing:
+        tracemalloc.stop()
+
+
+def test_estimate_read_memory(tmp_path):
+    file_path = write_file(tmp_path / 'data.xlsx', 1000)
+
+    assert estimate_read_memory(file_path, False, 'openpyxl') == MEMORY_OVERHEAD + 60 * 1000
+    assert estimate_read_memory(file_path, True, 'openpyxl') == MEMORY_OVERHEAD + 15 * 1000
+    # Unknown backends are estimated as non-streaming openpyxl, and a missing file needs nothing
+    assert estimate_read_memory(file_path, True, 'other') == MEMORY_OVERHEAD + 60 * 1000
+    assert estimate_read_memory(str(tmp_path / 'missing.xlsx'), False, 'openpyxl') == 0
+
+
+def test_no_budget_changes_nothing(tmp_path):
+    file_paths = [write_file(tmp_path / 'data.xlsx', 10**6)]
+
+    assert plan_reads(file_paths, 4, False, 'openpyxl', 0) == (4, set())
+    assert plan_reads([], 4, False, 'openpyxl', 2**20) == (4, set())
+
+
+def test_large_files_are_streamed_and_workers_lowered(tmp_path):
+    # Estimates: 1.6 MB per small file, 7 MB per large file, or 2.5 MB with streaming reads
+    small = [write_file(tmp_path / f'small {index}.xlsx', 10 * 2**10) for index in range(2)]
+    large = [write_file(tmp_path / f'large {index}.xlsx', 100 * 2**10) for index in range(2)]
+
+    # The large files are over their share of 2 MB, and the four files together are over the budget
+    assert plan_reads(small + large, 4, False, 'openpyxl', 8 * 2**20) == (3, set(large))
+    # Already streaming, so only the workers are lowered
+    assert plan_reads(small + large, 4, True, 'openpyxl', 8 * 2**20) == (4, set())
+    assert plan_reads(small + large, 4, False, 'openpyxl', 4 * 2**20) == (1, set(small + large))
+
+
+def test_file_over_budget_is_reported(tmp_path, caplog):
+    file_path = write_file(tmp_path / 'large.xlsx', 100 * 2**10)
+
+    with caplog.at_level(logging.WARNING, logger = 'utils.memory'):
+        assert plan_reads([file_path], 1, False, 'openpyxl', 2 * 2**20) == (1, {file_path})
+
+    assert [record.event for record in caplog.records] == ['over memory budget']
+    assert caplog.records[0].data == {'file': file_path}
+
+
+def test_memory_report(tmp_path, memory_report, caplog):
+    file_path = write_file(tmp_path / 'data.xlsx', 1000)
+    settings = {"Output file folder path": str(tmp_path), "Memory report file name": 'report.json'}
+
+    with measure_stage(memory_report, 'small'):
+        [0] * 1000
+    with measure_stage(memory_report, 'large'):
+        data = bytearray(4 * 2**20)
+    del data
+    scope_data, warning, stats = measure_file_read(lambda file_path, streaming: ({'Scope 1': {'Diesel (liter)': 10}}, None), file_path, True)
+    add_file_stats(memory_report, file_path, stats)
+    with caplog.at_level(logging.WARNING, logger = 'utils.memory'):
+        report_path = save_memory_report(memory_report, settings)
+
+    with open(report_path, encoding = 'utf-8') as f:
+        report = json.load(f)
+    assert (scope_data, warning) == ({'Scope 1': {'Diesel (liter)': 10}}, None)
+    assert (stats['bytes read'], stats['keys extracted'], stats['streaming']) == (1000, 1, True)
+    assert list(report['stages']) == ['small', 'large']
+    assert report['stages']['large']['tracemalloc peak (MB)'] >= 4
+    # Only what the report is about is saved for a file
+    assert list(report['files'][file_path]) == ['size (MB)', 'streaming', 'seconds', 'rss after (MB)', 'peak rss (MB)', 'tracemalloc peak (MB)']
+    assert report['over budget'] == ['large']
+    assert 'more than the memory budget' in caplog.text
+
+
+def test_no_memory_report(tmp_path):
+    assert start_memory_report({"Memory report": False}) is None
+    with measure_stage(None, 'stage'):
+        pass
+    add_file_stats(None, 'data.xlsx', {})
+    assert save_memory_report(None, {"Output file folder path": str(tmp_path), "Memory report file name": 'report.json'}) is None
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,77 @@
+import os
+import json
+import logging
+
+import pytest
+
+from openpyxl import load_workbook
+
+import utils.util as utils
+from utils.pipeline import run_pipeline
+from benchmarks.corpus import generate_corpus
+
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    # The special cases are read from scope_2_dict.json in the working directory
+    monkeypatch.chdir(REPO_PATH)
+    with open('settings.json', encoding = 'utf-8') as f:
+        settings = json.load(f)
+    # Fewer summary sheets than subsidiaries, so that some entries end up in "Mismatched Data"
+    corpus = generate_corpus(str(tmp_path), subsidiaries = 6, summary_sheets = 5, extra_labels = 5, offices = 2, settings = settings)
+    settings["Input file folder path"] = corpus['input folder path']
+    settings["Output file folder path"] = corpus['output folder path']
+    settings["Ingestion workers"] = 2
+    settings["Generate missing write data"] = False # Random values
+    settings["Parse cache file name"] = str(tmp_path / 'parse_cache.pkl')
+    return settings
+
+
+def run(settings, output_file_name):
+    settings = dict(settings, **{"Output file name": output_file_name})
+    input_files = utils.discover_input_files(path = settings["Input file folder path"], settings = settings)
+    input_file_paths = [file_path for file_paths in input_files.values() for file_path in file_paths]
+    wb = utils.excel_to_workbook(os.path.join(settings["Output file folder path"], settings["Summary file name"]))
+    summary_sheets = wb.sheetnames
+    wb.create_sheet("Mismatched Data")
+    matches = utils.match_lists(list(input_files.keys()), summary_sheets, filter_doubles = True)
+
+    if settings.get("Pipelined run", False):
+        run_pipeline(input_file_paths, matches, wb = wb, settings = settings)
+    else:
+        input_data = utils.get_input_data(input_file_paths, matches, settings = settings)
+        utils.write_data_to_summary(data_dict = input_data, wb = wb, matches = matches, settings = settings)
+    return sheet_values(os.path.join(settings["Output file folder path"], output_file_name))
+
+
+def sheet_values(file_path):
+    wb = load_workbook(file_path)
+    return {ws.title: [[cell.value for cell in row] for row in ws.iter_rows()] for ws in wb}
+
+
+def test_pipelined_run_matches_serial_run(corpus):
+    expected = run(corpus, 'serial.xlsx')
+
+    assert run(dict(corpus, **{"Pipelined run": True}), 'pipelined.xlsx') == expected
+    assert len(expected["Mismatched Data"]) > 1
+
+
+def test_pipelined_run_from_parse_cache(corpus, monkeypatch):
+    expected = run(dict(corpus, **{"Use parse cache": True}), 'serial.xlsx')
+
+    # Every file is served from the cache, so no extract processes are started
+    def no_pool(*args, **kwargs):
+        raise AssertionError('The process pool was started')
+    monkeypatch.setattr('concurrent.futures.ProcessPoolExecutor', no_pool)
+
+    assert run(dict(corpus, **{"Pipelined run": True, "Use parse cache": True}), 'pipelined.xlsx') == expected
+
+
+def test_pipelined_run_warns_about_sharded_summary(corpus, caplog):
+    with caplog.at_level(logging.WARNING, logger = 'utils.pipeline'):
+        run(dict(corpus, **{"Pipelined run": True, "Sharded summary": True}), 'pipelined.xlsx')
+
+    assert '"Sharded summary" is not used' in caplog.text
@@ -0,0 +1,88 @@
+import json
+import pstats
+import threading
+
+from openpyxl import Workbook
+from openpyxl.styles import PatternFill
+
+from utils.profiling import count_scanned_cells, scanned_cells, start_run_report, profile_stage, add_file_profile, add_cached_file, save_run_report, \
+    SLOWEST_COUNT
+from utils.util import get_input_data, KEY_COLOR
+
+
+def test_scanned_cells_are_counted_per_thread():
+    before = scanned_cells()
+    count_scanned_cells(10)
+    counts = []
+    thread = threading.Thread(target = lambda: (count_scanned_cells(3), counts.append(scanned_cells())))
+    thread.start()
+    thread.join()
+
+    assert scanned_cells() == before + 10
+    assert counts == [3]
+
+
+def test_no_run_report(tmp_path):
+    report = start_run_report({"Run report": False})
+    with profile_stage(report, 'stage'):
+        pass
+    add_file_profile(report, 'data.xlsx', {'seconds': 1})
+    add_cached_file(report, 'data.xlsx')
+
+    assert report is None
+    assert save_run_report(report, {"Output file folder path": str(tmp_path), "Run report file name": 'report.json'}) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_run_report_totals_and_slowest(tmp_path):
+    settings = {"Run report": True, "Output file folder path": str(tmp_path), "Run report file name": 'report.json'}
+    report = start_run_report(settings)
+    with profile_stage(report, 'read input'):
+        for index in range(SLOWEST_COUNT + 2):
+            add_file_profile(report, f'data {index}.xlsx', {'seconds': index, 'bytes read': 100, 'cells scanned': 10, 'keys extracted': 2, 'streaming': True, 'rss after (MB)': 1})
+        add_cached_file(report, 'cached.xlsx')
+    report['subsidiaries']['Bolag A AB'] = {'sheet': 'Bolag A', 'seconds': 0.5, 'entries': 4, 'writes': 3, 'mismatch': 1}
+
+    file_path = save_run_report(report, settings)
+
+    with open(file_path, encoding = 'utf-8') as f:
+        saved = json.load(f)
+    assert list(saved['stages']) == ['read input']
+    assert 'profile' not in saved['stages']['read input']
+    # Only the fields of the run report are kept for a file, and flags and times are not summed
+    assert saved['files']['data 0.xlsx'] == {'seconds': 0, 'bytes read': 100, 'cells scanned': 10, 'keys extracted': 2, 'streaming': True}
+    assert saved['files']['cached.xlsx'] == {'cached': True}
+    assert saved['totals'] == {'bytes read': 1200, 'cells scanned': 120, 'keys extracted': 24, 'entries': 4, 'writes': 3, 'mismatch': 1}
+    assert [entry['name'] for entry in saved['slowest files']] == [f'data {index}.xlsx' for index in range(SLOWEST_COUNT + 1, 1, -1)]
+    assert saved['slowest subsidiaries'] == [{'name': 'Bolag A AB', 'seconds': 0.5}]
+
+
+def test_profiled_stage(tmp_path):
+    report = start_run_report({"Run report": True, "Run report profile": True, "Output file folder path": str(tmp_path)})
+
+    with profile_stage(report, 'match'):
+        sorted(range(1000), key = str)
+
+    assert report['stages']['match']['profile'] == str(tmp_path / 'Run report match.prof')
+    assert pstats.Stats(report['stages']['match']['profile']).total_calls > 0
+
+
+def test_file_read_counters(tmp_path):
+    wb = Workbook()
+    ws = wb.create_sheet('Scope 1 & 2')
+    for row, (label, value) in enumerate([('Diesel (liter)', 10), ('Bensin (liter)', 5)], start = 2):
+        ws.cell(row = row, column = 2).value = label
+        ws.cell(row = row, column = 3).value = value
+        ws.cell(row = row, column = 3).fill = PatternFill('solid', start_color = KEY_COLOR)
+    (tmp_path / 'Bolag A AB').mkdir()
+    file_path = str(tmp_path / 'Bolag A AB' / 'data.xlsx')
+    wb.save(file_path)
+    report = start_run_report({"Run report": True})
+
+    get_input_data([file_path], {'Bolag A AB': {'match': 'Bolag A', 'score': 0.9}}, settings = {}, run_report = report)
+
+    stats = report['files'][file_path]
+    assert stats['keys extracted'] == 2
+    assert stats['cells scanned'] >= 4
+    assert stats['streaming'] is False
+    assert stats['bytes read'] > 0
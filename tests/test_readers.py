@@ -0,0 +1,168 @@
+import zipfile
+import tracemalloc
+
+import pytest
+
+from openpyxl import Workbook
+from openpyxl.styles import PatternFill
+
+from utils import xlsx_reader
+from utils.util import READER_BACKENDS, KEY_COLOR
+
+
+KEY_FILL = PatternFill('solid', start_color = KEY_COLOR)
+OTHER_FILL = PatternFill('solid', start_color = 'FFFFFF00')
+
+# (backend, streaming) pairs that must give the same scope data
+READERS = [("openpyxl", False), ("openpyxl", True), ("xml", False)]
+
+
+def read_scope_data(file_path, backend, streaming):
+    return {sheet: (dict(data), data.cells) for sheet, data in READER_BACKENDS[backend](str(file_path), streaming)}
+
+
+def save_workbook(wb, tmp_path):
+    file_path = tmp_path / 'subsidiary.xlsx'
+    wb.save(file_path)
+    return file_path
+
+
+def build_triplets(wb):
+    ws = wb.active
+    ws.title = 'Scope 1'
+    # o x o -> key is in the previous cell
+    ws['B2'] = 'Diesel (liter) '
+    ws['C2'] = 120
+    ws['C2'].fill = KEY_FILL
+    # o x x -> key is in the next cell
+    ws['B3'] = 'ignored'
+    ws['C3'] = 4.5
+    ws['C3'].fill = KEY_FILL
+    ws['D3'] = 'Bensin (liter)'
+    ws['D3'].fill = KEY_FILL
+    # x x o -> skipped, the previous cell is the value of another key
+    ws['B4'] = 'HVO100 (liter)'
+    ws['C4'] = 1
+    ws['C4'].fill = KEY_FILL
+    ws['D4'].fill = KEY_FILL
+    ws['E4'] = 'not a key'
+    # o x o with an empty value
+    ws['B5'] = 'El (kWh)'
+    ws['C5'].fill = KEY_FILL
+    # Other fills are not key-colored
+    ws['B6'] = 'Gas (m3)'
+    ws['C6'] = 9
+    ws['C6'].fill = OTHER_FILL
+    # Repeated keys keep every occurrence
+    ws['B7'] = 'Diesel (liter)'
+    ws['C7'] = '=C2*2'
+    ws['C7'].fill = KEY_FILL
+    wb.create_sheet('Info')['C2'] = 'not a scope sheet'
+    return wb
+
+
+@pytest.mark.parametrize('backend, streaming', READERS)
+def test_triplet_rules(tmp_path, backend, streaming):
+    file_path = save_workbook(build_triplets(Workbook()), tmp_path)
+
+    data, cells = read_scope_data(file_path, backend, streaming)['Scope 1']
+
+    assert data == {'Diesel (liter)': '=C2*2', 'Bensin (liter)': 4.5, 'HVO100 (liter)': 1, 'El (kWh)': None}
+    assert cells == {'Diesel (liter)': 'C7', 'Bensin (liter)': 'C3', 'HVO100 (liter)': 'C4', 'El (kWh)': 'C5'}
+
+
+def build_merged(wb):
+    ws = wb.active
+    ws.title = 'Scope 2'
+    ws['B5'] = 'Diesel (liter)'
+    ws['C5'] = 12
+    ws['C5'].fill = KEY_FILL
+    # The key-colored cell inside the merged range is not a value cell
+    ws['B11'] = 'Merged key'
+    ws['D11'] = 'x'
+    ws.merge_cells('B11:C11')
+    ws['C11'].fill = KEY_FILL
+    # The top-left cell of a merged range keeps its value and fill
+    ws['B12'] = 'Merged value'
+    ws['C12'] = 7
+    ws['C12'].fill = KEY_FILL
+    ws.merge_cells('C12:D13')
+    ws['D12'].fill = KEY_FILL
+    ws['C13'].fill = KEY_FILL
+    ws['B13'] = 'Merged row'
+    return wb
+
+
+@pytest.mark.parametrize('backend, streaming', READERS)
+def test_merged_cells(tmp_path, backend, streaming):
+    file_path = save_workbook(build_merged(Workbook()), tmp_path)
+
+    data, _ = read_scope_data(file_path, backend, streaming)['Scope 2']
+
+    assert data == {'Diesel (liter)': 12, 'Merged value': 7}
+
+
+@pytest.mark.parametrize('build', [build_triplets, build_merged])
+def test_readers_agree(tmp_path, build):
+    file_path = save_workbook(build(Workbook()), tmp_path)
+
+    results = [read_scope_data(file_path, backend, streaming) for backend, streaming in READERS]
+
+    assert all(result == results[0] for result in results[1:])
+
+
+def move_styles_part(file_path, styles_part):
+    # Rewrite the package with the styles part at another location, as some writers do
+    moved_path = file_path.with_name('moved.xlsx')
+    with zipfile.ZipFile(file_path) as source, zipfile.ZipFile(moved_path, 'w') as target:
+        for name in source.namelist():
+            data = source.read(name)
+            if name == 'xl/_rels/workbook.xml.rels':
+                data = data.replace(b'Target="styles.xml"', b'Target="' + styles_part.encode() + b'"')
+                data = data.replace(b'Target="/xl/styles.xml"', b'Target="/xl/' + styles_part.encode() + b'"')
+            elif name == '[Content_Types].xml':
+                data = data.replace(b'/xl/styles.xml', b'/xl/' + styles_part.encode())
+            target.writestr('xl/' + styles_part if name == 'xl/styles.xml' else name, data)
+    return moved_path
+
+
+def test_xml_reader_finds_styles_through_relationships(tmp_path):
+    file_path = move_styles_part(save_workbook(build_triplets(Workbook()), tmp_path), 'format/styles1.xml')
+
+    data, _ = read_scope_data(file_path, "xml", False)['Scope 1']
+
+    assert data == {'Diesel (liter)': '=C2*2', 'Bensin (liter)': 4.5, 'HVO100 (liter)': 1, 'El (kWh)': None}
+
+
+def test_xml_reader_finds_merged_cells_across_chunks(tmp_path, monkeypatch):
+    file_path = save_workbook(build_merged(Workbook()), tmp_path)
+    # Small enough to cut every tag
+    monkeypatch.setattr(xlsx_reader, '_CHUNK_SIZE', 7)
+
+    data, _ = read_scope_data(file_path, "xml", False)['Scope 2']
+
+    assert data == {'Diesel (liter)': 12, 'Merged value': 7}
+
+
+def test_xml_reader_memory_does_not_grow_with_the_sheet(tmp_path):
+    wb = Workbook(write_only = True)
+    ws = wb.create_sheet('Scope 1')
+    for row in range(20000):
+        ws.append([row, row * 1.5, None, row % 7])
+    file_path = tmp_path / 'large.xlsx'
+    wb.save(file_path)
+    with zipfile.ZipFile(file_path) as zf:
+        part_size = zf.getinfo('xl/worksheets/sheet1.xml').file_size
+
+    tracemalloc.start()
+    try:
+        rows = 0
+        for _, sheet_rows in xlsx_reader.iter_sheet_rows(zipfile.ZipFile(file_path), lambda sheet: True, KEY_COLOR):
+            for _ in sheet_rows:
+                rows += 1
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert rows == 20000
+    assert peak < part_size / 4
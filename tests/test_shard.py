@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+from openpyxl import Workbook, load_workbook
+
+from utils.util import compute_summary_writes, ScopeData
+from utils.shard import compute_summary_writes_sharded
+
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SUMMARY_SHEETS = {
+    'Bolag A': ['Diesel (liter)', 'Bensin (liter)', 'Flyg (km)', 'Flyg (km)'],
+    'Bolag B': ['Diesel (liter)', 'HVO100 (liter)', 'Tåg (km)'],
+    'Bolag C': ['Diesel (liter)', 'Fjärrvärme']
+}
+
+
+def scope_data(entries, repeats = None):
+    data = ScopeData(entries)
+    data.repeats.update(repeats or {})
+    return data
+
+
+def build_input():
+    data_dict = {
+        'Bolag A AB': {
+            'Scope 1 & 2': scope_data({'Diesel (liter)': 10, 'Bensin': 3, 'Okänd post': 1}),
+            'Scope 3': scope_data({'Flyg (km)': 1200})
+        },
+        'Bolag B AB': {
+            'Scope 1 & 2': scope_data({'HVO100 (liter)': 4, 'Källa värme': 'Vattenfall', 'Saknas': None}),
+            'Scope 3': scope_data({'Tåg (km)': 80, 'Cykel (km)': 5})
+        },
+        'Bolag B Filial': {
+            'Scope 1 & 2': scope_data({'Diesel (liter)': 2}, repeats = {'Diesel (liter)': [(1, 'C2'), (2, 'C3')]})
+        },
+        'Bolag C AB': {
+            'Scope 1 & 2': scope_data({'Diesel (liter)': 7, 'Okänd post': 2})
+        }
+    }
+    matches = {
+        'Bolag A AB': {'match': 'Bolag A', 'score': 0.9},
+        'Bolag B AB': {'match': 'Bolag B', 'score': 0.9},
+        'Bolag B Filial': {'match': 'Bolag B', 'score': 0.8},
+        'Bolag C AB': {'match': 'Bolag C', 'score': 0.9}
+    }
+    return data_dict, matches
+
+
+@pytest.fixture
+def settings(tmp_path, monkeypatch):
+    # The special cases are read from scope_2_dict.json in the working directory
+    monkeypatch.chdir(REPO_PATH)
+    wb = Workbook()
+    wb.remove(wb.active)
+    for sheet_name, labels in SUMMARY_SHEETS.items():
+        ws = wb.create_sheet(sheet_name)
+        for row, label in enumerate(labels, start = 2):
+            ws.cell(row = row, column = 2).value = label
+    wb.create_sheet('Mismatched Data')
+    wb.save(tmp_path / 'summary.xlsx')
+    return {
+        "Output file folder path": str(tmp_path),
+        "Summary file name": 'summary.xlsx',
+        "Generate missing write data": False,
+        "Mismatch suggestions": 2,
+        "Mismatch suggestion min score": 0.3
+    }
+
+
+@pytest.mark.parametrize('workers', [1, 2, 3])
+def test_sharded_writes_match_unsharded(settings, workers):
+    data_dict, matches = build_input()
+    wb = load_workbook(os.path.join(settings["Output file folder path"], settings["Summary file name"]))
+    targets = {}
+    expected = compute_summary_writes(data_dict, wb, matches, settings, targets = targets)
+
+    sharded_targets = {}
+    sharded = compute_summary_writes_sharded(data_dict, matches, dict(settings, **{"Summary shard workers": workers}), targets = sharded_targets)
+
+    assert sharded == expected
+    assert sharded_targets == targets
+    # Every kind of outcome is covered: writes, special cases and numbered mismatch rows
+    assert any(sheet_name == 'Mismatched Data' and row > 2 for sheet_name, row, _, _ in expected)
+    assert ('Bolag B', 9, 3, 'Vattenfall') in expected
@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from openpyxl import Workbook
+from openpyxl.styles import PatternFill
+
+from utils import template
+from utils.template import compile_read_plan, apply_read_plan, get_read_plan
+from utils.util import READER_BACKENDS, KEY_COLOR, _iter_scope_entries
+
+
+KEY_FILL = PatternFill('solid', start_color = KEY_COLOR)
+
+
+def random_grid(seed, rows = 12, cols = 8):
+    rng = random.Random(seed)
+    return [
+        [(rng.choice([None, None, 'label', 1, 2.5]), rng.random() < 0.4) for _ in range(rng.randint(0, cols))]
+        for _ in range(rows)
+    ]
+
+
+@pytest.mark.parametrize('seed', range(25))
+def test_read_plan_matches_triplet_scan(seed):
+    grid = random_grid(seed)
+    colored_cells = [(row, col) for row, cells in enumerate(grid, start = 1) for col, (_, colored) in enumerate(cells, start = 1) if colored]
+
+    def get_value(row, col):
+        cells = grid[row - 1] if row <= len(grid) else []
+        return cells[col - 1][0] if col <= len(cells) else None
+
+    assert list(apply_read_plan(compile_read_plan(colored_cells), get_value)) == list(_iter_scope_entries(grid))
+
+
+def build_template(values):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Scope 1 & 2'
+    for row, (label, value) in enumerate(values, start = 2):
+        ws.cell(row = row, column = 2).value = label
+        ws.cell(row = row, column = 3).value = value
+        ws.cell(row = row, column = 3).fill = KEY_FILL
+    return wb
+
+
+def test_same_template_reuses_plan(tmp_path):
+    template._read_plans.clear()
+    first = tmp_path / 'first.xlsx'
+    second = tmp_path / 'second.xlsx'
+    build_template([('Diesel (liter)', 10), ('Bensin (liter)', None), ('El (kWh)', 300)]).save(first)
+    build_template([('Diesel (liter)', 20), ('Bensin (liter)', 5), ('El (kWh)', None)]).save(second)
+
+    results = []
+    for file_path in (first, second):
+        results.append(dict(next(READER_BACKENDS["openpyxl"](str(file_path), False))[1]))
+        # The plan must give the same data as a full scan of the sheet
+        assert results[-1] == dict(next(READER_BACKENDS["openpyxl"](str(file_path), True))[1])
+
+    assert len(template._read_plans) == 1
+    assert results == [
+        {'Diesel (liter)': 10, 'Bensin (liter)': None, 'El (kWh)': 300},
+        {'Diesel (liter)': 20, 'Bensin (liter)': 5, 'El (kWh)': None}
+    ]
+
+
+def test_layout_change_compiles_new_plan():
+    template._read_plans.clear()
+    plan = get_read_plan('Scope 3', [(2, 3), (3, 3)])
+    assert get_read_plan('Scope 3', [(2, 3), (3, 3)]) is plan
+    assert get_read_plan('Scope 3', [(2, 3), (4, 3)]) is not plan
+    assert len(template._read_plans) == 2
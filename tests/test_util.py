@@ -0,0 +1,216 @@
+import os
+import json
+import logging
+
+import pytest
+
+from openpyxl import Workbook
+from openpyxl.styles import PatternFill
+
+from utils.util import discover_input_files, get_input_data, compute_summary_writes, accumulate_writes, apply_summary_writes, get_special_cases, _check_if_special_case, KEY_COLOR
+
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KEY_FILL = PatternFill('solid', start_color = KEY_COLOR)
+
+
+def write_subsidiary(file_path, entries):
+    wb = Workbook()
+    wb.active.title = 'Instruktioner'
+    for sheet_name, labels in entries.items():
+        ws = wb.create_sheet(sheet_name)
+        for row, (label, value) in enumerate(labels, start = 2):
+            ws.cell(row = row, column = 2).value = label
+            ws.cell(row = row, column = 3).value = value
+            ws.cell(row = row, column = 3).fill = KEY_FILL
+    wb.save(file_path)
+
+
+def build_input_folders(root):
+    # Subsidiaries of different sizes, so that the pool reads them in another order than the input order
+    file_paths = []
+    for index, size in enumerate([3, 40, 1, 15]):
+        folder = root / f'Bolag {index} AB'
+        folder.mkdir()
+        file_paths.append(str(folder / 'data.xlsx'))
+        write_subsidiary(file_paths[-1], {
+            'Scope 1 & 2': [(f'Post {i} (st)', i * index) for i in range(size)],
+            'Scope 3': [('Flyg (km)', 100 + index)]
+        })
+
+    folder = root / 'Utan scope AB'
+    folder.mkdir()
+    file_paths.append(str(folder / 'data.xlsx'))
+    Workbook().save(file_paths[-1])
+
+    folder = root / 'Trasig AB'
+    folder.mkdir()
+    file_paths.append(str(folder / 'data.xlsx'))
+    (folder / 'data.xlsx').write_bytes(b'not a zip file')
+    return file_paths
+
+
+def read_input(file_paths, workers, caplog):
+    matches = {os.path.basename(os.path.dirname(file_path)): {} for file_path in file_paths}
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger = 'utils.util'):
+        input_data = get_input_data(file_paths, matches, settings = {"Ingestion workers": workers})
+    # Errors logged while opening a file stay in the worker process, the warnings are reported by get_input_data
+    warnings = [record.getMessage() for record in caplog.records if record.levelno == logging.WARNING]
+    return input_data, warnings
+
+
+@pytest.mark.parametrize('workers', [2, 3])
+def test_parallel_ingestion_matches_serial(tmp_path, caplog, workers):
+    file_paths = build_input_folders(tmp_path)
+
+    expected, expected_warnings = read_input(file_paths, 1, caplog)
+    input_data, warnings = read_input(file_paths, workers, caplog)
+
+    assert list(input_data) == list(expected)
+    for key, scope_data in expected.items():
+        assert list(input_data[key]) == list(scope_data)
+        for sheet, sheet_data in scope_data.items():
+            assert list(input_data[key][sheet].items()) == list(sheet_data.items())
+            assert input_data[key][sheet].cells == sheet_data.cells
+    assert warnings == expected_warnings
+    # The broken files are reported without stopping the run
+    assert len(warnings) == 3
+    assert warnings[-1] == '2 of 6 input files could not be read'
+    assert input_data['Bolag 1 AB']['Scope 3'] == {'Flyg (km)': 101}
+
+
+def write_special_cases(json_path, special_cases):
+    json_path.write_text(json.dumps(special_cases), encoding = 'utf-8')
+    return str(json_path)
+
+
+def test_special_case_needs_every_keyword(tmp_path):
+    json_path = write_special_cases(tmp_path / 'special.json', {
+        "1": {"name": "Fjärrvärme", "row": 9, "col": 2, "keywords": ["Källa", "värme"]},
+        "2": {"name": "Fjärrvärme", "row": 9, "col": 3, "keywords": ["kwh", "värme"]}
+    })
+
+    special_case, match_count, write_key, match_dict = _check_if_special_case('KÄLLA fjärrvärme', {}, 0, json_path = json_path)
+    assert (special_case["col"], match_count, write_key, match_dict) == (2, 1, 'Fjärrvärme', {'Fjärrvärme': {"row": 9, "col": 2}})
+
+    assert _check_if_special_case('Källa el', {}, 0, json_path = json_path) == (None, 0, None, {})
+
+
+def test_first_special_case_wins(tmp_path):
+    json_path = write_special_cases(tmp_path / 'special.json', {
+        "1": {"name": "Fjärrvärme", "row": 9, "col": 2, "keywords": ["värme"]},
+        "2": {"name": "Fjärrvärme", "row": 9, "col": 3, "keywords": ["kwh", "värme"]}
+    })
+
+    assert _check_if_special_case('Värme (kWh)', {}, 0, json_path = json_path)[0]["col"] == 2
+
+
+def test_changed_special_cases_are_reloaded(tmp_path, caplog):
+    json_path = write_special_cases(tmp_path / 'special.json', {"1": {"name": "Fjärrkyla", "row": 10, "col": 2, "keywords": ["kyla"]}})
+    assert _check_if_special_case('Fjärrkyla', {}, 0, special_cases = get_special_cases(json_path))[2] == 'Fjärrkyla'
+
+    write_special_cases(tmp_path / 'special.json', {"1": {"name": "Fjärrkyla", "row": 10, "col": 2, "keywords": []}})
+    os.utime(json_path, ns = (0, os.stat(json_path).st_mtime_ns + 10**9))
+    with caplog.at_level(logging.WARNING, logger = 'utils.util'):
+        special_cases = get_special_cases(json_path)
+
+    assert _check_if_special_case('Fjärrkyla', {}, 0, special_cases = special_cases)[2] is None
+    assert 'has no keywords' in caplog.text
+
+
+def test_repo_special_cases(monkeypatch):
+    monkeypatch.chdir(REPO_PATH)
+
+    assert _check_if_special_case('Källa inköpt el', {}, 0)[0] == {"name": "Verksamhetsel", "row": 7, "col": 2, "keywords": ["källa", "inköpt el"]}
+    assert _check_if_special_case('Diesel (liter)', {}, 0)[0] is None
+
+
+def test_discover_input_files(tmp_path, caplog):
+    for name in ['Aktivitetsdata Klimatbokslut.xlsx', 'Bolag B AB/data.xlsx', 'Bolag B AB/~$data.xlsx', 'Bolag B AB/notes.txt',
+                 'Bolag A AB/data.xlsx', 'Bolag A AB/data backup.xlsx', 'Bolag A AB/2024/old.xlsx', 'Bolag C AB/data.xlsm']:
+        (tmp_path / name).parent.mkdir(parents = True, exist_ok = True)
+        (tmp_path / name).write_bytes(b'')
+    settings = {"Input include patterns": ["*.xlsx", "*.xlsm"], "Input exclude patterns": ["*backup*"]}
+
+    with caplog.at_level(logging.WARNING, logger = 'utils.util'):
+        input_files = discover_input_files([str(tmp_path), str(tmp_path / 'missing')], settings)
+
+    # Grouped by the folder that each file is in, folders and files in alphabetical order
+    assert input_files == {
+        'Bolag A AB': [str(tmp_path / 'Bolag A AB' / 'data.xlsx')],
+        '2024': [str(tmp_path / 'Bolag A AB' / '2024' / 'old.xlsx')],
+        'Bolag B AB': [str(tmp_path / 'Bolag B AB' / 'data.xlsx')],
+        'Bolag C AB': [str(tmp_path / 'Bolag C AB' / 'data.xlsm')]
+    }
+    assert list(input_files) == ['Bolag A AB', '2024', 'Bolag B AB', 'Bolag C AB']
+    assert 'missing' in caplog.text
+
+
+def test_default_input_patterns(tmp_path):
+    for name in ['Bolag A AB/data.xlsx', 'Bolag A AB/data.xlsm', 'Bolag A AB/~$data.xlsx']:
+        (tmp_path / name).parent.mkdir(parents = True, exist_ok = True)
+        (tmp_path / name).write_bytes(b'')
+
+    assert discover_input_files(str(tmp_path), {}) == {'Bolag A AB': [str(tmp_path / 'Bolag A AB' / 'data.xlsx')]}
+
+
+def test_accumulate_writes_sums_numbers():
+    writes = [('Bolag A', 7, 3, 100), ('Bolag A', 9, 3, 1.5), ('Bolag A', 7, 3, 50), ('Bolag A', 9, 3, 0.1), ('Bolag A', 9, 3, 0.2)]
+
+    assert accumulate_writes(writes) == [('Bolag A', 7, 3, 150), ('Bolag A', 9, 3, 1.8)]
+    assert isinstance(accumulate_writes(writes)[0][3], int)
+
+
+def test_accumulate_writes_joins_text():
+    writes = [('Bolag A', 7, 2, 'Vattenfall'), ('Bolag B', 7, 2, 'Fortum'), ('Bolag A', 7, 2, 'Eon')]
+
+    assert accumulate_writes(writes, separator = ' / ') == [('Bolag A', 7, 2, 'Vattenfall / Eon'), ('Bolag B', 7, 2, 'Fortum')]
+
+
+def test_accumulate_writes_mixed_types():
+    writes = [('Bolag A', 7, 3, 100), ('Bolag A', 7, 3, 'saknas'), ('Bolag A', 8, 3, True), ('Bolag A', 8, 3, 1)]
+
+    # Booleans are not summed as numbers
+    assert accumulate_writes(writes) == [('Bolag A', 7, 3, '100, saknas'), ('Bolag A', 8, 3, 'True, 1')]
+
+
+def test_accumulate_writes_leaves_out_none():
+    writes = [('Bolag A', 7, 3, None), ('Bolag A', 7, 3, 100), ('Bolag A', 8, 3, None), ('Bolag A', 9, 3, 'Eon'), ('Bolag A', 9, 3, None)]
+
+    assert accumulate_writes(writes) == [('Bolag A', 7, 3, 100), ('Bolag A', 8, 3, None), ('Bolag A', 9, 3, 'Eon')]
+
+
+@pytest.mark.parametrize('accumulate, expected', [(None, 50), (False, 50), (True, 150)])
+def test_last_write_wins_unless_accumulating(accumulate, expected):
+    wb = Workbook()
+    wb.active.title = 'Bolag A'
+    settings = {"Output file folder path": '', "Output file name": 'unused.xlsx'}
+    if accumulate is not None:
+        settings["Accumulate writes"] = accumulate
+
+    apply_summary_writes([('Bolag A', 7, 3, 100), ('Bolag A', 7, 3, 50)], wb, settings, save = False)
+
+    assert wb['Bolag A']['C7'].value == expected
+
+
+@pytest.mark.parametrize('suggestion_count', [2, 0])
+def test_mismatches_get_suggestions(monkeypatch, suggestion_count):
+    # The special cases are read from scope_2_dict.json in the working directory
+    monkeypatch.chdir(REPO_PATH)
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Bolag A'
+    ws['B3'] = 'Diesel (liter)'
+    ws['B4'] = 'Bensin (liter)'
+    ws['B5'] = 'Naturgas (m3)'
+    wb.create_sheet('Mismatched Data')
+    settings = {"Generate missing write data": False, "Mismatch suggestions": suggestion_count, "Mismatch suggestion min score": 0.3}
+    data_dict = {'Bolag A AB': {'Scope 1 & 2': {'Diesel (liter)': 10, 'Dieselolja (liter)': 5, 'Flygresor (km)': 300}}}
+
+    writes = compute_summary_writes(data_dict, wb, {'Bolag A AB': {'match': 'Bolag A', 'score': 0.9}}, settings)
+
+    # Best first, with the cell of each suggested label. Labels without a similar label get no suggestions column
+    suggestions = [(2, 5, 'Diesel (liter) (B3, 0.714); Bensin (liter) (B4, 0.357)')] if suggestion_count > 0 else []
+    assert writes[0] == ('Bolag A', 3, 3, 10)
+    assert [write[1:] for write in writes if write[0] == 'Mismatched Data' and write[2] in (3, 5)] == [(2, 3, 'Dieselolja (liter)')] + suggestions + [(3, 3, 'Flygresor (km)')]
@@ -0,0 +1,109 @@
+import os
+import json
+import shutil
+
+import pytest
+
+from openpyxl import load_workbook
+
+import utils.util as utils
+import utils.watch as watch
+from utils.watch import run_watch
+from benchmarks.corpus import generate_corpus, KEY_FILL
+
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    # The special cases are read from scope_2_dict.json in the working directory
+    monkeypatch.chdir(REPO_PATH)
+    with open('settings.json', encoding = 'utf-8') as f:
+        settings = json.load(f)
+    # Fewer summary sheets than subsidiaries, so that one input folder is left unmatched
+    corpus = generate_corpus(str(tmp_path), subsidiaries = 6, summary_sheets = 5, extra_labels = 3, settings = settings)
+    settings["Input file folder path"] = corpus['input folder path']
+    settings["Output file folder path"] = corpus['output folder path']
+    settings["Generate missing write data"] = False # Random values
+    settings["Use write map"] = False
+    return settings
+
+
+def load_summary(settings):
+    input_files = utils.discover_input_files(path = settings["Input file folder path"], settings = settings)
+    wb = utils.excel_to_workbook(os.path.join(settings["Output file folder path"], settings["Summary file name"]))
+    summary_sheets = wb.sheetnames
+    wb.create_sheet("Mismatched Data")
+    return input_files, wb, summary_sheets
+
+
+def serial_run(settings):
+    settings = dict(settings, **{"Output file name": 'serial.xlsx'})
+    input_files, wb, summary_sheets = load_summary(settings)
+    matches = utils.match_lists(list(input_files.keys()), summary_sheets, filter_doubles = True)
+    input_data = utils.get_input_data([file_path for file_paths in input_files.values() for file_path in file_paths], matches, settings = settings)
+    utils.write_data_to_summary(data_dict = input_data, wb = wb, matches = matches, settings = settings)
+    return sheet_values(os.path.join(settings["Output file folder path"], 'serial.xlsx'))
+
+
+def sheet_values(file_path):
+    # A patched file keeps the cells that were emptied again, so only the cells with a value are compared
+    wb = load_workbook(file_path)
+    return {ws.title: {cell.coordinate: cell.value for row in ws.iter_rows() for cell in row if cell.value is not None} for ws in wb}
+
+
+def change_first_value(file_path):
+    wb = load_workbook(file_path)
+    ws = wb['Scope 1 & 2']
+    cell = next(cell for row in ws.iter_rows() for cell in row if cell.fill == KEY_FILL and isinstance(cell.value, (int, float)))
+    cell.value += 1000
+    wb.save(file_path)
+
+
+@pytest.mark.parametrize('output_mode', ['openpyxl', 'patch'])
+def test_watch_updates_match_a_full_run(corpus, monkeypatch, output_mode):
+    settings = dict(corpus, **{"Output mode": output_mode})
+    output_path = os.path.join(settings["Output file folder path"], settings["Output file name"])
+    input_files, wb, summary_sheets = load_summary(settings)
+    matches = utils.match_lists(list(input_files.keys()), summary_sheets, filter_doubles = True)
+    folders = list(input_files.keys())
+    results = []
+    computed = []
+
+    compute_summary_writes = watch.compute_summary_writes
+    def recording_compute_summary_writes(data_dict, *args, **kwargs):
+        computed.extend(data_dict.keys())
+        return compute_summary_writes(data_dict, *args, **kwargs)
+    monkeypatch.setattr(watch, 'compute_summary_writes', recording_compute_summary_writes)
+    matched_sheets = []
+    match_lists = watch.match_lists
+    def recording_match_lists(list_1, list_2, **kwargs):
+        matched_sheets.append(list(list_2))
+        return match_lists(list_1, list_2, **kwargs)
+    monkeypatch.setattr(watch, 'match_lists', recording_match_lists)
+
+    def changes(path, settings):
+        results.append((sheet_values(output_path), serial_run(settings), list(computed)))
+        computed.clear()
+        change_first_value(input_files[folders[0]][0])
+        yield set(input_files[folders[0]])
+        results.append((sheet_values(output_path), serial_run(settings), list(computed)))
+        computed.clear()
+        shutil.rmtree(os.path.dirname(input_files[folders[1]][0]))
+        yield {os.path.dirname(input_files[folders[1]][0])}
+        results.append((sheet_values(output_path), serial_run(settings), list(computed)))
+    monkeypatch.setattr(watch, '_watch_changes', changes)
+
+    run_watch(settings, wb = wb, summary_sheets = summary_sheets, input_folder_names = folders, matches = matches)
+
+    (first, expected_first, computed_first), (changed, expected_changed, computed_changed), (removed, expected_removed, _) = results
+    assert first == expected_first
+    assert changed == expected_changed
+    assert removed == expected_removed
+    assert changed != first and removed != changed
+    # The input folders are only matched again when one is removed, and never to the "Mismatched Data" sheet
+    assert matched_sheets == [summary_sheets]
+    assert len(computed_first) == 5
+    # Only the subsidiary whose file changed is computed again
+    assert computed_changed == ([folders[0]] if folders[0] in matches else [])
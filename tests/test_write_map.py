@@ -0,0 +1,150 @@
+import os
+import json
+import zipfile
+import logging
+
+import pytest
+
+from openpyxl import Workbook, load_workbook
+
+import utils.util as utils
+from utils.write_map import load_write_maps, save_write_maps, hash_summary_sheets, WRITE_MAP_VERSION
+
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SETTINGS = {"Mismatch suggestions": 3, "Mismatch suggestion min score": 0.3, "Generate missing write data": False}
+
+
+@pytest.fixture
+def summary(tmp_path):
+    wb = Workbook()
+    wb.active.title = 'Bolag A'
+    wb['Bolag A']['B3'] = 'Diesel (liter)'
+    wb.create_sheet('Bolag B')
+    wb['Bolag B']['B3'] = 'Bensin (liter)'
+    wb['Bolag B']['D1'] = 2024
+    wb.save(tmp_path / 'summary.xlsx')
+    with open(os.path.join(REPO_PATH, 'scope_2_dict.json'), 'rb') as f:
+        (tmp_path / 'special.json').write_bytes(f.read())
+    return tmp_path
+
+
+def load(tmp_path, settings = SETTINGS):
+    return load_write_maps(str(tmp_path / 'map.json'), str(tmp_path / 'summary.xlsx'), settings, special_cases_path = str(tmp_path / 'special.json'))
+
+
+def compile_labels(tmp_path):
+    write_maps = load(tmp_path)
+    write_maps['sheets']['Bolag A']['labels']['Diesel (liter)'] = {'count': 1, 'first': [3, 3], 'last': [3, 3], 'outcome': 'exact'}
+    write_maps['sheets']['Bolag B']['labels']['Bensin (liter)'] = {'count': 1, 'first': [3, 3], 'last': [3, 3], 'outcome': 'exact'}
+    save_write_maps(write_maps, str(tmp_path / 'map.json'))
+    return write_maps
+
+
+def labels(write_maps):
+    return {sheet_name: list(sheet_map['labels']) for sheet_name, sheet_map in write_maps['sheets'].items()}
+
+
+def edit_summary(tmp_path, sheet_name, cell, value):
+    wb = load_workbook(tmp_path / 'summary.xlsx')
+    wb[sheet_name][cell] = value
+    wb.save(tmp_path / 'summary.xlsx')
+
+
+def test_unchanged_sheets_are_reused(summary):
+    write_maps = compile_labels(summary)
+
+    assert load(summary) == write_maps
+    assert labels(write_maps) == {'Bolag A': ['Diesel (liter)'], 'Bolag B': ['Bensin (liter)']}
+    assert write_maps['version'] == WRITE_MAP_VERSION
+    assert not (summary / 'map.json.tmp').exists()
+
+
+def test_changed_sheet_is_compiled_again(summary):
+    compile_labels(summary)
+
+    edit_summary(summary, 'Bolag B', 'D1', 2025)
+    assert labels(load(summary)) == {'Bolag A': ['Diesel (liter)'], 'Bolag B': []}
+
+    compile_labels(summary)
+    edit_summary(summary, 'Bolag A', 'B4', 'Naturgas (m3)')
+    assert labels(load(summary)) == {'Bolag A': [], 'Bolag B': ['Bensin (liter)']}
+
+
+def test_shared_strings_are_part_of_every_sheet_hash(summary):
+    sheet_hashes = hash_summary_sheets(str(summary / 'summary.xlsx'))
+
+    # Files saved by Excel keep their text in the shared strings, which the sheets refer to by index
+    with zipfile.ZipFile(summary / 'summary.xlsx', 'a') as zf:
+        zf.writestr('xl/sharedStrings.xml', '<sst><si><t>Naturgas (m3)</t></si></sst>')
+    changed_hashes = hash_summary_sheets(str(summary / 'summary.xlsx'))
+
+    assert list(changed_hashes) == ['Bolag A', 'Bolag B']
+    assert all(changed_hashes[sheet_name] != sheet_hash for sheet_name, sheet_hash in sheet_hashes.items())
+
+
+def test_changed_special_cases_invalidate_every_sheet(summary):
+    compile_labels(summary)
+
+    special_cases = json.loads((summary / 'special.json').read_text(encoding = 'utf-8'))
+    special_cases['99'] = {"name": "Fjärrkyla", "row": 10, "col": 2, "keywords": ["kyla"]}
+    (summary / 'special.json').write_text(json.dumps(special_cases), encoding = 'utf-8')
+
+    assert labels(load(summary)) == {'Bolag A': [], 'Bolag B': []}
+
+
+@pytest.mark.parametrize('setting, value', [("Mismatch suggestions", 5), ("Mismatch suggestion min score", 0.5)])
+def test_changed_suggestion_settings_invalidate_every_sheet(summary, setting, value):
+    compile_labels(summary)
+
+    assert labels(load(summary, dict(SETTINGS, **{setting: value}))) == {'Bolag A': [], 'Bolag B': []}
+
+
+def test_unreadable_or_outdated_map_is_empty(summary, caplog):
+    write_maps = compile_labels(summary)
+
+    (summary / 'map.json').write_text(json.dumps(dict(write_maps, version = WRITE_MAP_VERSION - 1)), encoding = 'utf-8')
+    assert labels(load(summary)) == {'Bolag A': [], 'Bolag B': []}
+
+    (summary / 'map.json').write_text('{not json', encoding = 'utf-8')
+    with caplog.at_level(logging.WARNING, logger = 'utils.write_map'):
+        assert labels(load(summary)) == {'Bolag A': [], 'Bolag B': []}
+    assert 'Could not read' in caplog.text
+
+
+def test_missing_summary_gives_no_map(tmp_path, caplog):
+    with caplog.at_level(logging.WARNING, logger = 'utils.write_map'):
+        assert load(tmp_path) is None
+
+    # Nothing to save either
+    save_write_maps(None, str(tmp_path / 'map.json'))
+    assert not (tmp_path / 'map.json').exists()
+
+
+def test_sheets_without_a_hash_are_not_saved(summary):
+    write_maps = load(summary)
+    write_maps['sheets']['Ny'] = {'hash': None, 'labels': {'Diesel (liter)': {'count': 0, 'suggestions': '', 'outcome': 'mismatch'}}}
+
+    save_write_maps(write_maps, str(summary / 'map.json'))
+
+    with open(summary / 'map.json', encoding = 'utf-8') as f:
+        assert list(json.load(f)['sheets']) == ['Bolag A', 'Bolag B']
+
+
+def test_compiled_labels_are_reused_by_compute_summary_writes(summary, monkeypatch):
+    # The special cases are read from scope_2_dict.json in the working directory
+    monkeypatch.chdir(REPO_PATH)
+    wb = load_workbook(summary / 'summary.xlsx')
+    wb.create_sheet('Mismatched Data')
+    data_dict = {'Bolag A AB': {'Scope 1': {'Diesel (liter)': 10, 'Dieselolja (liter)': 5}}, 'Bolag B AB': {'Scope 1': {'Bensin (liter)': 3}}}
+    matches = {'Bolag A AB': {'match': 'Bolag A', 'score': 0.9}, 'Bolag B AB': {'match': 'Bolag B', 'score': 0.9}}
+    expected = utils.compute_summary_writes(data_dict, wb, matches, SETTINGS)
+
+    write_maps = load(summary)
+    assert utils.compute_summary_writes(data_dict, wb, matches, SETTINGS, state = {'write_maps': write_maps}) == expected
+    save_write_maps(write_maps, str(summary / 'map.json'))
+
+    def no_compiling(*args, **kwargs):
+        raise AssertionError('A label was compiled again')
+    monkeypatch.setattr(utils, '_compile_write_entries', no_compiling)
+    assert utils.compute_summary_writes(data_dict, wb, matches, SETTINGS, state = {'write_maps': load(summary)}) == expected
@@ -0,0 +1,109 @@
+import datetime
+
+import pytest
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import PatternFill, Font
+
+from utils.util import apply_summary_writes
+from utils.xlsx_patch import patch_workbook
+
+
+YELLOW_FILL = PatternFill('solid', start_color = 'FFFFFF00')
+
+WRITES = [
+    ('Bolag A', 2, 3, 120),                # Overwrites a styled, empty cell
+    ('Bolag A', 3, 3, 4.25),               # Overwrites an existing value
+    ('Bolag A', 3, 2, 'Bensin & diesel'),  # Overwrites a shared string, with characters to escape
+    ('Bolag A', 10, 1, ' padded '),        # New row after the last one
+    ('Bolag A', 1, 6, True),               # New cell after the last one in its row
+    ('Bolag A', 5, 2, '=C2*2'),            # Formula
+    ('Bolag A', 2, 3, 121),                # Later writes win
+    ('Bolag B', 4, 2, None),               # Clears a value
+    ('Bolag B', 1, 1, 'Rubrik'),           # New cell before the existing ones
+    ('Mismatched Data', 2, 1, 'Bolag C')   # Sheet that does not exist yet
+]
+
+
+def build_summary(file_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Bolag A'
+    ws['B1'] = 'Kategori'
+    ws['B1'].font = Font(bold = True)
+    ws['B2'] = 'Diesel (liter)'
+    ws['C2'].fill = YELLOW_FILL
+    ws['B3'] = 'Bensin (liter)'
+    ws['C3'] = 1
+    ws['D4'] = '=SUM(C2:C3)'
+    ws = wb.create_sheet('Bolag B')
+    ws['B2'] = 'El (kWh)'
+    ws['B4'] = 'to be cleared'
+    ws['C4'] = 7
+    wb.save(file_path)
+
+
+def sheet_values(file_path):
+    wb = load_workbook(file_path)
+    return {ws.title: {cell.coordinate: cell.value for row in ws.iter_rows() for cell in row if cell.value is not None} for ws in wb}
+
+
+def save_with_openpyxl(source_path, output_path, writes):
+    wb = load_workbook(source_path)
+    for sheet_name, row, col, value in writes:
+        if sheet_name not in wb.sheetnames:
+            wb.create_sheet(sheet_name)
+        wb[sheet_name].cell(row = row, column = col).value = value
+    wb.save(output_path)
+
+
+def test_patch_matches_openpyxl_save(tmp_path):
+    summary_path = str(tmp_path / 'summary.xlsx')
+    build_summary(summary_path)
+
+    patch_workbook(summary_path, str(tmp_path / 'patched.xlsx'), WRITES)
+    save_with_openpyxl(summary_path, str(tmp_path / 'saved.xlsx'), WRITES)
+
+    assert sheet_values(tmp_path / 'patched.xlsx') == sheet_values(tmp_path / 'saved.xlsx')
+
+
+def test_patch_keeps_styles(tmp_path):
+    summary_path = str(tmp_path / 'summary.xlsx')
+    build_summary(summary_path)
+
+    patch_workbook(summary_path, str(tmp_path / 'patched.xlsx'), WRITES)
+
+    ws = load_workbook(tmp_path / 'patched.xlsx')['Bolag A']
+    assert ws['C2'].fill.start_color.index == YELLOW_FILL.start_color.index
+    assert ws['B1'].font.bold
+
+
+def test_patch_rejects_values_it_cannot_write(tmp_path):
+    summary_path = str(tmp_path / 'summary.xlsx')
+    build_summary(summary_path)
+
+    with pytest.raises(ValueError):
+        patch_workbook(summary_path, str(tmp_path / 'patched.xlsx'), [('Bolag A', 2, 3, datetime.date(2025, 1, 1))])
+    assert not (tmp_path / 'patched.xlsx').exists()
+
+
+@pytest.mark.parametrize('summary_content', [None, b'not a zip file'])
+def test_patch_mode_matches_openpyxl_mode(tmp_path, summary_content):
+    # With a summary file that cannot be patched, patch mode falls back to a full save
+    build_summary(str(tmp_path / 'summary.xlsx'))
+    writes = [write for write in WRITES if write[0] != 'Mismatched Data']
+    outputs = {}
+    for mode in ("openpyxl", "patch"):
+        wb = load_workbook(tmp_path / 'summary.xlsx')
+        if summary_content is not None:
+            (tmp_path / 'summary.xlsx').with_name('broken.xlsx').write_bytes(summary_content)
+        settings = {
+            "Output file folder path": str(tmp_path),
+            "Summary file name": 'summary.xlsx' if summary_content is None else 'broken.xlsx',
+            "Output file name": f'{mode}.xlsx',
+            "Output mode": mode
+        }
+        apply_summary_writes(writes, wb, settings)
+        outputs[mode] = sheet_values(tmp_path / f'{mode}.xlsx')
+
+    assert outputs["patch"] == outputs["openpyxl"]
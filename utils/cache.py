@@ -0,0 +1,166 @@
+import os
+import time
+import pickle
+import hashlib
+import logging
+
+from typing import Dict, Union, Any
+
+
+logger = logging.getLogger(__name__)
+
+# Bump when the extraction rules change, so that results of older versions are not served
+CACHE_VERSION = 4
+
+
+def load_parse_cache(cache_path: str) -> Dict[str, Any]:
+    '''
+    Summary:
+        Load the parse cache from disk. A missing, unreadable or outdated cache file gives an empty cache
+
+    Args:
+        cache_path (str): Path to the cache file
+
+    Returns:
+        Dict[str, Any]: Cache dictionary with the structure
+        {
+            'version': CACHE_VERSION,
+            'entries': {
+                'absolute file path': {
+                    'size': file size in bytes,
+                    'mtime': modification time in nanoseconds,
+                    'hash': sha256 of the file content or None,
+                    'data': scope data of the file (see _get_scope_data),
+                    'nbytes': size of the pickled data,
+                    'last_used': time of the last cache hit or store
+                }
+            }
+        }
+    '''
+    empty_cache = {'version': CACHE_VERSION, 'entries': {}}
+    try:
+        with open(cache_path, 'rb') as f:
+            cache = pickle.load(f)
+    except FileNotFoundError:
+        return empty_cache
+    except Exception as e:
+        logger.warning('Could not read %s, starting with an empty cache: %r', cache_path, e)
+        return empty_cache
+
+    if not isinstance(cache, dict) or cache.get('version') != CACHE_VERSION:
+        return empty_cache
+    return cache
+
+
+def save_parse_cache(cache: Dict[str, Any], cache_path: str, max_bytes: Union[int, None] = None) -> None:
+    '''
+    Summary:
+        Save the parse cache to disk. The entries of files that no longer exist are dropped, and if max_bytes
+        is given, the least recently used entries are evicted until the cached data fits. The file is replaced
+        atomically, so an interrupted run cannot leave a half-written cache behind
+
+    Args:
+        cache (Dict[str, Any]): Cache dictionary (see load_parse_cache)
+        cache_path (str): Path to the cache file
+        max_bytes (int, optional): Maximum total size of the cached data
+    '''
+    entries = cache['entries']
+    for file_path in [file_path for file_path in entries if not os.path.exists(file_path)]:
+        del entries[file_path]
+
+    if max_bytes is not None:
+        total_bytes = sum(entry['nbytes'] for entry in entries.values())
+        for file_path in sorted(entries, key = lambda file_path: entries[file_path]['last_used']):
+            if total_bytes <= max_bytes:
+                break
+            total_bytes -= entries.pop(file_path)['nbytes']
+
+    temp_path = cache_path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            pickle.dump(cache, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except Exception as e:
+        logger.warning('Could not write %s: %r', cache_path, e)
+
+
+def get_cached_scope_data(cache: Dict[str, Any], file_path: str, content_hash: bool = False) -> Union[Dict, None]:
+    '''
+    Summary:
+        Look up the scope data of a file in the cache. The entry is valid if the file has the same size and
+        modification time as when it was cached. With content_hash, the content has to match as well, and a
+        file whose modification time changed without its content changing is still served from the cache
+
+    Args:
+        cache (Dict[str, Any]): Cache dictionary (see load_parse_cache)
+        file_path (str): Path to the input file
+        content_hash (bool): If True, also compare a sha256 hash of the file content
+
+    Returns:
+        Dict or None: The cached scope data, or None on a cache miss
+    '''
+    entry = cache['entries'].get(os.path.abspath(file_path))
+    if entry is None:
+        return None
+
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+
+    if stat.st_size != entry['size']:
+        return None
+    if content_hash:
+        if entry['hash'] is None or _hash_file(file_path) != entry['hash']:
+            return None
+        entry['mtime'] = stat.st_mtime_ns
+    elif stat.st_mtime_ns != entry['mtime']:
+        return None
+
+    entry['last_used'] = time.time()
+    return entry['data']
+
+
+def put_cached_scope_data(cache: Dict[str, Any], file_path: str, scope_data: Dict, content_hash: bool = False) -> None:
+    '''
+    Summary:
+        Store the scope data of a file in the cache
+
+    Args:
+        cache (Dict[str, Any]): Cache dictionary (see load_parse_cache)
+        file_path (str): Path to the input file
+        scope_data (Dict): Scope data of the file
+        content_hash (bool): If True, also store a sha256 hash of the file content
+    '''
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return
+
+    cache['entries'][os.path.abspath(file_path)] = {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'hash': _hash_file(file_path) if content_hash else None,
+        'data': scope_data,
+        'nbytes': len(pickle.dumps(scope_data, protocol = pickle.HIGHEST_PROTOCOL)),
+        'last_used': time.time()
+    }
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _hash_file(file_path: str) -> str:
+    '''
+    Compute the sha256 hash of a file, reading it in chunks
+
+    Args:
+        file_path (str): Path to the file
+
+    Returns:
+        str: Hex digest of the file content
+    '''
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
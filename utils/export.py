@@ -0,0 +1,139 @@
+import os
+import numbers
+import logging
+
+from openpyxl.utils import get_column_letter
+
+from typing import List, Dict, Union
+
+
+logger = logging.getLogger(__name__)
+
+# Columns of the activity data table, one row per entry of each scope sheet
+ACTIVITY_COLUMNS = [
+    'subsidiary', # Input folder name
+    'scope', # Scope sheet name
+    'label', # Entry name
+    'value', # Value as text, None if the cell was empty
+    'numeric value', # Value as a float, None if it is not a number
+    'source file',
+    'source cell', # e.g. 'C5'
+    'summary sheet', # Summary cell the value was written to, None if no location was found
+    'summary cell'
+]
+
+# File extension per export format
+EXPORT_FORMATS = {
+    "parquet": ".parquet",
+    "arrow": ".arrow"
+}
+
+
+def build_activity_table(input_data: Dict, sources: Dict[str, str], targets: Dict, table: Union[Dict[str, List], None] = None) -> Dict[str, List]:
+    '''
+    Summary:
+        Flatten the input data into a table with one row per entry (see ACTIVITY_COLUMNS).
+        Several rows can point to the same summary cell, whose value is their sum if settings["Accumulate writes"] is set
+        (see accumulate_writes), else the value of the last row
+
+    Args:
+        input_data (Dict): Input data, see get_input_data
+        sources (Dict[str, str]): Input folder name -> path of the file that its data was read from
+        targets (Dict): Summary cell per entry, see compute_summary_writes
+        table (Dict[str, List], optional): Table to add the rows to, e.g. one subsidiary at a time
+
+    Returns:
+        Dict[str, List]: Column name -> column values
+    '''
+    if table is None:
+        table = {column: [] for column in ACTIVITY_COLUMNS}
+
+    for key, scope_data in input_data.items():
+        for item, sheet_data in scope_data.items():
+            # Only ScopeData knows its cells and repeated keys
+            cells = getattr(sheet_data, 'cells', {})
+            repeats = getattr(sheet_data, 'repeats', {})
+            for subitem, last_value in sheet_data.items():
+                target = targets.get((key, item, subitem))
+                # A key that is repeated in the sheet (e.g. once per office) gives one row per occurrence
+                for value, cell in repeats.get(subitem, [(last_value, cells.get(subitem))]):
+                    is_number = isinstance(value, numbers.Real) and not isinstance(value, bool)
+                    table['subsidiary'].append(key)
+                    table['scope'].append(item)
+                    table['label'].append(str(subitem))
+                    table['value'].append(None if value is None else str(value))
+                    table['numeric value'].append(float(value) if is_number else None)
+                    table['source file'].append(sources.get(key))
+                    table['source cell'].append(cell)
+                    table['summary sheet'].append(None if target is None else target[0])
+                    table['summary cell'].append(None if target is None else get_column_letter(target[2]) + str(target[1]))
+
+    return table
+
+
+def write_activity_table(table: Dict[str, List], file_path: str, file_format: str) -> None:
+    '''
+    Summary:
+        Write the activity data table as Parquet or as an Arrow IPC file. Arrow files can be
+        memory-mapped, e.g. with pyarrow.ipc.open_file(pyarrow.memory_map(file_path)), and read without copying.
+        Needs pyarrow, which is only imported here
+
+    Args:
+        table (Dict[str, List]): Table from build_activity_table
+        file_path (str): Path to the output file
+        file_format (str): "parquet" or "arrow"
+    '''
+    import pyarrow as pa
+
+    schema = pa.schema([
+        (column, pa.float64() if column == 'numeric value' else pa.string())
+        for column in ACTIVITY_COLUMNS
+    ])
+    arrow_table = pa.Table.from_pydict(table, schema = schema)
+
+    # Write to a temporary file first, so that a failed export does not leave a broken file behind
+    temp_path = file_path + '.tmp'
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+        pq.write_table(arrow_table, temp_path)
+    elif file_format == "arrow":
+        import pyarrow.ipc
+        with pa.OSFile(temp_path, 'wb') as sink, pyarrow.ipc.new_file(sink, schema) as writer:
+            writer.write_table(arrow_table)
+    else:
+        raise ValueError(f'Unknown export format "{file_format}", expected one of {list(EXPORT_FORMATS)}')
+    os.replace(temp_path, file_path)
+
+
+def export_activity_data(table: Dict[str, List], settings: Dict) -> Union[str, None]:
+    '''
+    Summary:
+        Export the activity data table as settings["Export format"] ("none", "parquet" or "arrow") to
+        settings["Export file name"] in the output folder. The file extension is added by the format
+
+    Args:
+        table (Dict[str, List]): Table from build_activity_table
+        settings (Dict): Script settings dictionary
+
+    Returns:
+        str or None: Path to the exported file, or None if nothing was exported
+    '''
+    file_format = settings.get("Export format", "none")
+    if file_format == "none":
+        return None
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown export format "{file_format}", expected one of {list(EXPORT_FORMATS)}')
+
+    file_path = os.path.join(settings["Output file folder path"], settings["Export file name"] + EXPORT_FORMATS[file_format])
+    try:
+        write_activity_table(table, file_path, file_format)
+    except ImportError:
+        logger.error('Could not export the activity data: pyarrow is not installed')
+        return None
+    except OSError as e:
+        logger.error('Could not export the activity data to %s: %s', file_path, e)
+        return None
+
+    logger.info('Exported %d entries to %s', len(table['label']), file_path)
+    return file_path
+
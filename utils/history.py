@@ -0,0 +1,356 @@
+import os
+import sys
+import json
+import sqlite3
+import pathlib
+import datetime
+import argparse
+import contextlib
+import logging
+
+from typing import List, Dict, Union, Any, Iterator
+
+
+logger = logging.getLogger(__name__)
+
+# Stored as PRAGMA user_version, the tables and indexes are created when it is not set yet
+HISTORY_SCHEMA_VERSION = 1
+
+# One row per entry of each scope sheet and reporting period, see build_activity_table
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    period TEXT NOT NULL,
+    subsidiary TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    label TEXT NOT NULL,
+    source_cell TEXT NOT NULL, -- '' if the cell is not known
+    value TEXT,
+    numeric_value REAL,
+    source_file TEXT,
+    summary_sheet TEXT,
+    summary_cell TEXT,
+    updated TEXT NOT NULL, -- Time of the run that last wrote the entry
+    PRIMARY KEY (period, subsidiary, scope, label, source_cell)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_scope ON entries (period, scope, numeric_value);
+CREATE INDEX IF NOT EXISTS entries_label ON entries (subsidiary, scope, label, period, numeric_value);
+'''
+
+# Levels that year_over_year can aggregate to, with the columns they group by
+YOY_LEVELS = {
+    "scope": ['scope'],
+    "subsidiary": ['subsidiary', 'scope'],
+    "label": ['subsidiary', 'scope', 'label']
+}
+
+
+def save_history(table: Dict[str, List], store_path: str, period: str) -> int:
+    '''
+    Summary:
+        Upsert the activity data table into the history store, keyed by reporting period, subsidiary, scope, label and
+        source cell. The subsidiaries in the table replace what the store held for them in the same period: entries
+        that are no longer in their input files are removed. Other subsidiaries and periods are left untouched
+
+    Args:
+        table (Dict[str, List]): Table from build_activity_table
+        store_path (str): Path to the SQLite history store, created if it does not exist
+        period (str): Reporting period, e.g. '2024'
+
+    Returns:
+        int: Number of entries written
+    '''
+    # Marks the entries of this run, so that the ones it did not write can be removed
+    updated = datetime.datetime.now().isoformat(timespec = 'microseconds')
+    rows = [
+        (period, subsidiary, scope, label, source_cell or '', value, numeric_value, source_file, summary_sheet, summary_cell, updated)
+        for subsidiary, scope, label, value, numeric_value, source_file, source_cell, summary_sheet, summary_cell in zip(
+            table['subsidiary'], table['scope'], table['label'], table['value'], table['numeric value'],
+            table['source file'], table['source cell'], table['summary sheet'], table['summary cell']
+        )
+    ]
+    subsidiaries = sorted(set(table['subsidiary']))
+
+    with contextlib.closing(_connect(store_path)) as conn, conn:
+        conn.executemany('''
+            INSERT INTO entries (period, subsidiary, scope, label, source_cell, value, numeric_value, source_file, summary_sheet, summary_cell, updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (period, subsidiary, scope, label, source_cell) DO UPDATE SET
+                value = excluded.value, numeric_value = excluded.numeric_value, source_file = excluded.source_file,
+                summary_sheet = excluded.summary_sheet, summary_cell = excluded.summary_cell, updated = excluded.updated
+        ''', rows)
+        removed = 0
+        for subsidiary in subsidiaries:
+            removed += conn.execute('DELETE FROM entries WHERE period = ? AND subsidiary = ? AND updated <> ?', (period, subsidiary, updated)).rowcount
+
+    logger.info('Saved %d entries of %d subsidiaries for period %s to %s (%d outdated entries removed)', len(rows), len(subsidiaries), period, store_path, removed)
+    return len(rows)
+
+
+def save_run_history(table: Dict[str, List], settings: Dict) -> Union[int, None]:
+    '''
+    Summary:
+        Save the activity data table of a run to the history store if settings["Use history store"] is True.
+        The store is settings["History store file name"], and the period is settings["Reporting period"]
+
+    Args:
+        table (Dict[str, List]): Table from build_activity_table
+        settings (Dict): Script settings dictionary
+
+    Returns:
+        int or None: Number of entries written, or None if nothing was saved
+
+    Raises:
+        ValueError: If settings["Reporting period"] is not set
+    '''
+    if not settings.get("Use history store", False):
+        return None
+    try:
+        return save_history(table, settings["History store file name"], get_reporting_period(settings))
+    except sqlite3.Error as e:
+        logger.error('Could not save the history to %s: %s', settings["History store file name"], e)
+        return None
+
+
+def get_reporting_period(settings: Dict) -> str:
+    '''
+    Summary:
+        Get settings["Reporting period"]. It has to be set when the history store is used, since the data is
+        usually reported after the end of the period, so the current year would file it under the wrong period
+
+    Args:
+        settings (Dict): Script settings dictionary
+
+    Returns:
+        str: Reporting period
+
+    Raises:
+        ValueError: If settings["Reporting period"] is not set
+    '''
+    period = str(settings.get("Reporting period") or '').strip()
+    if period == '':
+        raise ValueError('"Reporting period" has to be set in settings.json when "Use history store" is set, e.g. "2025"')
+    return period
+
+
+def list_periods(store_path: str) -> List[Dict[str, Any]]:
+    '''
+    Summary:
+        List the reporting periods in the history store
+
+    Args:
+        store_path (str): Path to the history store
+
+    Returns:
+        List[Dict[str, Any]]: {'period', 'subsidiaries', 'entries', 'updated'} per period, oldest first
+    '''
+    return _query(store_path, '''
+        SELECT period, COUNT(DISTINCT subsidiary) AS subsidiaries, COUNT(*) AS entries, MAX(updated) AS updated
+        FROM entries GROUP BY period ORDER BY period
+    ''')
+
+
+def scope_totals(store_path: str, period: Union[str, None] = None, subsidiary: Union[str, None] = None) -> List[Dict[str, Any]]:
+    '''
+    Summary:
+        Total the numeric values per scope, over every subsidiary or a single one
+
+    Args:
+        store_path (str): Path to the history store
+        period (str, optional): Reporting period, every period if None
+        subsidiary (str, optional): Subsidiary, every subsidiary if None
+
+    Returns:
+        List[Dict[str, Any]]: {'period', 'scope', 'total', 'entries', 'numeric entries'} per period and scope
+    '''
+    return _query(store_path, '''
+        SELECT period, scope, TOTAL(numeric_value) AS total, COUNT(*) AS entries, COUNT(numeric_value) AS "numeric entries"
+        FROM entries
+        WHERE (:period IS NULL OR period = :period) AND (:subsidiary IS NULL OR subsidiary = :subsidiary)
+        GROUP BY period, scope ORDER BY period, scope
+    ''', {'period': period, 'subsidiary': subsidiary})
+
+
+def year_over_year(store_path: str, period: str, previous: Union[str, None] = None, by: str = "scope") -> List[Dict[str, Any]]:
+    '''
+    Summary:
+        Compare the totals of a reporting period with those of the period before it
+
+    Args:
+        store_path (str): Path to the history store
+        period (str): Reporting period
+        previous (str, optional): Period to compare with, by default the latest period before period
+        by (str): Level of the totals, see YOY_LEVELS: "scope", "subsidiary" (per subsidiary and scope) or "label"
+
+    Returns:
+        List[Dict[str, Any]]: The grouping columns, followed by 'current', 'previous', 'delta' and 'change' (delta
+        relative to previous). The values are None where a period has no numeric entries
+    '''
+    if by not in YOY_LEVELS:
+        raise ValueError(f'Unknown level "{by}", expected one of {list(YOY_LEVELS)}')
+    if previous is None:
+        periods = _query(store_path, 'SELECT MAX(period) AS period FROM entries WHERE period < :period', {'period': period})
+        previous = periods[0]['period']
+        if previous is None:
+            return []
+
+    columns = ', '.join(YOY_LEVELS[by])
+    rows = _query(store_path, f'''
+        SELECT {columns},
+            SUM(CASE WHEN period = :period THEN numeric_value END) AS current,
+            SUM(CASE WHEN period = :previous THEN numeric_value END) AS previous
+        FROM entries WHERE period IN (:period, :previous)
+        GROUP BY {columns} ORDER BY {columns}
+    ''', {'period': period, 'previous': previous})
+    for row in rows:
+        both = row['current'] is not None and row['previous'] is not None
+        row['delta'] = row['current'] - row['previous'] if both else None
+        row['change'] = row['delta'] / row['previous'] if both and row['previous'] != 0 else None
+    return rows
+
+
+def missing_entries(store_path: str, period: str, previous: Union[str, None] = None, subsidiary: Union[str, None] = None) -> List[Dict[str, Any]]:
+    '''
+    Summary:
+        List the missing entries of each subsidiary in a reporting period:
+        - 'empty': the entry is in the input file, but has no value
+        - 'not reported': the subsidiary reported the entry in the previous period, but not in this one
+        Subsidiaries that are not in the period at all are left out
+
+    Args:
+        store_path (str): Path to the history store
+        period (str): Reporting period
+        previous (str, optional): Period to compare with, by default the latest period before period
+        subsidiary (str, optional): Subsidiary, every subsidiary if None
+
+    Returns:
+        List[Dict[str, Any]]: {'subsidiary', 'scope', 'label', 'reason'} per missing entry, by subsidiary, scope and label
+    '''
+    if previous is None:
+        previous = _query(store_path, 'SELECT MAX(period) AS period FROM entries WHERE period < :period', {'period': period})[0]['period']
+
+    return _query(store_path, '''
+        SELECT DISTINCT subsidiary, scope, label, 'empty' AS reason
+        FROM entries
+        WHERE period = :period AND value IS NULL AND (:subsidiary IS NULL OR subsidiary = :subsidiary)
+        UNION ALL
+        SELECT DISTINCT old.subsidiary, old.scope, old.label, 'not reported' AS reason
+        FROM entries AS old
+        WHERE old.period = :previous AND old.value IS NOT NULL AND (:subsidiary IS NULL OR old.subsidiary = :subsidiary)
+            AND EXISTS (SELECT 1 FROM entries AS new WHERE new.period = :period AND new.subsidiary = old.subsidiary)
+            AND NOT EXISTS (
+                SELECT 1 FROM entries AS new
+                WHERE new.period = :period AND new.subsidiary = old.subsidiary AND new.scope = old.scope AND new.label = old.label
+            )
+        ORDER BY 1, 2, 3
+    ''', {'period': period, 'previous': previous, 'subsidiary': subsidiary})
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _connect(store_path: str) -> sqlite3.Connection:
+    '''
+    Open the history store, creating its tables and indexes if needed
+    '''
+    conn = sqlite3.connect(store_path)
+    conn.row_factory = sqlite3.Row
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version != HISTORY_SCHEMA_VERSION:
+        conn.executescript(_SCHEMA)
+        conn.execute(f'PRAGMA user_version = {HISTORY_SCHEMA_VERSION}')
+    return conn
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _query(store_path: str, sql: str, parameters: Union[Dict[str, Any], None] = None) -> List[Dict[str, Any]]:
+    '''
+    Run a query on the history store and return its rows as dictionaries. The store is opened read-only,
+    so that a query never creates or changes it
+
+    Raises:
+        FileNotFoundError: If the store does not exist
+    '''
+    if not os.path.exists(store_path):
+        raise FileNotFoundError(f'No history store at {store_path}')
+    with contextlib.closing(sqlite3.connect(pathlib.Path(store_path).absolute().as_uri() + '?mode=ro', uri = True)) as conn:
+        conn.row_factory = sqlite3.Row
+        return [dict(row) for row in conn.execute(sql, parameters or {})]
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _format_rows(rows: List[Dict[str, Any]]) -> Iterator[str]:
+    '''
+    Format query rows as an aligned text table, numbers rounded to 3 decimals
+    '''
+    if len(rows) == 0:
+        yield '(no rows)'
+        return
+
+    def text(value: Any) -> str:
+        if value is None:
+            return ''
+        if isinstance(value, float):
+            return f'{value:.3f}'
+        return str(value)
+
+    columns = list(rows[0].keys())
+    cells = [[text(row[column]) for column in columns] for row in rows]
+    widths = [max(len(column), *(len(row[i]) for row in cells)) for i, column in enumerate(columns)]
+    yield '  '.join(column.ljust(width) for column, width in zip(columns, widths))
+    for row in cells:
+        yield '  '.join(cell.ljust(width) for cell, width in zip(row, widths))
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog = 'python -m utils.history', description = 'Query the history store of earlier runs, without opening any workbook.')
+    parser.add_argument('--store', default = None, help = 'Path to the history store (default: "History store file name" in settings.json)')
+    parser.add_argument('--json', action = 'store_true', help = 'Print the rows as JSON instead of a table')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    commands.add_parser('periods', help = 'List the reporting periods in the store')
+
+    totals_parser = commands.add_parser('totals', help = 'Total the numeric values per scope')
+    totals_parser.add_argument('--period', help = 'Reporting period (default: every period)')
+    totals_parser.add_argument('--subsidiary', help = 'Subsidiary (default: every subsidiary)')
+
+    yoy_parser = commands.add_parser('yoy', help = 'Compare the totals of a period with the period before it')
+    yoy_parser.add_argument('period', help = 'Reporting period')
+    yoy_parser.add_argument('--previous', help = 'Period to compare with (default: the latest period before it)')
+    yoy_parser.add_argument('--by', choices = list(YOY_LEVELS), default = 'scope', help = 'Level of the totals')
+
+    missing_parser = commands.add_parser('missing', help = 'List the missing entries per subsidiary')
+    missing_parser.add_argument('period', help = 'Reporting period')
+    missing_parser.add_argument('--previous', help = 'Period to compare with (default: the latest period before it)')
+    missing_parser.add_argument('--subsidiary', help = 'Subsidiary (default: every subsidiary)')
+
+    args = parser.parse_args(argv)
+
+    store_path = args.store
+    if store_path is None:
+        with open('settings.json', 'r') as f:
+            store_path = json.load(f).get("History store file name", "history.sqlite")
+
+    try:
+        if args.command == 'periods':
+            rows = list_periods(store_path)
+        elif args.command == 'totals':
+            rows = scope_totals(store_path, period = args.period, subsidiary = args.subsidiary)
+        elif args.command == 'yoy':
+            rows = year_over_year(store_path, args.period, previous = args.previous, by = args.by)
+        else:
+            rows = missing_entries(store_path, args.period, previous = args.previous, subsidiary = args.subsidiary)
+    except (FileNotFoundError, sqlite3.Error) as e:
+        print(f'[history] {e}', file = sys.stderr)
+        return 1
+
+    if args.json:
+        print(json.dumps(rows, indent = 4, ensure_ascii = False))
+    else:
+        for line in _format_rows(rows):
+            print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,289 @@
+import math
+import collections
+
+from typing import List, Dict, Tuple, Any, Iterable, Sequence
+
+from openpyxl.worksheet.worksheet import Worksheet
+
+
+def build_label_index(sheet: Worksheet) -> Dict[str, Dict[str, Any]]:
+    '''
+    Summary:
+        Build a label position index for a summary sheet. Every non-empty cell in the used range
+        is normalized the same way write_data_to_summary compares it (stripped if it is a string,
+        str() otherwise) and registered under its text, together with its first and last occurrence
+        in row-major order
+
+    Args:
+        sheet (Worksheet): Summary sheet to index
+
+    Returns:
+        Dict: Normalized cell text -> {
+            'positions': [(row, col), ...],
+            'first': (row, col),
+            'last': (row, col)
+        }
+    '''
+    rows = sheet.iter_rows(min_row = 1, max_row = sheet.max_row, min_col = 1, max_col = sheet.max_column, values_only = True)
+    return build_label_index_from_rows(rows)
+
+
+def build_label_index_from_rows(rows: Iterable[Sequence[Any]]) -> Dict[str, Dict[str, Any]]:
+    '''
+    Summary:
+        Build a label position index from the cell values of a sheet, see build_label_index. Used when the
+        sheet is not loaded with openpyxl, e.g. read straight from the sheet XML (see utils/xlsx_reader.py)
+
+    Args:
+        rows (Iterable[Sequence[Any]]): Cell values per row, starting at row 1 and column 1
+
+    Returns:
+        Dict: Same as build_label_index
+    '''
+    label_index = {}
+
+    for row, values in enumerate(rows, start = 1):
+        for col, value in enumerate(values, start = 1):
+            if value is None:
+                continue
+            text = value.strip() if isinstance(value, str) else str(value)
+
+            entry = label_index.get(text)
+            if entry is None:
+                label_index[text] = {'positions': [(row, col)], 'first': (row, col), 'last': (row, col)}
+            else:
+                entry['positions'].append((row, col))
+                entry['last'] = (row, col)
+
+    return label_index
+
+
+def find_label_matches(label_index: Dict[str, Dict[str, Any]], labels: Iterable[Any]) -> Dict[Any, Dict[str, Any]]:
+    '''
+    Summary:
+        Find every indexed cell that contains each of the given labels, i.e. the cells where
+        str(label) in cell text. All labels are matched in a single pass over the distinct cell
+        texts of the index using an Aho-Corasick automaton
+
+    Args:
+        label_index (Dict): Index returned by build_label_index
+        labels (Iterable[Any]): Labels to look up, typically the keys of one scope sheet
+
+    Returns:
+        Dict: Label -> {
+            'count': number of matching cells,
+            'first': (row, col) of the first matching cell in row-major order,
+            'last': (row, col) of the last matching cell in row-major order
+        }
+        Labels without any matching cell are left out
+    '''
+    patterns = {}
+    for label in labels:
+        patterns.setdefault(str(label), []).append(label)
+
+    # An empty label is part of every cell text
+    empty_labels = patterns.pop('', [])
+
+    automaton = _build_automaton(patterns.keys())
+    pattern_matches = {}
+    for text, entry in label_index.items():
+        found = _search_automaton(automaton, text)
+        if len(empty_labels) > 0:
+            found.add('')
+        for pattern in found:
+            _merge_entry(pattern_matches, pattern, entry)
+
+    output_dict = {}
+    for pattern, pattern_labels in list(patterns.items()) + [('', empty_labels)]:
+        if pattern in pattern_matches:
+            for label in pattern_labels:
+                output_dict[label] = pattern_matches[pattern]
+
+    return output_dict
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _merge_entry(pattern_matches: Dict[str, Dict[str, Any]], pattern: str, entry: Dict[str, Any]) -> None:
+    '''
+    Add the occurrences of one indexed cell text to the running match summary of a pattern
+
+    Args:
+        pattern_matches (Dict): Pattern -> {'count', 'first', 'last'}, updated in place
+        pattern (str): Pattern that was found in the cell text
+        entry (Dict): Index entry of the cell text
+    '''
+    match = pattern_matches.get(pattern)
+    if match is None:
+        pattern_matches[pattern] = {'count': len(entry['positions']), 'first': entry['first'], 'last': entry['last']}
+    else:
+        match['count'] += len(entry['positions'])
+        match['first'] = min(match['first'], entry['first'])
+        match['last'] = max(match['last'], entry['last'])
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _build_automaton(patterns: Iterable[str]) -> Tuple[List[Dict[str, int]], List[int], List[List[str]]]:
+    '''
+    Build an Aho-Corasick automaton for the given (non-empty) patterns
+
+    Args:
+        patterns (Iterable[str]): Patterns to search for
+
+    Returns:
+        A tuple containing the following three elements:
+        - goto (List[Dict[str, int]]): Trie transitions per state
+        - fail (List[int]): Failure link per state
+        - output (List[List[str]]): Patterns that end in each state, including those reached through failure links
+    '''
+    goto = [{}]
+    fail = [0]
+    output = [[]]
+
+    for pattern in patterns:
+        state = 0
+        for char in pattern:
+            next_state = goto[state].get(char)
+            if next_state is None:
+                next_state = len(goto)
+                goto[state][char] = next_state
+                goto.append({})
+                fail.append(0)
+                output.append([])
+            state = next_state
+        output[state].append(pattern)
+
+    # Breadth-first, so that the failure link of a state is always set before its children are visited
+    queue = collections.deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for char, next_state in goto[state].items():
+            queue.append(next_state)
+            fail_state = fail[state]
+            while fail_state != 0 and char not in goto[fail_state]:
+                fail_state = fail[fail_state]
+            fail[next_state] = goto[fail_state].get(char, 0)
+            output[next_state] = output[next_state] + output[fail[next_state]]
+
+    return goto, fail, output
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _search_automaton(automaton: Tuple[List[Dict[str, int]], List[int], List[List[str]]], text: str) -> set:
+    '''
+    Find all patterns of the automaton that occur in the given text
+
+    Args:
+        automaton (Tuple): Automaton returned by _build_automaton
+        text (str): Text to search in
+
+    Returns:
+        set: Patterns found in the text
+    '''
+    goto, fail, output = automaton
+    found = set()
+    state = 0
+
+    for char in text:
+        while state != 0 and char not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(char, 0)
+        if output[state]:
+            found.update(output[state])
+
+    return found
+
+
+def build_trigram_index(label_index: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    '''
+    Summary:
+        Build a trigram inverted index over the text labels of a label index (see build_label_index), to look up
+        the labels that are most similar to a label without a match (see suggest_labels). Cells without any
+        letter (e.g. numbers) are left out. Built once per summary sheet
+
+    Args:
+        label_index (Dict): Index returned by build_label_index
+
+    Returns:
+        Dict: Trigram index with the structure
+        {
+            'labels': [label text, ...],
+            'positions': [(row, col) of the first cell with each label, ...],
+            'trigrams': [distinct trigrams of each label, ...],
+            'postings': {trigram: [ids of the labels that contain it, ...]}
+        }
+    '''
+    trigram_index = {'labels': [], 'positions': [], 'trigrams': [], 'postings': {}}
+    for text, entry in label_index.items():
+        if not any(char.isalpha() for char in text):
+            continue
+        label_id = len(trigram_index['labels'])
+        trigrams = _trigrams(text)
+        trigram_index['labels'].append(text)
+        trigram_index['positions'].append(entry['first'])
+        trigram_index['trigrams'].append(trigrams)
+        for trigram in trigrams:
+            trigram_index['postings'].setdefault(trigram, []).append(label_id)
+    return trigram_index
+
+
+def suggest_labels(trigram_index: Dict[str, Any], label: Any, top_k: int = 3, min_score: float = 0.3) -> List[Tuple[str, float, Tuple[int, int]]]:
+    '''
+    Summary:
+        Find the labels of a trigram index that are most similar to a label, scored by the Dice coefficient
+        of their trigrams (2 * shared trigrams / total trigrams). The shared trigrams are counted through the
+        postings of the trigrams of the label, so only the labels that share a trigram with it are looked at,
+        not the whole sheet. Labels that share too few trigrams to reach min_score are skipped before scoring
+
+    Args:
+        trigram_index (Dict): Index returned by build_trigram_index
+        label (Any): Label to find similar labels for, e.g. an entry name without a match
+        top_k (int): Maximum number of suggestions
+        min_score (float): Suggestions with a lower score are left out
+
+    Returns:
+        List[Tuple[str, float, Tuple[int, int]]]: (label text, score, (row, col) of its first cell) per suggestion,
+        best first. Ties are broken by position in the sheet
+    '''
+    trigrams = _trigrams(str(label).strip())
+    if len(trigrams) == 0 or top_k <= 0:
+        return []
+
+    shared = collections.Counter()
+    for trigram in trigrams:
+        shared.update(trigram_index['postings'].get(trigram, ()))
+
+    # 2 * shared >= min_score * (len(trigrams) + label trigrams) and label trigrams >= shared give this bound,
+    # minus a rounding margin
+    min_overlap = math.ceil(min_score * len(trigrams) / (2 - min_score) - 1e-9) if min_score < 2 else math.inf
+    suggestions = []
+    for label_id, count in shared.items():
+        if count < min_overlap:
+            continue
+        score = 2 * count / (len(trigrams) + len(trigram_index['trigrams'][label_id]))
+        if score >= min_score:
+            suggestions.append((trigram_index['labels'][label_id], round(score, 3), trigram_index['positions'][label_id]))
+    suggestions.sort(key = lambda suggestion: (-suggestion[1], suggestion[2]))
+    return suggestions[:top_k]
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _trigrams(text: str) -> set:
+    '''
+    Get the distinct trigrams of a text, case-insensitive and with punctuation and whitespace collapsed into
+    single spaces. The text is padded with spaces, so that short labels have trigrams too and the start and
+    end of a word weigh in
+
+    Args:
+        text (str): Text to split
+
+    Returns:
+        set: Trigrams of the text
+    '''
+    text = ' ' + ' '.join(''.join(char if char.isalnum() else ' ' for char in text.lower()).split()) + ' '
+    if len(text) <= 2:
+        return set()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
@@ -0,0 +1,192 @@
+import sys
+import json
+import time
+import logging
+import threading
+
+from typing import Dict, Union, Any
+
+
+# Handler that counts the warnings of the current run, see configure_logging
+_warning_summary_handler = None
+
+# Event of the end-of-run warning summary, which is always shown
+WARNING_SUMMARY_EVENT = 'warning summary'
+
+
+def configure_logging(settings: Union[Dict[str, Any], None] = None) -> None:
+    '''
+    Summary:
+        Set up logging for a run. Every module logs to its own logger (logging.getLogger(__name__)),
+        and this function attaches a single console handler to the root logger:
+        - settings["Log level"]: DEBUG, INFO, WARNING or ERROR (default: INFO)
+        - settings["Log format"]: "text" for readable lines, or "json" for one JSON object per line
+        - settings["Repeated warnings shown"]: how many warnings of the same kind are printed before
+          the rest are only counted (default: 5). All of them are listed by log_warning_summary
+
+    Args:
+        settings (Dict, optional): Script settings dictionary
+    '''
+    global _warning_summary_handler
+    settings = settings or {}
+
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        if getattr(handler, '_excel_env_handler', False):
+            root_logger.removeHandler(handler)
+
+    repeated_warning_filter = RepeatedWarningFilter(settings.get("Repeated warnings shown", 5))
+    console_handler = logging.StreamHandler(sys.stderr)
+    if settings.get("Log format", "text") == "json":
+        console_handler.setFormatter(JsonFormatter(notes = repeated_warning_filter))
+    else:
+        console_handler.setFormatter(TextFormatter('%(levelname)s [%(funcName)s] %(message)s', notes = repeated_warning_filter))
+    console_handler.addFilter(repeated_warning_filter)
+    console_handler._excel_env_handler = True
+
+    _warning_summary_handler = WarningSummaryHandler()
+    _warning_summary_handler._excel_env_handler = True
+
+    root_logger.addHandler(_warning_summary_handler)
+    root_logger.addHandler(console_handler)
+    root_logger.setLevel(getattr(logging, str(settings.get("Log level", "INFO")).upper(), logging.INFO))
+
+
+def log_warning_summary(logger: logging.Logger) -> Dict[str, int]:
+    '''
+    Summary:
+        Log one end-of-run summary of all warnings since configure_logging was called,
+        counted per kind of warning (the 'event' passed in extra, or the message template)
+
+    Args:
+        logger (logging.Logger): Logger to write the summary to
+
+    Returns:
+        Dict[str, int]: Kind of warning -> number of occurrences
+    '''
+    if _warning_summary_handler is None:
+        return {}
+
+    counts = dict(_warning_summary_handler.counts)
+    if len(counts) == 0:
+        logger.info('Run finished without warnings')
+    else:
+        details = ', '.join(f'{event}: {count}' for event, count in sorted(counts.items(), key = lambda item: -item[1]))
+        logger.warning(f'Run finished with {sum(counts.values())} warnings ({details})', extra = {'event': WARNING_SUMMARY_EVENT, 'data': {'warnings': counts}})
+    return counts
+
+
+class TextFormatter(logging.Formatter):
+    '''
+    Formats each record as a readable line, with the note of a RepeatedWarningFilter appended to the
+    last warning of each kind that it lets through
+    '''
+    def __init__(self, fmt: str, notes: Union['RepeatedWarningFilter', None] = None):
+        super().__init__(fmt)
+        self.notes = notes
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        message = super().formatMessage(record)
+        note = self.notes.pop_note(record) if self.notes is not None else None
+        return message if note is None else f'{message} ({note})'
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+    Formats each record as a single JSON line with the time, level, logger, function and message,
+    plus the 'event' and 'data' fields when they are passed in extra, and the 'note' of a RepeatedWarningFilter
+    '''
+    def __init__(self, notes: Union['RepeatedWarningFilter', None] = None):
+        super().__init__()
+        self.notes = notes
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'function': record.funcName,
+            'message': record.getMessage()
+        }
+        note = self.notes.pop_note(record) if self.notes is not None else None
+        if note is not None:
+            entry['note'] = note
+        if hasattr(record, 'event'):
+            entry['event'] = record.event
+        if hasattr(record, 'data'):
+            entry['data'] = record.data
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default = str, ensure_ascii = False)
+
+
+class RepeatedWarningFilter(logging.Filter):
+    '''
+    Lets through the first max_repeats warnings of each kind and drops the rest,
+    so that e.g. a long list of mismatches does not bury the other warnings. The last warning of a kind
+    that is let through gets a note that the rest are only counted. The note is added by the formatter
+    (see pop_note), the record itself is left unchanged for the other handlers
+    '''
+    def __init__(self, max_repeats: int):
+        super().__init__()
+        self.max_repeats = max_repeats
+        self.counts = {}
+        self._notes = {} # id(record) -> (record, note) of the records whose note is not formatted yet
+        self._lock = threading.Lock() # Records can be logged from several threads
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.WARNING or getattr(record, 'event', None) == WARNING_SUMMARY_EVENT:
+            return True
+        event = _event_name(record)
+        with self._lock:
+            count = self.counts[event] = self.counts.get(event, 0) + 1
+            if count == self.max_repeats:
+                self._notes[id(record)] = (record, f'further "{event}" warnings are only counted, see the summary at the end of the run')
+        return count <= self.max_repeats
+
+    def pop_note(self, record: logging.LogRecord) -> Union[str, None]:
+        '''
+        Summary:
+            Get the note of a record that was let through, once
+
+        Args:
+            record (logging.LogRecord): Log record being formatted
+
+        Returns:
+            str or None: The note if the record is the last shown warning of its kind, else None
+        '''
+        with self._lock:
+            noted = self._notes.get(id(record))
+            if noted is None or noted[0] is not record:
+                return None
+            del self._notes[id(record)]
+        return noted[1]
+
+
+class WarningSummaryHandler(logging.Handler):
+    '''
+    Counts the warnings per kind, for log_warning_summary
+    '''
+    def __init__(self):
+        super().__init__(level = logging.WARNING)
+        self.counts = {}
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.levelno == logging.WARNING:
+            event = _event_name(record)
+            self.counts[event] = self.counts.get(event, 0) + 1
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _event_name(record: logging.LogRecord) -> str:
+    '''
+    Get the kind of warning of a record: its 'event' if one was passed in extra, else the message template
+
+    Args:
+        record (logging.LogRecord): Log record
+
+    Returns:
+        str: Kind of warning
+    '''
+    return getattr(record, 'event', None) or str(record.msg)
@@ -0,0 +1,181 @@
+import os
+import json
+import logging
+
+from typing import List, Dict, Tuple, Any
+
+
+logger = logging.getLogger(__name__)
+
+# Bump when the match scores or the candidate rules (top_k, margin) change, so that older candidates are not reused
+MATCH_STORE_VERSION = 1
+
+# Candidate rules, see find_top_candidates
+TOP_K = 5
+MARGIN = 0.1
+
+
+def load_match_store(store_path: str) -> Dict[str, Any]:
+    '''
+    Summary:
+        Load the match store from disk. A missing, unreadable or outdated store gives an empty store,
+        but the manual pins of an outdated store are kept
+
+    Args:
+        store_path (str): Path to the match store file
+
+    Returns:
+        Dict[str, Any]: Match store dictionary with the structure
+        {
+            'version': MATCH_STORE_VERSION,
+            'pins': {
+                'input folder name': 'summary sheet name', # Manual matches, edit these in the file
+            },
+            'sheets': [sorted summary sheet names that the candidates were found among],
+            'candidates': {
+                'input folder name': [['summary sheet name', score], ...] # See find_top_candidates
+            }
+        }
+    '''
+    empty_store = {'version': MATCH_STORE_VERSION, 'pins': {}, 'sheets': [], 'candidates': {}}
+    try:
+        with open(store_path, 'r', encoding = 'utf-8') as f:
+            store = json.load(f)
+    except FileNotFoundError:
+        return empty_store
+    except Exception as e:
+        logger.warning('Could not read %s, starting with an empty match store: %r', store_path, e)
+        return empty_store
+
+    if not isinstance(store, dict):
+        return empty_store
+    empty_store['pins'] = dict(store.get('pins', {}))
+    if store.get('version') != MATCH_STORE_VERSION:
+        return empty_store
+    return store
+
+
+def save_match_store(store: Dict[str, Any], store_path: str) -> None:
+    '''
+    Summary:
+        Save the match store to disk as readable JSON, so that the pins can be edited by hand.
+        The file is replaced atomically
+
+    Args:
+        store (Dict[str, Any]): Match store dictionary (see load_match_store)
+        store_path (str): Path to the match store file
+    '''
+    temp_path = store_path + '.tmp'
+    try:
+        with open(temp_path, 'w', encoding = 'utf-8') as f:
+            json.dump(store, f, indent = 4, ensure_ascii = False)
+        os.replace(temp_path, store_path)
+    except Exception as e:
+        logger.warning('Could not write %s: %r', store_path, e)
+
+
+def get_match_candidates(store: Dict[str, Any], items: List[str], sheets: List[str]) -> Dict[str, List[Tuple[str, float]]]:
+    '''
+    Summary:
+        Get the top match candidates of each item among the sheets, the same as find_top_candidates, but only
+        computing what the store does not know yet. The store is updated in place:
+        - items that are new to the store are matched against every sheet
+        - if sheets were added since the last run, the stored items are only matched against the added sheets
+        - items with a candidate sheet that was removed (or renamed) are matched against every sheet again
+        Items that are not asked for while the sheets changed are dropped, since their candidates cannot be kept up to date
+
+    Args:
+        store (Dict[str, Any]): Match store dictionary (see load_match_store)
+        items (List[str]): Strings to find matches for, e.g. input folder names
+        sheets (List[str]): Strings to match against, e.g. summary sheet names
+
+    Returns:
+        Dict[str, List[Tuple[str, float]]]: Item -> list of (sheet, score) sorted by descending score
+    '''
+    # Imported here, since NumPy is slow to import and is only needed when something is matched
+    from .matching import find_top_candidates
+
+    candidates = store['candidates']
+    sorted_sheets = sorted(set(sheets))
+    old_sheets = set(store['sheets'])
+    new_sheets = set(sorted_sheets)
+
+    if new_sheets != old_sheets:
+        removed = old_sheets - new_sheets
+        added = sorted(new_sheets - old_sheets)
+        asked = set(items)
+        for item in list(candidates):
+            if item not in asked or any(sheet in removed for sheet, _ in candidates[item]):
+                del candidates[item]
+
+        stale = [item for item in sorted(asked) if item in candidates]
+        if len(stale) > 0 and len(added) > 0:
+            for item, added_candidates in zip(stale, find_top_candidates(stale, added, top_k = TOP_K, margin = MARGIN)):
+                candidates[item] = _merge_candidates(item, candidates[item], [(added[j], score) for j, score in added_candidates])
+        if len(old_sheets) > 0:
+            logger.info('Summary sheets changed (%d added, %d removed), %d stored matches kept', len(added), len(removed), len(stale))
+        store['sheets'] = sorted_sheets
+
+    missing = sorted({item for item in items if item not in candidates})
+    if len(missing) > 0:
+        for item, item_candidates in zip(missing, find_top_candidates(missing, sorted_sheets, top_k = TOP_K, margin = MARGIN)):
+            candidates[item] = [[sorted_sheets[j], score] for j, score in item_candidates]
+    logger.debug('%d of %d match candidates served from the match store', len(set(items)) - len(missing), len(set(items)))
+
+    return {item: [(sheet, score) for sheet, score in candidates[item]] for item in items}
+
+
+def get_pins(store: Dict[str, Any], items: List[str], sheets: List[str]) -> Dict[str, str]:
+    '''
+    Summary:
+        Get the manual pins of the given items. Pins to a sheet that does not exist are reported and left out,
+        and so is every pin after the first one to the same sheet
+
+    Args:
+        store (Dict[str, Any]): Match store dictionary (see load_match_store)
+        items (List[str]): Strings to find matches for, e.g. input folder names
+        sheets (List[str]): Strings to match against, e.g. summary sheet names
+
+    Returns:
+        Dict[str, str]: Item -> pinned sheet
+    '''
+    sheet_set = set(sheets)
+    pins = {}
+    for item in items:
+        sheet = store['pins'].get(item)
+        if sheet is None or item in pins:
+            continue
+        if sheet not in sheet_set:
+            logger.warning('%s is pinned to sheet %s, which does not exist', item, sheet, extra = {"event": "invalid pin"})
+        elif sheet in pins.values():
+            logger.warning('%s is pinned to sheet %s, which is already pinned to another folder', item, sheet, extra = {"event": "invalid pin"})
+        else:
+            pins[item] = sheet
+    return pins
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _merge_candidates(item: str, candidates: List[Tuple[str, float]], added_candidates: List[Tuple[str, float]]) -> List[Tuple[str, float]]:
+    '''
+    Merge the stored candidates of an item with its candidates among added sheets, with the same rules as find_top_candidates.
+    Ties are broken by sheet name, which is the order of the sorted sheet list that find_top_candidates is given
+
+    Args:
+        item (str): String that the candidates are matches for
+        candidates (List[Tuple[str, float]]): Stored candidates
+        added_candidates (List[Tuple[str, float]]): Candidates among the added sheets
+
+    Returns:
+        List[Tuple[str, float]]: Merged candidates
+    '''
+    # An exact match is the only candidate
+    if any(sheet == item for sheet, _ in candidates):
+        return candidates
+    if any(sheet == item for sheet, _ in added_candidates):
+        return [[item, 1.0]]
+
+    merged = sorted(list(candidates) + list(added_candidates), key = lambda candidate: (-candidate[1], candidate[0]))[:TOP_K]
+    if len(merged) == 0:
+        return []
+    return [[sheet, score] for sheet, score in merged if score >= merged[0][1] - MARGIN]
@@ -0,0 +1,295 @@
+import difflib
+
+import numpy as np
+
+from typing import List, Dict, Tuple
+
+
+# Upper limit for the number of elements in one batch of the character count comparison
+_BOUND_BATCH_ELEMENTS = 2 ** 24
+
+
+def find_best_matches(list_1: List[str], list_2: List[str]) -> List[Tuple[int, float]]:
+    '''
+    Summary:
+        Find the best match in list_2 for every string in list_1, using the difflib.SequenceMatcher
+        ratio. Gives exactly the same result as comparing every pair, i.e. the first string in list_2
+        with the highest ratio wins and a ratio of 0 never counts as a match, but:
+        - exact matches are resolved with a dictionary lookup
+        - the upper bounds of all pairs are computed as a batched NumPy matrix (see _ratio_upper_bounds)
+        - the exact ratio is only computed for pairs whose upper bound can still beat the best match so far
+
+    Args:
+        list_1 (List[str]): Strings to find matches for
+        list_2 (List[str]): Strings to match against
+
+    Returns:
+        List[Tuple[int, float]]: (index in list_2, ratio) per string in list_1. The index is -1 if nothing matched
+    '''
+    first_index = {}
+    for j, item_2 in enumerate(list_2):
+        first_index.setdefault(item_2, j)
+
+    best_matches = [(first_index[item], 1.0) if item in first_index else None for item in list_1]
+    remaining = [i for i, best_match in enumerate(best_matches) if best_match is None]
+    if len(remaining) == 0:
+        return best_matches
+
+    bounds = _ratio_upper_bounds([list_1[i] for i in remaining], list_2)
+    matchers = {}
+
+    for row, i in enumerate(remaining):
+        best_score = 0.0
+        best_j = -1
+        # Highest bound first, and the lowest index first among equal bounds
+        for j in np.lexsort((np.arange(len(list_2)), -bounds[row])):
+            bound = bounds[row, j]
+            if bound == 0.0 or bound < best_score or (bound == best_score and j > best_j):
+                break # No remaining candidate can beat (or tie with an earlier) best match
+            score = _ratio(matchers, list_2, list_1[i], j)
+            if score > best_score or (score == best_score and j < best_j):
+                best_score = score
+                best_j = int(j)
+        best_matches[i] = (best_j, best_score)
+
+    return best_matches
+
+
+def find_top_candidates(list_1: List[str], list_2: List[str], top_k: int = 5, margin: float = 0.1) -> List[List[Tuple[int, float]]]:
+    '''
+    Summary:
+        Find the top_k best matches in list_2 for every string in list_1 whose ratio is within margin of
+        the best match of that string, pruned with the same upper bounds as find_best_matches.
+        A string with an exact match only gets that match
+
+    Args:
+        list_1 (List[str]): Strings to find matches for
+        list_2 (List[str]): Strings to match against
+        top_k (int): Maximum number of candidates per string
+        margin (float): Maximum difference in ratio between a candidate and the best match
+
+    Returns:
+        List[List[Tuple[int, float]]]: Per string in list_1, a list of (index in list_2, ratio) sorted by
+        descending ratio. Pairs with a ratio of 0 are left out
+    '''
+    first_index = {}
+    for j, item_2 in enumerate(list_2):
+        first_index.setdefault(item_2, j)
+
+    candidates = [[(first_index[item], 1.0)] if item in first_index else None for item in list_1]
+    remaining = [i for i, candidate in enumerate(candidates) if candidate is None]
+    if len(remaining) == 0:
+        return candidates
+
+    bounds = _ratio_upper_bounds([list_1[i] for i in remaining], list_2)
+    matchers = {}
+
+    for row, i in enumerate(remaining):
+        top = []
+        for j in np.lexsort((np.arange(len(list_2)), -bounds[row])):
+            bound = bounds[row, j]
+            if bound == 0.0 or (len(top) > 0 and bound < top[0][1] - margin) or (len(top) == top_k and bound < top[-1][1]):
+                break # No remaining candidate can make it into the top
+            score = _ratio(matchers, list_2, list_1[i], j)
+            if score > 0.0:
+                top.append((int(j), score))
+                top.sort(key = lambda candidate: (-candidate[1], candidate[0]))
+                del top[top_k:]
+        candidates[i] = [(j, score) for j, score in top if score >= top[0][1] - margin]
+
+    return candidates
+
+
+def assign_matches(candidates: List[List[Tuple[int, float]]], min_score: float = 0.0) -> Dict[int, Tuple[int, float]]:
+    '''
+    Summary:
+        Solve the one-to-one matching between list_1 and list_2 as an optimal assignment, i.e. maximize the
+        total ratio over all matched pairs (Hungarian algorithm). Only candidate pairs can be matched, so a
+        string may end up without a match
+
+    Args:
+        candidates (List[List[Tuple[int, float]]]): Output of find_top_candidates
+        min_score (float): Pairs with a lower ratio are never matched
+
+    Returns:
+        Dict[int, Tuple[int, float]]: Index in list_1 -> (index in list_2, ratio)
+    '''
+    rows = sorted({i for i, candidate in enumerate(candidates) for _, score in candidate if score >= min_score})
+    cols = sorted({j for candidate in candidates for j, score in candidate if score >= min_score})
+    if len(rows) == 0:
+        return {}
+    row_position = {i: position for position, i in enumerate(rows)}
+    col_position = {j: position for position, j in enumerate(cols)}
+
+    # Pairs that are not candidates have a weight of 0, which is the same as leaving both unmatched
+    weights = np.zeros((len(rows), len(cols)))
+    for i, candidate in enumerate(candidates):
+        for j, score in candidate:
+            if score >= min_score:
+                weights[row_position[i], col_position[j]] = score
+
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError:
+        linear_sum_assignment = _linear_sum_assignment
+
+    assignment = {}
+    for row, col in zip(*linear_sum_assignment(-weights)):
+        if weights[row, col] > 0.0:
+            assignment[rows[row]] = (cols[col], float(weights[row, col]))
+
+    return assignment
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _ratio(matchers: Dict[int, difflib.SequenceMatcher], list_2: List[str], item: str, j: int) -> float:
+    '''
+    Compute SequenceMatcher(None, item, list_2[j]).ratio(), reusing one SequenceMatcher per
+    string in list_2 so that the lookup tables of the second sequence are only built once
+
+    Args:
+        matchers (Dict[int, difflib.SequenceMatcher]): Cache of matchers per index in list_2, updated in place
+        list_2 (List[str]): Strings to match against
+        item (str): String to match
+        j (int): Index in list_2 to match against
+
+    Returns:
+        float: Similarity ratio
+    '''
+    matcher = matchers.get(j)
+    if matcher is None:
+        matcher = difflib.SequenceMatcher(None)
+        matcher.set_seq2(list_2[j])
+        matchers[j] = matcher
+    matcher.set_seq1(item)
+    return matcher.ratio()
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _ratio_upper_bounds(list_1: List[str], list_2: List[str]) -> np.ndarray:
+    '''
+    Compute an upper bound of SequenceMatcher(None, a, b).ratio() for every pair of strings.
+    The bound is the same as SequenceMatcher.quick_ratio (the number of characters the two strings
+    have in common, ignoring order), which is never larger than real_quick_ratio (the length bound).
+    The character counts are compared in row batches to keep memory use bounded
+
+    Args:
+        list_1 (List[str]): First list of strings
+        list_2 (List[str]): Second list of strings
+
+    Returns:
+        np.ndarray: len(list_1) x len(list_2) matrix of upper bounds
+    '''
+    alphabet = {char: index for index, char in enumerate(sorted(set(''.join(list_1)) | set(''.join(list_2))))}
+    counts_1 = _character_counts(list_1, alphabet)
+    counts_2 = _character_counts(list_2, alphabet)
+    lengths = counts_1.sum(axis = 1)[:, None] + counts_2.sum(axis = 1)[None, :]
+
+    common = np.zeros((len(list_1), len(list_2)), dtype = np.int64)
+    batch_size = max(1, _BOUND_BATCH_ELEMENTS // max(1, len(list_2) * len(alphabet)))
+    for start in range(0, len(list_1), batch_size):
+        stop = start + batch_size
+        common[start:stop] = np.minimum(counts_1[start:stop, None, :], counts_2[None, :, :]).sum(axis = 2)
+
+    # Same formula as difflib, so that a bound equal to the ratio compares as equal
+    bounds = np.ones(common.shape)
+    nonzero_lengths = lengths > 0
+    bounds[nonzero_lengths] = 2.0 * common[nonzero_lengths] / lengths[nonzero_lengths]
+    return bounds
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _character_counts(strings: List[str], alphabet: Dict[str, int]) -> np.ndarray:
+    '''
+    Count the characters of each string
+
+    Args:
+        strings (List[str]): Strings to count the characters of
+        alphabet (Dict[str, int]): Character -> column index
+
+    Returns:
+        np.ndarray: len(strings) x len(alphabet) matrix of character counts
+    '''
+    counts = np.zeros((len(strings), len(alphabet)), dtype = np.int32)
+    for row, string in enumerate(strings):
+        for char in string:
+            counts[row, alphabet[char]] += 1
+    return counts
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _linear_sum_assignment(cost: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Minimum cost assignment for a rectangular cost matrix (Hungarian algorithm with potentials,
+    O(n^2 m) with the inner loop vectorized). Used when SciPy is not installed, with the same
+    interface as scipy.optimize.linear_sum_assignment
+
+    Args:
+        cost (np.ndarray): n x m cost matrix
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Row indices and the column indices assigned to them
+    '''
+    cost = np.asarray(cost, dtype = float)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+
+    # 1-based, column 0 is a virtual column used as the root of each augmenting path
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype = int) # p[j] is the row assigned to column j, 0 if none
+    way = np.zeros(m + 1, dtype = int)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype = bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used
+            free[0] = False
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            improved = free[1:] & (reduced < minv[1:])
+            minv[1:][improved] = reduced[improved]
+            way[1:][improved] = j0
+
+            masked = np.where(free, minv, np.inf)
+            j1 = int(np.argmin(masked))
+            delta = masked[j1]
+
+            used_columns = np.nonzero(used)[0]
+            u[p[used_columns]] += delta
+            v[used_columns] -= delta
+            minv[free] -= delta
+
+            j0 = j1
+            if p[j0] == 0:
+                break
+
+        # Flip the augmenting path
+        while j0 != 0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    rows = []
+    cols = []
+    for j in range(1, m + 1):
+        if p[j] != 0:
+            rows.append(p[j] - 1)
+            cols.append(j - 1)
+    rows = np.array(rows, dtype = int)
+    cols = np.array(cols, dtype = int)
+
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
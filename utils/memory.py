@@ -0,0 +1,303 @@
+import os
+import sys
+import json
+import time
+import tracemalloc
+import contextlib
+import logging
+
+from typing import List, Dict, Union, Tuple, Any, Set, Iterator
+
+from .profiling import scanned_cells
+
+
+logger = logging.getLogger(__name__)
+
+# Estimated peak memory per byte of input file while it is read, per (reader backend, streaming reads).
+# Measured with tracemalloc on generated corpora, openpyxl keeps the whole workbook in memory unless it streams
+MEMORY_EXPANSION = {
+    ("openpyxl", False): 60,
+    ("openpyxl", True): 15,
+    ("xml", False): 25,
+    ("xml", True): 25
+}
+
+# Estimated memory used to read any input file, whatever its size
+MEMORY_OVERHEAD = 2**20
+
+
+def plan_reads(file_paths: List[str], workers: int, streaming: bool, backend: str, budget: int) -> Tuple[int, Set[str]]:
+    '''
+    Summary:
+        Fit the reading of the input files into a memory budget:
+        - files whose estimated memory use is larger than their share of the budget (budget / workers)
+          are read with streaming reads
+        - the number of workers, i.e. the number of workbooks that are open at once, is lowered until
+          the largest files fit into the budget together
+        Files that do not fit into the budget on their own are reported, and read anyway
+
+    Args:
+        file_paths (List[str]): Paths to the input files
+        workers (int): Number of worker processes, see _get_read_settings
+        streaming (bool): Whether streaming reads are already used for every file
+        backend (str): Name of the reader backend
+        budget (int): Memory budget in bytes, 0 for no budget
+
+    Returns:
+        Tuple[int, Set[str]]: Number of workers to use, and the files to read with streaming reads
+    '''
+    if budget <= 0 or len(file_paths) == 0:
+        return workers, set()
+
+    estimates = {file_path: estimate_read_memory(file_path, streaming, backend) for file_path in file_paths}
+    streaming_files = set()
+    if not streaming:
+        for file_path, estimate in estimates.items():
+            if estimate > budget / workers:
+                streaming_files.add(file_path)
+                estimates[file_path] = estimate_read_memory(file_path, True, backend)
+
+    for file_path, estimate in estimates.items():
+        if estimate > budget:
+            logger.warning('%s needs about %d MB to read, more than the memory budget of %d MB', file_path, estimate // 2**20, budget // 2**20, extra = {"event": "over memory budget", "data": {"file": file_path}})
+
+    largest = sorted(estimates.values(), reverse = True)
+    planned_workers = workers
+    while planned_workers > 1 and sum(largest[:planned_workers]) > budget:
+        planned_workers -= 1
+
+    if planned_workers < workers or len(streaming_files) > 0:
+        logger.info('Memory budget of %d MB: %d of %d workers, %d files read with streaming reads', budget // 2**20, planned_workers, workers, len(streaming_files))
+    return planned_workers, streaming_files
+
+
+def estimate_read_memory(file_path: str, streaming: bool, backend: str) -> int:
+    '''
+    Summary:
+        Estimate the peak memory use of reading an input file, from its size (see MEMORY_EXPANSION)
+
+    Args:
+        file_path (str): Path to the input file
+        streaming (bool): Whether the file is read with streaming reads
+        backend (str): Name of the reader backend
+
+    Returns:
+        int: Estimated bytes
+    '''
+    try:
+        size = os.path.getsize(file_path)
+    except OSError:
+        return 0
+    return MEMORY_OVERHEAD + size * MEMORY_EXPANSION.get((backend, streaming), MEMORY_EXPANSION[("openpyxl", False)])
+
+
+def current_rss() -> Union[int, None]:
+    '''
+    Summary:
+        Get the resident set size (RSS) of this process, from /proc on Linux or with psutil if it is installed
+
+    Returns:
+        int or None: Bytes, or None if it cannot be measured on this platform
+    '''
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def peak_rss() -> Union[int, None]:
+    '''
+    Summary:
+        Get the highest resident set size (RSS) of this process so far
+
+    Returns:
+        int or None: Bytes, or None if it cannot be measured on this platform (e.g. on Windows)
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def start_memory_report(settings: Dict) -> Union[Dict[str, Any], None]:
+    '''
+    Summary:
+        Start a memory report if settings["Memory report"] is True. Starts tracemalloc, which slows the run down
+
+    Args:
+        settings (Dict): Script settings dictionary
+
+    Returns:
+        Dict[str, Any] or None: Memory report dictionary with the structure below, or None if there is no report
+        {
+            'memory budget (MB)': settings["Memory budget (MB)"],
+            'stages': {
+                'stage name': {'seconds': ..., 'rss before (MB)': ..., 'rss after (MB)': ..., 'peak rss (MB)': ..., 'tracemalloc peak (MB)': ...}
+            },
+            'files': {
+                'file path': {'size (MB)': ..., 'streaming': ..., 'seconds': ..., 'rss after (MB)': ..., 'peak rss (MB)': ..., 'tracemalloc peak (MB)': ...}
+                # The tracemalloc peak of a file is the memory used while reading it, on top of what was in use before
+            },
+            'over budget': [stages and files whose peak was larger than the budget]
+        }
+    '''
+    if not settings.get("Memory report", False):
+        return None
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return {'memory budget (MB)': settings.get("Memory budget (MB)", 0), 'stages': {}, 'files': {}, 'over budget': []}
+
+
+@contextlib.contextmanager
+def measure_stage(report: Union[Dict[str, Any], None], stage: str) -> Iterator[None]:
+    '''
+    Summary:
+        Measure the time and memory use of a stage of the run and add it to the memory report.
+        Does nothing if there is no report
+
+    Args:
+        report (Dict[str, Any], optional): Memory report, see start_memory_report
+        stage (str): Name of the stage
+    '''
+    if report is None:
+        yield
+        return
+
+    tracemalloc.reset_peak()
+    rss_before = current_rss()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = {
+            'seconds': time.perf_counter() - start,
+            'rss before (MB)': _to_mb(rss_before),
+            'rss after (MB)': _to_mb(current_rss()),
+            'peak rss (MB)': _to_mb(peak_rss()),
+            'tracemalloc peak (MB)': _to_mb(tracemalloc.get_traced_memory()[1])
+        }
+        report['stages'][stage] = stats
+        _check_budget(report, stage, stats)
+
+
+def measure_file_read(read: Any, file_path: str, *args: Any, trace_memory: bool = True) -> Tuple[Dict, Union[Tuple[str, str], None], Dict[str, Any]]:
+    '''
+    Summary:
+        Read an input file and measure the time and memory it took, and count the cells scanned and the keys extracted
+        (see utils/profiling.py). Runs in the process that reads the file, which can be a worker process, so tracemalloc
+        is started there if needed
+
+    Args:
+        read (Callable): Function that reads the file, e.g. _read_input_file
+        file_path (str): Path to the input file
+        *args: Passed on to read after the file path, starting with streaming
+        trace_memory (bool): If False, the memory is not traced with tracemalloc, which is faster
+
+    Returns:
+        The result of read, followed by the measurements of the file (see start_memory_report and start_run_report)
+    '''
+    if trace_memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        traced_before = tracemalloc.get_traced_memory()[0]
+    cells_before = scanned_cells()
+    start = time.perf_counter()
+    scope_data, warning = read(file_path, *args)
+    seconds = time.perf_counter() - start
+    try:
+        size = os.path.getsize(file_path)
+    except OSError:
+        size = None
+    stats = {
+        'size (MB)': _to_mb(size),
+        'streaming': bool(args[0]) if len(args) > 0 else False,
+        'seconds': seconds,
+        'rss after (MB)': _to_mb(current_rss()),
+        'peak rss (MB)': _to_mb(peak_rss()),
+        'tracemalloc peak (MB)': _to_mb(tracemalloc.get_traced_memory()[1] - traced_before) if trace_memory else None,
+        'bytes read': size,
+        'cells scanned': scanned_cells() - cells_before,
+        # Keys that occur more than once in a sheet are counted once per occurrence
+        'keys extracted': sum(len(sheet_data) + sum(len(occurrences) - 1 for occurrences in getattr(sheet_data, 'repeats', {}).values()) for sheet_data in scope_data.values())
+    }
+    return scope_data, warning, stats
+
+
+def add_file_stats(report: Union[Dict[str, Any], None], file_path: str, stats: Dict[str, Any]) -> None:
+    '''
+    Summary:
+        Add the measurements of a file read (see measure_file_read) to the memory report
+
+    Args:
+        report (Dict[str, Any], optional): Memory report, see start_memory_report
+        file_path (str): Path to the input file
+        stats (Dict[str, Any]): Measurements of the file
+    '''
+    if report is None:
+        return
+    report['files'][file_path] = {field: value for field, value in stats.items() if field not in ('bytes read', 'cells scanned', 'keys extracted')}
+    _check_budget(report, file_path, stats)
+
+
+def save_memory_report(report: Union[Dict[str, Any], None], settings: Dict) -> Union[str, None]:
+    '''
+    Summary:
+        Save the memory report as JSON to settings["Memory report file name"] in the output folder,
+        with the files sorted by their tracemalloc peak, largest first
+
+    Args:
+        report (Dict[str, Any], optional): Memory report, see start_memory_report
+        settings (Dict): Script settings dictionary
+
+    Returns:
+        str or None: Path to the report, or None if nothing was saved
+    '''
+    if report is None:
+        return None
+
+    report['files'] = dict(sorted(report['files'].items(), key = lambda item: -(item[1]['tracemalloc peak (MB)'] or 0)))
+    file_path = os.path.join(settings["Output file folder path"], settings["Memory report file name"])
+    temp_path = file_path + '.tmp'
+    try:
+        with open(temp_path, 'w', encoding = 'utf-8') as f:
+            json.dump(report, f, indent = 4, ensure_ascii = False)
+        os.replace(temp_path, file_path)
+    except OSError as e:
+        logger.error('Could not write the memory report to %s: %s', file_path, e)
+        return None
+
+    if len(report['over budget']) > 0:
+        logger.warning('%d stages or files used more than the memory budget of %s MB, see %s', len(report['over budget']), report['memory budget (MB)'], file_path, extra = {"event": "over memory budget"})
+    logger.info('Memory report saved to %s', file_path)
+    return file_path
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _check_budget(report: Dict[str, Any], name: str, stats: Dict[str, Any]) -> None:
+    '''
+    Add a stage or file to report['over budget'] if its tracemalloc peak was larger than the memory budget.
+    The peak RSS is not used, since it only ever grows during a run
+    '''
+    budget = report['memory budget (MB)']
+    if budget > 0 and (stats['tracemalloc peak (MB)'] or 0) > budget:
+        report['over budget'].append(name)
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _to_mb(value: Union[int, None]) -> Union[float, None]:
+    '''
+    Convert bytes to megabytes, rounded to 0.01 MB
+    '''
+    return None if value is None else round(value / 2**20, 2)
@@ -0,0 +1,206 @@
+import queue
+import threading
+import multiprocessing
+import logging
+
+from openpyxl import Workbook
+
+from typing import List, Dict, Union
+
+import concurrent.futures
+
+from .util import _get_file_jobs, _get_read_settings, _get_memory_budget, _read_input_file, compute_summary_writes, apply_summary_writes, \
+    load_summary_write_maps, save_summary_write_maps
+from .cache import load_parse_cache, save_parse_cache, get_cached_scope_data, put_cached_scope_data
+from .export import build_activity_table, export_activity_data
+from .history import save_run_history
+from .memory import plan_reads, measure_file_read, add_file_stats
+from .profiling import add_file_profile, add_cached_file
+
+
+logger = logging.getLogger(__name__)
+
+
+def run_pipeline(input_file_paths: Union[List[str], str], matches: Dict, wb: Workbook, settings: Dict, save: bool = True, report: Union[Dict, None] = None,
+                 run_report: Union[Dict, None] = None) -> int:
+    '''
+    Summary:
+        Read the input files and write their data to the summary workbook in overlapping stages,
+        instead of reading every file before writing anything:
+        - read: settings["Pipeline read threads"] threads read the raw file contents
+        - extract: the scope data is extracted from the contents in a process pool
+          (settings["Ingestion workers"] processes, see get_input_data)
+        - write: the calling thread computes the summary writes of each subsidiary as soon as its files are extracted
+        At most settings["Pipeline files in flight"] files are read but not yet written at any time, which caps the memory use.
+        The files are written in input order, so the output is the same as get_input_data followed by write_data_to_summary.
+        The activity data export (see utils/export.py) and the history store (see utils/history.py) are built along the way.
+        settings["Memory budget (MB)"] lowers the number of extract processes and streams large files, the same as get_input_data.
+        The extract processes are only started if there are files to extract, e.g. not when every file is served from the
+        parse cache. settings["Sharded summary"] is not used, since the writes are computed as the files come in
+
+    Args:
+        input_file_paths (Union[List[str], str]): List of paths to the input files
+        matches (Dict): Dictionary with the matches between the input and output data
+        wb (openpyxl.Workbook): The summary workbook to write to
+        settings (Dict): Script settings dictionary
+        save (bool): If True, save the summary workbook as settings["Output file name"] and close it
+        report (Dict, optional): Memory report to add the measurements of each file read to (see start_memory_report)
+        run_report (Dict, optional): Run report to add the measurements of each file read and each subsidiary to (see start_run_report)
+
+    Returns:
+        int: Status code, 0 if successful
+    '''
+    if settings.get("Sharded summary", False):
+        logger.warning('"Sharded summary" is not used in a pipelined run, the summary writes are computed as the input files are extracted')
+
+    file_jobs = _get_file_jobs(input_file_paths, matches)
+    workers, streaming, backend = _get_read_settings(settings)
+    read_threads = max(1, settings.get("Pipeline read threads", 2))
+    in_flight = max(1, settings.get("Pipeline files in flight", 4))
+
+    # Serve unchanged files from the parse cache, these skip the read and extract stages
+    cached = {}
+    cache = None
+    if settings.get("Use parse cache", False):
+        content_hash = settings.get("Parse cache content hash", False)
+        cache = load_parse_cache(settings["Parse cache file name"])
+        for index, (_, file_path) in enumerate(file_jobs):
+            scope_data = get_cached_scope_data(cache, file_path, content_hash = content_hash)
+            if scope_data is not None:
+                cached[index] = (scope_data, None)
+                add_cached_file(run_report, file_path)
+        logger.info('%d of %d input files served from the parse cache', len(cached), len(file_jobs))
+
+    # A subsidiary is written once its last file is extracted, in the order in which the subsidiaries first appear
+    last_index = {input_data_key: index for index, (input_data_key, _) in enumerate(file_jobs)}
+    key_order = list(last_index) # Dicts keep the order in which the keys were first inserted
+
+    files_to_read = [file_path for index, (_, file_path) in enumerate(file_jobs) if index not in cached]
+    workers, streaming_files = plan_reads(files_to_read, workers, streaming, backend, _get_memory_budget(settings))
+
+    jobs = queue.Queue()
+    for index, (_, file_path) in enumerate(file_jobs):
+        if index not in cached:
+            jobs.put((index, file_path, streaming or file_path in streaming_files))
+    extracted = queue.Queue(maxsize = in_flight) # (index, future) of the files that are being extracted
+    slots = threading.Semaphore(in_flight)
+    stop = threading.Event()
+
+    # Forking while the reader threads run can deadlock, so the worker processes are started from a fork server,
+    # or spawned where there is none (e.g. on Windows)
+    executor = None
+    if len(files_to_read) > 0:
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers = min(workers, len(files_to_read)), mp_context = context)
+    readers = [
+        threading.Thread(target = _read_files, args = (jobs, extracted, slots, stop, executor, backend, report is not None or run_report is not None, report is not None), daemon = True)
+        for _ in range(min(read_threads, jobs.qsize()))
+    ]
+    for reader in readers:
+        reader.start()
+
+    writes = []
+    state = {'write_maps': load_summary_write_maps(settings), 'subsidiary stats': None if run_report is None else run_report['subsidiaries']} # Running state of compute_summary_writes
+    input_data = {}
+    sources = {}
+    export = settings.get("Export format", "none") != "none" or settings.get("Use history store", False)
+    table = build_activity_table({}, {}, {}) # Empty table, the subsidiaries are added as they are written
+    failures = []
+    pending = {}
+    next_key = 0
+    try:
+        for index, (input_data_key, file_path) in enumerate(file_jobs):
+            if index in cached:
+                scope_data, warning = cached.pop(index)
+            else:
+                while index not in pending:
+                    extracted_index, future = extracted.get()
+                    pending[extracted_index] = future
+                try:
+                    result = pending.pop(index).result()
+                    scope_data, warning = result[:2]
+                    if len(result) > 2:
+                        add_file_stats(report, file_path, result[2])
+                        add_file_profile(run_report, file_path, result[2])
+                except Exception as e:
+                    # A worker that dies (e.g. out of memory) only fails its own file
+                    scope_data, warning = {}, ('unreadable input file', f'Could not read {file_path}: {e!r}')
+                slots.release()
+                if cache is not None and warning is None:
+                    put_cached_scope_data(cache, file_path, scope_data, content_hash = content_hash)
+
+            input_data[input_data_key] = scope_data
+            sources[input_data_key] = file_path
+            if warning is not None:
+                failures.append(file_path)
+                event, message = warning
+                logger.warning(message, extra = {"event": event, "data": {"file": file_path}})
+
+            while next_key < len(key_order) and last_index[key_order[next_key]] <= index:
+                input_data_key = key_order[next_key]
+                data_dict = {input_data_key: input_data.pop(input_data_key)}
+                targets = {}
+                writes += compute_summary_writes(data_dict, wb, matches, settings, state, targets)
+                if export:
+                    build_activity_table(data_dict, sources, targets, table)
+                next_key += 1
+    finally:
+        stop.set()
+        if executor is not None:
+            executor.shutdown(wait = True, cancel_futures = True)
+
+    if cache is not None:
+        save_parse_cache(cache, settings["Parse cache file name"], max_bytes = int(settings.get("Parse cache max size (MB)", 256) * 1024 * 1024))
+
+    if len(failures) > 0:
+        logger.warning('%d of %d input files could not be read', len(failures), len(file_jobs))
+
+    save_summary_write_maps(state['write_maps'], settings)
+    status = apply_summary_writes(writes, wb, settings, save = save)
+    if export:
+        export_activity_data(table, settings)
+        save_run_history(table, settings)
+    return status
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _read_files(jobs: queue.Queue, extracted: queue.Queue, slots: threading.Semaphore, stop: threading.Event,
+                executor: concurrent.futures.Executor, backend: str, measure: bool = False, trace_memory: bool = False) -> None:
+    '''
+    Read stage of run_pipeline. Takes files from jobs until it is empty, reads their contents
+    and submits the extraction to the executor. A slot is taken before each file and
+    released by the writer, so that at most as many files as there are slots are in flight
+
+    Args:
+        jobs (queue.Queue): (index, file path, whether to use streaming reads) of the files to read
+        extracted (queue.Queue): Receives (index, future of the result of _read_input_file) per file,
+        followed by the measurements of the file if measure is True (see measure_file_read)
+        slots (threading.Semaphore): Files in flight
+        stop (threading.Event): Set when the pipeline stops, e.g. after an error in the writer
+        executor (concurrent.futures.Executor): Executor of the extract stage
+        backend (str): Passed on to _read_input_file
+        measure (bool): If True, measure the time and counters of each file read
+        trace_memory (bool): If True, also measure the memory of each file read
+    '''
+    while not stop.is_set():
+        # Take the slot before the job, so that the files are in flight in input order and the writer never waits on a file without a slot
+        if not slots.acquire(timeout = 0.1):
+            continue
+        try:
+            index, file_path, streaming = jobs.get_nowait()
+        except queue.Empty:
+            slots.release()
+            return
+
+        try:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            if measure:
+                future = executor.submit(measure_file_read, _read_input_file, file_path, streaming, backend, data, trace_memory = trace_memory)
+            else:
+                future = executor.submit(_read_input_file, file_path, streaming, backend, data)
+        except Exception as e:
+            future = concurrent.futures.Future()
+            future.set_result(({}, ('unreadable input file', f'Could not read {file_path}: {e!r}')))
+        extracted.put((index, future))
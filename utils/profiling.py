@@ -0,0 +1,220 @@
+import os
+import time
+import cProfile
+import threading
+import contextlib
+import json
+import logging
+
+from typing import Dict, Union, Any, Iterator
+
+
+logger = logging.getLogger(__name__)
+
+# Number of files and subsidiaries listed as the slowest ones in the run report
+SLOWEST_COUNT = 10
+
+# Cells scanned by the readers of the current thread, see count_scanned_cells
+_scan_counter = threading.local()
+
+
+def count_scanned_cells(count: int) -> None:
+    '''
+    Summary:
+        Add to the number of input cells that the readers of the current thread have scanned.
+        Kept per thread, since files can be read in threads as well as in worker processes
+
+    Args:
+        count (int): Number of cells
+    '''
+    _scan_counter.cells = getattr(_scan_counter, 'cells', 0) + count
+
+
+def scanned_cells() -> int:
+    '''
+    Summary:
+        Get the number of input cells that the readers of the current thread have scanned so far
+
+    Returns:
+        int: Number of cells
+    '''
+    return getattr(_scan_counter, 'cells', 0)
+
+
+def start_run_report(settings: Dict) -> Union[Dict[str, Any], None]:
+    '''
+    Summary:
+        Start a run report if settings["Run report"] is True. With settings["Run report profile"], each stage is
+        also run under cProfile, and its profile is saved in the output folder (see profile_stage)
+
+    Args:
+        settings (Dict): Script settings dictionary
+
+    Returns:
+        Dict[str, Any] or None: Run report dictionary with the structure below, or None if there is no report
+        {
+            'started': local time of the start of the run,
+            'stages': {
+                'stage name': {'seconds': ..., 'profile': path to the cProfile dump, if profiled}
+            },
+            'files': {
+                'file path': {'seconds': ..., 'bytes read': ..., 'cells scanned': ..., 'keys extracted': ..., 'streaming': ...}
+                # Files served from the parse cache are only marked with 'cached': True
+            },
+            'subsidiaries': {
+                'input folder name': {
+                    'sheet': summary sheet name, 'seconds': ..., 'entries': ..., 'writes': ..., 'compiled labels': ...,
+                    'exact': ..., 'substring': ..., 'special case': ..., 'mismatch': ..., 'multiple matches': ...
+                }
+            },
+            'totals': sums of the counters of the files and subsidiaries,
+            'slowest files': [the SLOWEST_COUNT slowest files],
+            'slowest subsidiaries': [the SLOWEST_COUNT subsidiaries whose summary writes took the longest]
+        }
+    '''
+    if not settings.get("Run report", False):
+        return None
+
+    profile_folder = None
+    if settings.get("Run report profile", False):
+        profile_folder = settings["Output file folder path"]
+    return {
+        'started': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'profile folder': profile_folder,
+        'stages': {},
+        'files': {},
+        'subsidiaries': {},
+        'totals': {},
+        'slowest files': [],
+        'slowest subsidiaries': []
+    }
+
+
+@contextlib.contextmanager
+def profile_stage(report: Union[Dict[str, Any], None], stage: str) -> Iterator[None]:
+    '''
+    Summary:
+        Time a stage of the run and add it to the run report. If the report has a profile folder, the stage
+        runs under cProfile and its stats are dumped to "Run report <stage>.prof" there, which can be read with
+        pstats or snakeviz. Stages cannot be nested, since only one profiler can be active at a time.
+        Does nothing if there is no report
+
+    Args:
+        report (Dict[str, Any], optional): Run report, see start_run_report
+        stage (str): Name of the stage
+    '''
+    if report is None:
+        yield
+        return
+
+    profiler = cProfile.Profile() if report['profile folder'] is not None else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        stats = {}
+        if profiler is not None:
+            profiler.disable()
+        stats['seconds'] = time.perf_counter() - start
+        if profiler is not None:
+            stats['profile'] = _dump_profile(profiler, report['profile folder'], stage)
+        report['stages'][stage] = stats
+
+
+def add_file_profile(report: Union[Dict[str, Any], None], file_path: str, stats: Dict[str, Any]) -> None:
+    '''
+    Summary:
+        Add the measurements of a file read (see measure_file_read) to the run report
+
+    Args:
+        report (Dict[str, Any], optional): Run report, see start_run_report
+        file_path (str): Path to the input file
+        stats (Dict[str, Any]): Measurements of the file
+    '''
+    if report is None:
+        return
+    report['files'][file_path] = {field: stats[field] for field in ('seconds', 'bytes read', 'cells scanned', 'keys extracted', 'streaming') if field in stats}
+
+
+def add_cached_file(report: Union[Dict[str, Any], None], file_path: str) -> None:
+    '''
+    Summary:
+        Mark a file that was served from the parse cache in the run report
+
+    Args:
+        report (Dict[str, Any], optional): Run report, see start_run_report
+        file_path (str): Path to the input file
+    '''
+    if report is None:
+        return
+    report['files'][file_path] = {'cached': True}
+
+
+def save_run_report(report: Union[Dict[str, Any], None], settings: Dict) -> Union[str, None]:
+    '''
+    Summary:
+        Add the totals and the slowest files and subsidiaries to the run report, and save it as JSON to
+        settings["Run report file name"] in the output folder
+
+    Args:
+        report (Dict[str, Any], optional): Run report, see start_run_report
+        settings (Dict): Script settings dictionary
+
+    Returns:
+        str or None: Path to the report, or None if nothing was saved
+    '''
+    if report is None:
+        return None
+
+    totals = {}
+    for section in ('files', 'subsidiaries'):
+        for stats in report[section].values():
+            for field, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and field != 'seconds':
+                    totals[field] = totals.get(field, 0) + value
+    report['totals'] = totals
+    report['slowest files'] = _slowest(report['files'])
+    report['slowest subsidiaries'] = _slowest(report['subsidiaries'])
+
+    file_path = os.path.join(settings["Output file folder path"], settings["Run report file name"])
+    temp_path = file_path + '.tmp'
+    try:
+        with open(temp_path, 'w', encoding = 'utf-8') as f:
+            json.dump(report, f, indent = 4, ensure_ascii = False, default = str)
+        os.replace(temp_path, file_path)
+    except OSError as e:
+        logger.error('Could not write the run report to %s: %s', file_path, e)
+        return None
+
+    logger.info('Run report saved to %s', file_path)
+    return file_path
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _slowest(section: Dict[str, Dict[str, Any]]) -> list:
+    '''
+    List the SLOWEST_COUNT entries of a report section with the most seconds, slowest first, as {'name': ..., 'seconds': ...}
+    '''
+    timed = [(name, stats['seconds']) for name, stats in section.items() if 'seconds' in stats]
+    timed.sort(key = lambda item: -item[1])
+    return [{'name': name, 'seconds': seconds} for name, seconds in timed[:SLOWEST_COUNT]]
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _dump_profile(profiler: cProfile.Profile, folder: str, stage: str) -> Union[str, None]:
+    '''
+    Dump the stats of a profiled stage to "Run report <stage>.prof" in folder
+    '''
+    file_path = os.path.join(folder, f'Run report {stage}.prof')
+    try:
+        profiler.dump_stats(file_path)
+    except OSError as e:
+        logger.error('Could not write the profile of stage %s to %s: %s', stage, file_path, e)
+        return None
+
+    return file_path
+
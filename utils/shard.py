@@ -0,0 +1,212 @@
+import os
+import zipfile
+import logging
+
+from typing import List, Dict, Union, Tuple, Any, Iterable
+
+import concurrent.futures
+
+from .util import compute_summary_writes, KEY_COLOR
+from .label_index import build_label_index_from_rows
+from .xlsx_reader import iter_sheet_rows
+
+
+logger = logging.getLogger(__name__)
+
+
+def compute_summary_writes_sharded(data_dict: Dict, matches: Dict, settings: Dict, targets: Union[Dict, None] = None,
+                                   write_maps: Union[Dict[str, Any], None] = None, subsidiary_stats: Union[Dict, None] = None) -> List[Tuple[str, int, int, Any]]:
+    '''
+    Summary:
+        Compute the summary writes of data_dict the same way as compute_summary_writes, with the matched summary
+        sheets split across settings["Summary shard workers"] worker processes (0 means one per CPU core).
+        Each subsidiary only writes to its own sheet, so every shard is independent:
+        - each worker reads only the sheets of its shard from the summary file, straight from the sheet XML,
+          and computes their writes. With write maps, only the sheets with labels that are not compiled yet are read
+        - the writes are merged in the order of data_dict, and the "Mismatched Data" rows are numbered in that
+          order, so the result is the same as compute_summary_writes
+        The log records of the workers are passed on to the logging of this process
+
+    Args:
+        data_dict (Dict): Input data, see get_input_data
+        matches (Dict): Dictionary with the matches between the input and output data
+        settings (Dict): Script settings dictionary
+        targets (Dict, optional): Filled with the summary cell of each entry, see compute_summary_writes
+        write_maps (Dict[str, Any], optional): Write maps of the summary sheets (see load_write_maps), updated with
+        the labels compiled by the workers
+        subsidiary_stats (Dict, optional): Filled with the measurements of each subsidiary, see compute_summary_writes
+
+    Returns:
+        List[Tuple[str, int, int, Any]]: (sheet name, row, column, value) per write, see compute_summary_writes
+
+    Raises:
+        ValueError: If a matched sheet cannot be read from the summary file, e.g. because it only exists in memory
+    '''
+    summary_path = os.path.join(settings["Output file folder path"], settings["Summary file name"])
+    workers = settings.get("Summary shard workers", 0) or os.cpu_count() or 1
+    shards = _split_shards(data_dict, matches, workers)
+
+    sheet_maps = {} if write_maps is None else write_maps['sheets']
+    results = {}
+    if len(shards) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = len(shards)) as executor:
+            futures = [
+                executor.submit(_compute_shard, summary_path, {key: data_dict[key] for key in keys}, {key: matches[key] for key in keys}, settings,
+                                _get_shard_maps(sheet_maps, matches, keys), logging.getLogger().level, collect_stats = subsidiary_stats is not None)
+                for keys in shards
+            ]
+            for future in futures:
+                shard_results, shard_maps, records = future.result()
+                results.update(shard_results)
+                sheet_maps.update(shard_maps)
+                for record in records:
+                    logging.getLogger(record.name).handle(record)
+    elif len(shards) == 1:
+        # Not worth starting a process for
+        results, shard_maps, _ = _compute_shard(summary_path, data_dict, matches, settings, _get_shard_maps(sheet_maps, matches, data_dict.keys()), capture_logs = False,
+                                                collect_stats = subsidiary_stats is not None)
+        sheet_maps.update(shard_maps)
+
+    # Merge in input order, numbering the mismatch rows after those of the subsidiaries before
+    writes = []
+    mismatch_count = 0
+    for key in data_dict.keys():
+        key_writes, key_mismatch_count, key_targets, key_stats = results[key]
+        for sheet_name, row, col, value in key_writes:
+            if sheet_name == 'Mismatched Data':
+                row += mismatch_count
+            writes.append((sheet_name, row, col, value))
+        mismatch_count += key_mismatch_count
+        if targets is not None:
+            targets.update(key_targets)
+        if subsidiary_stats is not None:
+            subsidiary_stats.update(key_stats)
+
+    logger.info('Summary writes computed in %d shards', len(shards))
+    return writes
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _split_shards(data_dict: Dict, matches: Dict, workers: int) -> List[List[str]]:
+    '''
+    Split the subsidiaries into at most workers shards, keeping the subsidiaries that write to the same summary sheet
+    together. Sheets are given to the shard with the fewest entries so far, the sheets with the most entries first
+
+    Args:
+        data_dict (Dict): Input data, see get_input_data
+        matches (Dict): Dictionary with the matches between the input and output data
+        workers (int): Maximum number of shards
+
+    Returns:
+        List[List[str]]: Keys of data_dict per shard, in the order of data_dict. Empty shards are left out
+    '''
+    sheet_keys = {}
+    sheet_entries = {}
+    for key, scope_data in data_dict.items():
+        sheet_name = matches[key]['match']
+        sheet_keys.setdefault(sheet_name, []).append(key)
+        sheet_entries[sheet_name] = sheet_entries.get(sheet_name, 0) + sum(len(sheet_data) for sheet_data in scope_data.values())
+
+    shards = [[] for _ in range(min(workers, len(sheet_keys)))]
+    shard_entries = [0] * len(shards)
+    for sheet_name in sorted(sheet_keys, key = lambda sheet_name: -sheet_entries[sheet_name]):
+        shard = shard_entries.index(min(shard_entries))
+        shards[shard].extend(sheet_keys[sheet_name])
+        shard_entries[shard] += sheet_entries[sheet_name]
+
+    order = {key: position for position, key in enumerate(data_dict)}
+    return [sorted(keys, key = order.get) for keys in shards if len(keys) > 0]
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _compute_shard(summary_path: str, data_dict: Dict, matches: Dict, settings: Dict, sheet_maps: Dict[str, Dict[str, Any]],
+                   log_level: int = logging.NOTSET, capture_logs: bool = True, collect_stats: bool = False) -> Tuple[Dict[str, Tuple[List, int, Dict]], Dict[str, Dict[str, Any]], List[logging.LogRecord]]:
+    '''
+    Compute the summary writes of one shard, see compute_summary_writes_sharded. Kept at module level so that
+    it can be sent to worker processes. The writes are computed per subsidiary, with the mismatch rows starting at 2
+
+    Args:
+        summary_path (str): Path to the summary file
+        data_dict (Dict): Input data of the shard
+        matches (Dict): Matches of the subsidiaries of the shard
+        settings (Dict): Script settings dictionary
+        sheet_maps (Dict[str, Dict[str, Any]]): Write maps of the sheets of the shard, see load_write_maps
+        log_level (int): Level of the root logger of the parent process, which a spawned worker does not inherit
+        capture_logs (bool): If True, the log records are returned instead of handled here
+        collect_stats (bool): If True, measure each subsidiary for the run report
+
+    Returns:
+        A tuple containing the following three elements:
+        - results (Dict): Key -> (writes, number of mismatches, targets, measurements or None)
+        - sheet_maps (Dict): The write maps of the sheets of the shard, with the labels compiled by this shard
+        - records (List[logging.LogRecord]): Log records to handle in the parent process
+    '''
+    root_logger = logging.getLogger()
+    handler = _RecordCollector()
+    handlers = list(root_logger.handlers)
+    if capture_logs:
+        for existing_handler in handlers:
+            root_logger.removeHandler(existing_handler)
+        root_logger.addHandler(handler)
+        root_logger.setLevel(log_level)
+
+    try:
+        # Only the sheets with labels that are not in their write map yet are read
+        sheet_names = set()
+        for key, scope_data in data_dict.items():
+            labels = sheet_maps[matches[key]['match']]['labels']
+            if any(str(subitem) not in labels for sheet_data in scope_data.values() for subitem in sheet_data.keys()):
+                sheet_names.add(matches[key]['match'])
+        label_indexes = {}
+        if len(sheet_names) > 0:
+            with zipfile.ZipFile(summary_path) as archive:
+                for sheet_name, rows in iter_sheet_rows(archive, sheet_filter = sheet_names.__contains__, key_color = KEY_COLOR):
+                    label_indexes[sheet_name] = build_label_index_from_rows([value for value, _ in row] for row in rows)
+        missing = sheet_names - set(label_indexes)
+        if len(missing) > 0:
+            raise ValueError(f'Sheets {sorted(missing)} are not in {summary_path}')
+
+        state = {'label_indexes': label_indexes, 'write_maps': {'sheets': sheet_maps}}
+        results = {}
+        for key in data_dict.keys():
+            # The mismatch rows are numbered per subsidiary and renumbered in the merge
+            state['mismatch_count'] = 0
+            state['mismatch_dict'] = {}
+            key_targets = {}
+            state['subsidiary stats'] = {} if collect_stats else None
+            key_writes = compute_summary_writes({key: data_dict[key]}, None, matches, settings, state = state, targets = key_targets)
+            results[key] = (key_writes, state['mismatch_count'], key_targets, state['subsidiary stats'])
+    finally:
+        if capture_logs:
+            root_logger.removeHandler(handler)
+            for existing_handler in handlers:
+                root_logger.addHandler(existing_handler)
+
+    return results, sheet_maps, handler.records
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _get_shard_maps(sheet_maps: Dict[str, Dict[str, Any]], matches: Dict, keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    '''
+    Get the write maps of the summary sheets of a shard. Sheets without a map get an empty one that is not hashed,
+    see compute_summary_writes
+    '''
+    return {matches[key]['match']: sheet_maps.get(matches[key]['match'], {'hash': None, 'labels': {}}) for key in keys}
+
+
+class _RecordCollector(logging.Handler):
+    '''
+    Collects the log records of a worker process, with their messages formatted so that they can be pickled
+    '''
+    def __init__(self) -> None:
+        super().__init__()
+        self.records = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
@@ -0,0 +1,108 @@
+import hashlib
+import logging
+
+from typing import List, Tuple, Any, Callable, Iterator, Sequence
+
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of read plans kept per process, one per distinct template sheet
+MAX_READ_PLANS = 256
+
+# Read plans of the templates seen so far, fingerprint -> read plan
+_read_plans = {}
+
+
+def template_fingerprint(sheet: str, colored_cells: Sequence[Tuple[int, int]]) -> str:
+    '''
+    Summary:
+        Fingerprint the layout of a scope sheet: its name and the positions of its key-colored cells.
+        Sheets filled in from the same template have the same fingerprint, whatever was filled in.
+        The used range is left out, since a note typed outside the template changes it without changing the layout
+
+    Args:
+        sheet (str): Sheet name
+        colored_cells (Sequence[Tuple[int, int]]): (row, column) of every key-colored cell, sorted by row and column
+
+    Returns:
+        str: Hex digest of the layout
+    '''
+    digest = hashlib.sha1(sheet.encode('utf-8'))
+    digest.update(repr(tuple(colored_cells)).encode('ascii'))
+    return digest.hexdigest()
+
+
+def get_read_plan(sheet: str, colored_cells: Sequence[Tuple[int, int]]) -> List[Tuple[int, int, Tuple[Tuple[int, int], ...]]]:
+    '''
+    Summary:
+        Get the read plan of a scope sheet layout (see compile_read_plan). The plan is compiled once per
+        template fingerprint, and reused for every other sheet with the same layout. Only the compiling is saved,
+        the colored cells still have to be found by a color scan of the used range of every sheet
+
+    Args:
+        sheet (str): Sheet name
+        colored_cells (Sequence[Tuple[int, int]]): (row, column) of every key-colored cell, sorted by row and column
+
+    Returns:
+        List[Tuple[int, int, Tuple[Tuple[int, int], ...]]]: Read plan
+    '''
+    fingerprint = template_fingerprint(sheet, colored_cells)
+    plan = _read_plans.get(fingerprint)
+    if plan is None:
+        plan = compile_read_plan(colored_cells)
+        if len(_read_plans) >= MAX_READ_PLANS:
+            _read_plans.pop(next(iter(_read_plans))) # Forget the oldest template
+        _read_plans[fingerprint] = plan
+        logger.debug('New template %s in sheet %s: %d entries', fingerprint[:12], sheet, len(plan))
+    return plan
+
+
+def compile_read_plan(colored_cells: Sequence[Tuple[int, int]]) -> List[Tuple[int, int, Tuple[Tuple[int, int], ...]]]:
+    '''
+    Summary:
+        Compile the triplet rules of _get_scope_data into a list of cells to read. The colored cells decide
+        which cells hold values and which neighbours can hold their key, but which neighbour holds the key
+        depends on the values, so each entry lists its key cells in the order they are tried:
+        o x o -> the key is in the previous cell
+        o x x -> the key is in the next cell, or in the previous cell if the next one is empty
+        An entry whose key cells are all empty is skipped
+
+    Args:
+        colored_cells (Sequence[Tuple[int, int]]): (row, column) of every key-colored cell, sorted by row and column
+
+    Returns:
+        List[Tuple[int, int, Tuple[Tuple[int, int], ...]]]: (row, column) of each value cell, with the (row, column)
+        of the cells to take the key from, first non-empty one first. In the order that the triplet scan finds them
+    '''
+    colored = set(colored_cells)
+    plan = []
+    for row, col in colored_cells:
+        # The first column has no previous cell, and x x . is skipped since the previous cell likely holds another value
+        if col < 2 or (row, col - 1) in colored:
+            continue
+        if (row, col + 1) in colored:
+            key_cells = ((row, col + 1), (row, col - 1))
+        else:
+            key_cells = ((row, col - 1),)
+        plan.append((row, col, key_cells))
+    return plan
+
+
+def apply_read_plan(plan: List[Tuple[int, int, Tuple[Tuple[int, int], ...]]], get_value: Callable[[int, int], Any]) -> Iterator[Tuple[Any, Any, int, int]]:
+    '''
+    Summary:
+        Read the entries of a sheet by looking up the cells of its read plan
+
+    Args:
+        plan (List[Tuple[int, int, Tuple[Tuple[int, int], ...]]]): Read plan, see compile_read_plan
+        get_value (Callable[[int, int], Any]): Value of the cell at (row, column), None if it is empty
+
+    Returns:
+        Iterator of (key, value, row, col) tuples, the same as _iter_scope_entries
+    '''
+    for row, col, key_cells in plan:
+        for key_row, key_col in key_cells:
+            key = get_value(key_row, key_col)
+            if key is not None:
+                yield key, get_value(row, col), row, col
+                break
@@ -1,16 +1,43 @@
+import io
 import os
 import sys
-
-import numpy as np
+import zipfile
+import contextlib
+import math
+import numbers
+import random
+import time
 
 from openpyxl import Workbook, load_workbook
+from openpyxl.utils import get_column_letter
+from openpyxl.cell.read_only import EMPTY_CELL
 import json
 
 import itertools
+import functools
+import fnmatch
+import logging
+
+from typing import List, Dict, Union, Tuple, Any, Iterable, Iterator, Sequence, Set
+
+import concurrent.futures
+
+from .label_index import build_label_index, find_label_matches, build_trigram_index, suggest_labels, _build_automaton, _search_automaton
+from .cache import load_parse_cache, save_parse_cache, get_cached_scope_data, put_cached_scope_data
+from .match_store import get_match_candidates, get_pins
+from .template import get_read_plan, apply_read_plan
+from .xlsx_patch import patch_workbook, read_sheet_names, PATCH_ERRORS
+from .xlsx_reader import iter_sheet_rows, read_merged_ranges
+from .memory import plan_reads, measure_file_read, add_file_stats
+from .write_map import load_write_maps, save_write_maps
+from .profiling import count_scanned_cells, add_file_profile, add_cached_file, profile_stage
+
+
+logger = logging.getLogger(__name__)
 
-from typing import List, Dict, Union, Tuple, Any
 
-import difflib
+# Fill color of the cells that hold input values (and sometimes keys) in the input templates
+KEY_COLOR = 'FFDDEBF7'
 
 
 def load_json(json_path: str) -> Dict[str, Any]:
@@ -37,79 +64,94 @@ def load_json(json_path: str) -> Dict[str, Any]:
     return output_json
 
 
-# NOTE: The double underscore (__) prefix indicates that this function is not meant 
-# for production use, but this may change in a future update
-def __get_input_files(path: Union[List[str], str], settings: Dict) -> List[str]:
+def discover_input_files(path: Union[List[str], str], settings: Dict) -> Dict[str, List[str]]:
     '''
     Summary:
-        Get all excel file paths in the given path
+        Find all input excel files below the given path(s) in a single os.scandir pass and group
+        them by the name of the folder they are in. Files directly in the given path(s), such as
+        the summary file, are not input files and are skipped.
+
+        A file is an input file if its name matches one of settings["Input include patterns"]
+        (default: *.xlsx) and none of settings["Input exclude patterns"]. Excel lock files (~$*)
+        are always skipped
 
     Args:
         path (List[str] or str): Path to the folder(s) to search in
         settings (dict): Script settings dictionary
 
     Returns:
-        list: List of excel files
+        Dict[str, List[str]]: Folder name -> paths of the excel files in that folder
     '''
     if isinstance(path, str):
         path = [path]
-    excel_files = []
 
-    for p in path:
-        for root, dirs, files in os.walk(p):
-            for f in files:
-                # If file is an excel file and is part of a subdirectory, add it to the list
-                if f.endswith('.xlsx') and not root.split(os.sep)[-1] in settings['Input file folder name']:
-                    excel_files.append(os.path.join(root, f))
+    input_files = {}
 
-    return excel_files
+    for p in path:
+        # (directory, is the top level folder)
+        stack = [(p, True)]
+        while stack:
+            directory, is_top_level = stack.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    entries = sorted(entries, key = lambda entry: entry.name)
+            except OSError as e:
+                logger.warning("Could not read %s: %s", directory, e, extra = {"event": "unreadable folder"})
+                continue
+
+            subdirectories = []
+            for entry in entries:
+                if entry.is_dir(follow_symlinks = False):
+                    subdirectories.append((entry.path, False))
+                elif not is_top_level and entry.is_file() and _is_input_file_name(entry.name, settings):
+                    # Use the last path component as folder name, independent of the path separator
+                    input_files.setdefault(os.path.basename(directory), []).append(entry.path)
+
+            # Reversed, so that subdirectories are visited in alphabetical order
+            stack.extend(reversed(subdirectories))
+
+    return input_files
 
 
-# NOTE: The double underscore (__) prefix indicates that this function is not meant 
-# for production use, but this may change in a future update
-def __get_input_folders(path: Union[List[str], str], settings: Dict) -> List[str]:
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _is_input_file_name(name: str, settings: Dict) -> bool:
     '''
-    Summary:
-        Get all folder paths that contain the input excel files
+    Check whether a file name matches one of settings["Input include patterns"] (default: *.xlsx)
+    and none of settings["Input exclude patterns"]. Excel lock files (~$*) never match
 
     Args:
-        path (List[str] or str): Path to the folder(s) to search in
+        name (str): File name
         settings (dict): Script settings dictionary
 
     Returns:
-        list: List of excel files
+        bool: True if a file with this name is an input file
     '''
-    if isinstance(path, str):
-        path = [path]
-    excel_folders = []
-
-    for p in path:
-        for root, dirs, files in os.walk(p):
-            for d in dirs:
-                # If dir contains excel files, add it to the list
-                if len([f for f in os.listdir(os.path.join(root, d)) if f.endswith('.xlsx')]) > 0:
-                    excel_folders.append(os.path.join(root, d))
+    include_patterns = settings.get("Input include patterns", ["*.xlsx"])
+    exclude_patterns = ["~$*"] + settings.get("Input exclude patterns", [])
+    return any(fnmatch.fnmatch(name, pattern) for pattern in include_patterns) \
+        and not any(fnmatch.fnmatch(name, pattern) for pattern in exclude_patterns)
 
-    return excel_folders
 
-
-def excel_to_workbook(file_path: str) -> Union[Workbook, None]:
+def excel_to_workbook(file_path: Union[str, io.BytesIO], read_only: bool = False) -> Union[Workbook, None]:
     '''
     Summary:
         Read an Excel file and return an openpyxl workbook
 
     Args:
-        file_path (str): Path to the Excel file
+        file_path (str or io.BytesIO): Path to the Excel file, or its content
+        read_only (bool): If True, open the workbook in openpyxl's read-only mode, where
+        worksheet rows are streamed from the file instead of being kept in memory
 
     Returns:
         openpyxl.workbook.workbook.Workbook: Workbook object
     '''
     try:
         wb = Workbook()
-        wb = load_workbook(file_path)
+        wb = load_workbook(file_path, read_only = read_only)
         return wb
     except Exception as e:
-        print(f"[excel_to_workbook] Error: {e}")
+        logger.error("Could not open %s: %s", getattr(file_path, 'name', file_path), e)
         return None
 
 
@@ -128,7 +170,7 @@ def preprocess_cell(cell: str) -> str:
     return cell.strip()
 
 
-def match_lists(list_1: List, list_2: List, filter_doubles: bool = False) -> Dict:
+def match_lists(list_1: List, list_2: List, filter_doubles: bool = False, min_score: float = 0.0, store: Union[Dict, None] = None) -> Dict:
     '''
     Use difflib to match two lists and returns a nested dictionary with the following structure:
     {
@@ -154,123 +196,442 @@ def match_lists(list_1: List, list_2: List, filter_doubles: bool = False) -> Dic
         }
     }
 
+    Exact matches are resolved without any fuzzy matching, and pairs that cannot beat the current best
+    match are pruned with upper bounds of the similarity ratio (see utils/matching.py).
+
+    With filter_doubles, the matching is solved as an optimal one-to-one assignment (Hungarian algorithm)
+    over the top candidates of each item, maximizing the total similarity. Items without a match are left
+    out of the output. The lists are sorted first, so the result does not depend on their input order
+
+    With filter_doubles and a match store (see utils/match_store.py), the top candidates are reused from earlier
+    runs, and only new items and changed sheet names are fuzzy matched. Items that are pinned in the store are
+    matched to their pinned sheet with a score of 1.0, and the other items are assigned among the remaining sheets
+
     Args:
         list_1 (List): First list of strings
         list_2 (List): Second list of strings
         filter_doubles (bool): If True, make sure each item in list_2 only has one match in list_1
+        min_score (float): With filter_doubles, pairs with a lower similarity are never matched
+        store (Dict, optional): With filter_doubles, match store to reuse and update (see load_match_store)
 
     Returns:
         Dict: Output dictionary with the above structure
     '''
 
+    # Imported here, since NumPy is slow to import and is only needed for matching
+    from .matching import find_best_matches, find_top_candidates, assign_matches
+
     # Make sure the lists are not empty
     if len(list_1) == 0:
-        print('[match_lists] Error: List 1 is empty')
+        logger.error('List 1 is empty')
         return {}
     if len(list_2) == 0:
-        print('[match_lists] Error: List 2 is empty')
+        logger.error('List 2 is empty')
         return {}
 
     output_dict = {}
-    match_relations_dict = {}
-
-    if filter_doubles:
-        best_match_strings = []
-
-    for item in list_1:
-        best_match_score = 0
-        best_match_string = ''
-
-        for item_2 in list_2:
-            ratio = difflib.SequenceMatcher(None, item, item_2).ratio()
-            if ratio > best_match_score:
-                best_match_score = ratio
-                best_match_string = item_2
-
-        if filter_doubles:
-            if best_match_string in best_match_strings:
-                # Check if the new match is better
-                print(f"[match_lists] Debug: Matched {item} to {best_match_string} with a score of {np.round(best_match_score, 3)}, but it is already matched to {match_relations_dict[best_match_string]['match']} with a score of {match_relations_dict[best_match_string]['score']}")
-                if best_match_score > match_relations_dict[best_match_string]['score']:
-                    # Update the output dictionary
-                    print(f'[match_lists] Debug: Updating to {item} with a score of {best_match_score}')
-                    output_dict[item] = {
-                        'match': best_match_string,
-                        'score': np.round(best_match_score, 3)
-                    }
-                    # Update the reverse match for comparison and debugging purposes
-                    match_relations_dict[best_match_string] = {
-                        'match': item,
-                        'score': np.round(best_match_score, 3)
-                    }
-                else:
-                    print(f'[match_lists] Debug: Keeping the previous match with a score of {match_relations_dict[best_match_string]["score"]}')
-            else:
-                print(f"[match_lists] Debug: Matched {item} to {best_match_string} with a score of {np.round(best_match_score, 3)}")
-                # Add the new match to the list of best matches and the output dictionary
-                best_match_strings.append(best_match_string)
-                output_dict[item] = {
-                'match': best_match_string,
-                'score': np.round(best_match_score, 3)
-                 }
-                # Record the reverse match for comparison and debugging purposes
-                match_relations_dict[best_match_string] = {
-                    'match': item,
-                    'score': np.round(best_match_score, 3)
-                }
-        else:
+
+    if not filter_doubles:
+        for item, (j, score) in zip(list_1, find_best_matches(list_1, list_2)):
+            output_dict[item] = {
+                'match': list_2[j] if j >= 0 else '',
+                'score': round(float(score), 3)
+            }
+        return output_dict
+
+    # Solve in sorted order, so that ties are resolved the same way regardless of how the input was ordered
+    sorted_1 = sorted(set(list_1))
+    sorted_2 = sorted(set(list_2))
+    pins = {}
+    if store is None:
+        candidates = find_top_candidates(sorted_1, sorted_2)
+    else:
+        pins = get_pins(store, sorted_1, sorted_2)
+        pinned_sheets = set(pins.values())
+        sheet_index = {sheet: j for j, sheet in enumerate(sorted_2)}
+        stored_candidates = get_match_candidates(store, sorted_1, sorted_2)
+        # Pinned items and sheets take no part in the assignment
+        candidates = [
+            [] if item in pins else [(sheet_index[sheet], score) for sheet, score in stored_candidates[item] if sheet not in pinned_sheets]
+            for item in sorted_1
+        ]
+    assignment = assign_matches(candidates, min_score = min_score)
+
+    # Report in the order of list_1
+    input_order = {}
+    for position, item in enumerate(list_1):
+        input_order.setdefault(item, position)
+
+    for i, item in sorted(enumerate(sorted_1), key = lambda pair: input_order[pair[1]]):
+        if item in pins:
+            logger.debug("Matched %s to %s, which it is pinned to", item, pins[item])
             output_dict[item] = {
-                'match': best_match_string,
-                'score': np.round(best_match_score, 3)
+                'match': pins[item],
+                'score': 1.0
             }
+        elif i in assignment:
+            j, score = assignment[i]
+            logger.debug("Matched %s to %s with a score of %s", item, sorted_2[j], round(float(score), 3))
+            output_dict[item] = {
+                'match': sorted_2[j],
+                'score': round(float(score), 3)
+            }
+        elif len(candidates[i]) > 0:
+            j, score = candidates[i][0]
+            logger.debug("No one-to-one match for %s, its best match %s (score %s) is assigned elsewhere", item, sorted_2[j], round(float(score), 3))
+        else:
+            logger.debug("No match found for %s", item)
 
     return output_dict
 
 
-def get_input_data(input_file_paths: Union[List[str], str], matches: Dict) -> Dict:
+def get_input_data(input_file_paths: Union[List[str], str], matches: Dict, settings: Union[Dict, None] = None, sources: Union[Dict, None] = None,
+                   report: Union[Dict, None] = None, run_report: Union[Dict, None] = None) -> Dict:
     """
     Summary:
-        Read the input data from the given Excel files and return a nested dictionary
+        Read the input data from the given Excel files and return a nested dictionary.
+        If settings["Ingestion workers"] is larger than 1 (or 0, meaning one worker per CPU core),
+        the files are parsed in a process pool, largest files first.
+        If settings["Use parse cache"] is True, files that have not changed since they were last parsed
+        are served from the parse cache (see utils/cache.py) and only the other files are parsed.
+        settings["Reader backend"] selects how the files are read (see READER_BACKENDS), "openpyxl" by default.
+        If settings["Memory budget (MB)"] is set, fewer workbooks are open at once and large files are
+        read with streaming reads to stay within the budget (see plan_reads)
     Args:
         input_file_paths (Union[List[str], str]): List of paths to the input files
         matches (Dict): Dictionary with the matches between the input and output data
+        settings (Dict, optional): Script settings dictionary
+        sources (Dict, optional): Filled with input folder name -> path of the file that its data was read from
+        report (Dict, optional): Memory report to add the measurements of each file read to (see start_memory_report)
+        run_report (Dict, optional): Run report to add the time and counters of each file read to (see start_run_report)
     Returns:
         Dict: Nested dictionary containing the input data
     """
-    
+    file_jobs = _get_file_jobs(input_file_paths, matches)
+    workers, streaming, backend = _get_read_settings(settings)
+
+    # Serve unchanged files from the parse cache
+    results = {}
+    cache = None
+    if settings is not None and settings.get("Use parse cache", False):
+        content_hash = settings.get("Parse cache content hash", False)
+        cache = load_parse_cache(settings["Parse cache file name"])
+        for _, file_path in file_jobs:
+            scope_data = get_cached_scope_data(cache, file_path, content_hash = content_hash)
+            if scope_data is not None:
+                results[file_path] = (scope_data, None)
+                add_cached_file(run_report, file_path)
+        logger.info('%d of %d input files served from the parse cache', len(results), len(file_jobs))
+
+    files_to_parse = [file_path for _, file_path in file_jobs if file_path not in results]
+    workers, streaming_files = plan_reads(files_to_parse, workers, streaming, backend, _get_memory_budget(settings))
+    parsed = _read_input_files(files_to_parse, workers, streaming, backend, streaming_files = streaming_files, report = report, run_report = run_report)
+    results.update(parsed)
+
+    if cache is not None:
+        for file_path, (scope_data, warning) in parsed.items():
+            if warning is None:
+                put_cached_scope_data(cache, file_path, scope_data, content_hash = content_hash)
+        save_parse_cache(cache, settings["Parse cache file name"], max_bytes = int(settings.get("Parse cache max size (MB)", 256) * 1024 * 1024))
+
+    # Assemble in input order, so that the output does not depend on which worker finished first
     input_data = {}
+    failures = []
+    for input_data_key, file_path in file_jobs:
+        scope_data, warning = results[file_path]
+        input_data[input_data_key] = scope_data
+        if sources is not None:
+            sources[input_data_key] = file_path
+        if warning is not None:
+            failures.append(file_path)
+            event, message = warning
+            logger.warning(message, extra = {"event": event, "data": {"file": file_path}})
+
+    if len(failures) > 0:
+        logger.warning('%d of %d input files could not be read', len(failures), len(file_jobs))
+
+    return input_data
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _get_file_jobs(input_file_paths: Union[List[str], str], matches: Dict) -> List[Tuple[str, str]]:
+    '''
+    List the input files to read, with the folder name that their data is stored under.
+    Only files whose folder name is in the matches dict are read
+
+    Args:
+        input_file_paths (Union[List[str], str]): List of paths to the input files
+        matches (Dict): Dictionary with the matches between the input and output data
+
+    Returns:
+        List[Tuple[str, str]]: (folder name, file path) per file to read, in input order
+    '''
+    if isinstance(input_file_paths, str):
+        input_file_paths = [input_file_paths]
+
+    file_jobs = []
     for file_path in input_file_paths:
-        input_data_key = file_path.split('\\')[-2] # Use the folder name as key
-        # Check if key is in the matches dict
+        input_data_key = os.path.basename(os.path.dirname(file_path)) # Use the folder name as key
         if input_data_key in matches.keys():
-            input_data[input_data_key] = {}
-        else:
-            continue # Immediately go to the next file if key is not in matches
+            file_jobs.append((input_data_key, file_path))
+    return file_jobs
 
-        # Load the workbook at the given path
-        wb = excel_to_workbook(file_path)
-        
-        if wb is None:
-            print(f'[get_input_data] Warning: Could not open {file_path}')
-            continue
 
-        scope_sheets = [sheet for sheet in wb.sheetnames if 'scope' in sheet.lower()]
-        
-        if len(scope_sheets) == 0:
-            print(f'[get_input_data] Warning: Could not find scope sheet in {file_path}')
-            continue
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _get_read_settings(settings: Union[Dict, None]) -> Tuple[int, bool, str]:
+    '''
+    Get the settings for reading the input files
+
+    Args:
+        settings (Dict, optional): Script settings dictionary
+
+    Returns:
+        Tuple[int, bool, str]: Number of worker processes, whether to use streaming reads, and the reader backend
+    '''
+    workers = 1 if settings is None else settings.get("Ingestion workers", 1)
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    streaming = False if settings is None else settings.get("Streaming reads", False)
+    backend = "openpyxl" if settings is None else settings.get("Reader backend", "openpyxl")
+    if backend not in READER_BACKENDS:
+        raise ValueError(f'Unknown reader backend "{backend}", expected one of {list(READER_BACKENDS)}')
+    return workers, streaming, backend
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _get_memory_budget(settings: Union[Dict, None]) -> int:
+    '''
+    Get settings["Memory budget (MB)"] in bytes, 0 if there is no budget
+
+    Args:
+        settings (Dict, optional): Script settings dictionary
+
+    Returns:
+        int: Memory budget in bytes
+    '''
+    if settings is None:
+        return 0
+    return int(settings.get("Memory budget (MB)", 0) * 2**20)
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _read_input_file(file_path: str, streaming: bool = False, backend: str = "openpyxl", data: Union[bytes, None] = None) -> Tuple[Dict, Union[Tuple[str, str], None]]:
+    '''
+    Read the scope sheets of a single input file. Kept at module level so that
+    it can be sent to worker processes
+
+    Args:
+        file_path (str): Path to the input file
+        streaming (bool): If True, read the file in read-only mode with _get_scope_data_streaming
+        backend (str): Name of the reader backend in READER_BACKENDS
+        data (bytes, optional): Content of the file, if it has already been read
+
+    Returns:
+        A tuple containing the following two elements:
+        - scope_data (Dict): Scope sheet name -> scope data (see _get_scope_data)
+        - warning (Tuple[str, str] or None): (kind of warning, description) of what went wrong, or None if the file was read
+    '''
+    scope_data = {}
+    try:
+        source = file_path
+        if data is not None:
+            source = io.BytesIO(data)
+            source.name = file_path # For error messages
+        scope_sheets = READER_BACKENDS[backend](source, streaming)
+
+        if scope_sheets is None:
+            return scope_data, ('unreadable input file', f'Could not open {file_path}')
+
+        with contextlib.closing(scope_sheets):
+            for sheet, sheet_data in scope_sheets:
+                scope_data[sheet] = sheet_data
+
+        if len(scope_data) == 0:
+            return scope_data, ('missing scope sheet', f'Could not find scope sheet in {file_path}')
+    except Exception as e:
+        return scope_data, ('unreadable input file', f'Could not read {file_path}: {e!r}')
+
+    return scope_data, None
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _read_input_files(file_paths: List[str], workers: int, streaming: bool = False, backend: str = "openpyxl",
+                      streaming_files: Union[Set[str], None] = None, report: Union[Dict, None] = None,
+                      run_report: Union[Dict, None] = None) -> Dict[str, Tuple[Dict, Union[Tuple[str, str], None]]]:
+    '''
+    Read the given input files, in a process pool if there is more than one worker and more than one file
+
+    Args:
+        file_paths (List[str]): Paths to the input files
+        workers (int): Number of worker processes
+        streaming (bool): Passed on to _read_input_file
+        backend (str): Passed on to _read_input_file
+        streaming_files (Set[str], optional): Files to read with streaming reads, whatever streaming is (see plan_reads)
+        report (Dict, optional): Memory report to add the measurements of each file read to
+        run_report (Dict, optional): Run report to add the time and counters of each file read to
+
+    Returns:
+        Dict: File path -> result of _read_input_file
+    '''
+    if workers > 1 and len(file_paths) > 1:
+        return _read_input_files_parallel(file_paths, workers, streaming, backend, streaming_files, report, run_report)
+
+    results = {}
+    for file_path in file_paths:
+        file_streaming = streaming or (streaming_files is not None and file_path in streaming_files)
+        if report is None and run_report is None:
+            results[file_path] = _read_input_file(file_path, file_streaming, backend)
         else:
-            for sheet in scope_sheets:
-                input_data[input_data_key][sheet] = _get_scope_data(wb, sheet)
+            scope_data, warning, stats = measure_file_read(_read_input_file, file_path, file_streaming, backend, trace_memory = report is not None)
+            add_file_stats(report, file_path, stats)
+            add_file_profile(run_report, file_path, stats)
+            results[file_path] = (scope_data, warning)
+    return results
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _read_input_files_parallel(file_paths: List[str], workers: int, streaming: bool = False, backend: str = "openpyxl",
+                               streaming_files: Union[Set[str], None] = None, report: Union[Dict, None] = None,
+                               run_report: Union[Dict, None] = None) -> Dict[str, Tuple[Dict, Union[Tuple[str, str], None]]]:
+    '''
+    Read the given input files in a process pool. The largest files are submitted first,
+    so that a big workbook does not end up being parsed alone at the end of the run
+
+    Args:
+        file_paths (List[str]): Paths to the input files
+        workers (int): Number of worker processes
+        streaming (bool): Passed on to _read_input_file
+        backend (str): Passed on to _read_input_file
+        streaming_files (Set[str], optional): Files to read with streaming reads, whatever streaming is
+        report (Dict, optional): Memory report to add the measurements of each file read to
+        run_report (Dict, optional): Run report to add the time and counters of each file read to
+
+    Returns:
+        Dict: File path -> result of _read_input_file
+    '''
+    measure = report is not None or run_report is not None
+
+    def file_size(file_path: str) -> int:
+        try:
+            return os.path.getsize(file_path)
+        except OSError:
+            return 0
+
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers = min(workers, len(file_paths))) as executor:
+        futures = {}
+        for file_path in sorted(set(file_paths), key = file_size, reverse = True):
+            file_streaming = streaming or (streaming_files is not None and file_path in streaming_files)
+            if not measure:
+                futures[executor.submit(_read_input_file, file_path, file_streaming, backend)] = file_path
+            else:
+                futures[executor.submit(measure_file_read, _read_input_file, file_path, file_streaming, backend, trace_memory = report is not None)] = file_path
+        for future in concurrent.futures.as_completed(futures):
+            file_path = futures[future]
+            try:
+                if not measure:
+                    results[file_path] = future.result()
+                else:
+                    scope_data, warning, stats = future.result()
+                    add_file_stats(report, file_path, stats)
+                    add_file_profile(run_report, file_path, stats)
+                    results[file_path] = (scope_data, warning)
+            except Exception as e:
+                # A worker that dies (e.g. out of memory) only fails its own file
+                results[file_path] = ({}, ('unreadable input file', f'Could not read {file_path}: {e!r}'))
+
+    return results
 
-        wb.close()
-    
-    return input_data
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _is_scope_sheet(sheet: str) -> bool:
+    '''
+    Check whether a sheet of an input file is a scope sheet, i.e. whether its name contains 'scope'
+    '''
+    return 'scope' in sheet.lower()
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _read_scope_sheets_openpyxl(file_path: Union[str, io.BytesIO], streaming: bool = False) -> Union[Iterator[Tuple[str, Dict[str, list]]], None]:
+    '''
+    Reader backend that loads the file with openpyxl (see READER_BACKENDS)
+
+    Args:
+        file_path (str or io.BytesIO): Path to the input file, or its content
+        streaming (bool): If True, open the file in read-only mode and use _get_scope_data_streaming
+
+    Returns:
+        Iterator of (scope sheet name, scope data), or None if the file cannot be opened
+    '''
+    wb = excel_to_workbook(file_path, read_only = streaming)
+    if wb is None:
+        return None
+
+    # Read-only workbooks do not apply merged ranges, so they are read from the sheet XML instead
+    merged_ranges = {}
+    if streaming:
+        try:
+            with zipfile.ZipFile(file_path) as zf:
+                merged_ranges = read_merged_ranges(zf, _is_scope_sheet)
+        except Exception as e:
+            logger.error("Could not read the merged cells of %s: %s", getattr(file_path, 'name', file_path), e)
+            wb.close()
+            return None
+
+    def scope_sheets() -> Iterator[Tuple[str, Dict[str, list]]]:
+        try:
+            for sheet in wb.sheetnames:
+                if _is_scope_sheet(sheet):
+                    if streaming:
+                        yield sheet, _get_scope_data_streaming(wb, sheet, merged_ranges.get(sheet))
+                    else:
+                        yield sheet, _get_scope_data(wb, sheet)
+        finally:
+            wb.close()
+
+    return scope_sheets()
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _read_scope_sheets_xml(file_path: Union[str, io.BytesIO], streaming: bool = False) -> Union[Iterator[Tuple[str, Dict[str, list]]], None]:
+    '''
+    Reader backend that streams the sheet XML of the file (see utils/xlsx_reader.py and READER_BACKENDS).
+    Gives the same scope data as the openpyxl backend, without building cell and style objects.
+    The file is always streamed, so streaming makes no difference
+
+    Args:
+        file_path (str or io.BytesIO): Path to the input file, or its content
+        streaming (bool): Not used
+
+    Returns:
+        Iterator of (scope sheet name, scope data), or None if the file cannot be opened
+    '''
+    try:
+        zf = zipfile.ZipFile(file_path)
+    except Exception as e:
+        logger.error("Could not open %s: %s", getattr(file_path, 'name', file_path), e)
+        return None
+
+    def scope_sheets() -> Iterator[Tuple[str, Dict[str, list]]]:
+        sheets = iter_sheet_rows(zf, sheet_filter = _is_scope_sheet, key_color = KEY_COLOR)
+        with contextlib.closing(sheets):
+            for sheet, rows in sheets:
+                yield sheet, _scope_entries_to_dict(_iter_scope_entries(rows))
+
+    return scope_sheets()
 
 
 # The underscore (_) prefix means that this function is private and is
 # only used by modules in this package
-# NOTE: Could use some refactoring
 def _get_scope_data(wb: Workbook, sheet: str) -> Dict[str, list]:
     '''
     Get the scope data from the given workbook and sheet
@@ -294,6 +655,10 @@ def _get_scope_data(wb: Workbook, sheet: str) -> Dict[str, list]:
     x x o -> skip, since previous cell likely contains a value to some other key
     x x x -> skip, since previous cell likely contains a value to some other key
 
+    The sheet is scanned for its colored cells, and the rules are compiled into a read plan once per
+    template (see utils/template.py). Which neighbour holds the key depends on the values, so the plan
+    lists the key cells to try, and the cells of the plan are looked up directly
+
     Args:
         wb (Workbook): Workbook to get the scope data from
         sheet (str): Worksheet to get the scope data from
@@ -301,185 +666,601 @@ def _get_scope_data(wb: Workbook, sheet: str) -> Dict[str, list]:
     Returns:
         result_dict (Dict[str, list]): Dictionary with the scope data
     '''
-    result_dict = {}
+    sheet_name = sheet
     sheet = wb[sheet]
-    max_row = sheet.max_row
-    max_col = sheet.max_column
-    
-    for row in range(1, max_row + 1):
-        # Don't load the first column, since previous cell can't load then
-        for col in range(2, max_col + 1):
-            prev_cell = sheet.cell(row=row, column=col-1)
-            cell = sheet.cell(row=row, column=col)
-            next_cell = sheet.cell(row=row, column=col+1)
-
-            # skip if previous cell is colored (since it likely contains a value to some other key)
-            if 'FFDDEBF7'.lower() in prev_cell.fill.start_color.index.lower():
-                    continue
-            # Check if the current cell color is FFDDEBF7
-            elif 'FFDDEBF7'.lower() in cell.fill.start_color.index.lower():
-                if next_cell.value is not None:
+    colored_cells, scanned = _key_colored_cells(sheet)
+    count_scanned_cells(scanned)
+    plan = get_read_plan(sheet_name, colored_cells)
+
+    def get_value(row: int, col: int) -> Any:
+        return sheet.cell(row = row, column = col).value
+
+    return _scope_entries_to_dict(apply_read_plan(plan, get_value))
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _get_scope_data_streaming(wb: Workbook, sheet: str, merged_cells: Union[Dict[int, List[Tuple[int, int, int]]], None] = None) -> Dict[str, list]:
+    '''
+    Get the scope data from the given read-only workbook and sheet
+
+    Same output as _get_scope_data, but the sheet is streamed row by row from a workbook
+    opened with read_only=True, so only one row of cells is held in memory at a time.
+    Read-only workbooks do not apply merged ranges, so the cells inside a merged range, apart from
+    its top-left cell, are made empty and non-colored here, like the MergedCell of a normal workbook
+
+    Args:
+        wb (Workbook): Read-only workbook to get the scope data from
+        sheet (str): Worksheet to get the scope data from
+        merged_cells (Dict[int, List[Tuple[int, int, int]]], optional): Merged ranges of the sheet, see read_merged_ranges
+
+    Returns:
+        result_dict (Dict[str, list]): Dictionary with the scope data
+    '''
+    sheet = wb[sheet]
+    # The <dimension> tag of the file can be missing or stale, so read every stored cell instead
+    sheet.reset_dimensions()
+
+    # Each distinct cell style is checked for the key color once (see _is_key_colored). The empty cells that
+    # fill the gaps between stored cells have no style, and are never key-colored
+    key_styles = {}
+    rows = (
+        [(None, False) if cell is EMPTY_CELL else (cell.value, _is_key_colored(cell, cell.style_array, key_styles)) for cell in row]
+        for row in sheet.iter_rows(min_row = 1, min_col = 1)
+    )
+    if merged_cells:
+        rows = _blank_merged_cells(rows, merged_cells)
+    return _scope_entries_to_dict(_iter_scope_entries(rows))
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _blank_merged_cells(rows: Iterable[List[Tuple[Any, bool]]], merged_cells: Dict[int, List[Tuple[int, int, int]]]) -> Iterator[List[Tuple[Any, bool]]]:
+    '''
+    Make the cells inside the merged ranges of each row empty and non-colored, apart from the top-left cell of each range
+    '''
+    empty_cell = (None, False)
+    for row_index, row in enumerate(rows, start = 1):
+        for min_col, max_col, skip_col in merged_cells.get(row_index, ()):
+            for col in range(min_col, min(max_col, len(row)) + 1):
+                if col != skip_col:
+                    row[col - 1] = empty_cell
+        yield row
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _key_colored_cells(sheet: Any) -> Tuple[List[Tuple[int, int]], int]:
+    '''
+    Find the key-colored cells of a sheet from a workbook that is not read-only, checking each distinct
+    cell style once instead of each cell (see _is_key_colored)
+
+    Args:
+        sheet (Worksheet): Worksheet to search
+
+    Returns:
+        Tuple[List[Tuple[int, int]], int]: (row, column) of every key-colored cell in row-major order,
+        and the number of cells visited
+    '''
+    key_styles = {}
+    colored_cells = []
+    scanned = 0
+    for row in sheet.iter_rows():
+        scanned += len(row)
+        for cell in row:
+            if _is_key_colored(cell, cell.style_id if cell.has_style else None, key_styles):
+                colored_cells.append((cell.row, cell.column))
+    return colored_cells, scanned
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _is_key_colored(cell: Any, style_key: Any, key_styles: Dict[Any, bool]) -> bool:
+    '''
+    Check whether the fill of a cell has the key color, memoized per cell style in key_styles, so that the
+    fill is only resolved and compared once per distinct style
+
+    Args:
+        cell (Any): openpyxl cell, read-only or not
+        style_key (Any): Key of the style of the cell, e.g. cell.style_id or cell.style_array
+        key_styles (Dict[Any, bool]): Memo, style key -> whether its fill has the key color
+
+    Returns:
+        bool: True if the fill of the cell has the key color
+    '''
+    is_key = key_styles.get(style_key)
+    if is_key is None:
+        is_key = key_styles[style_key] = _is_key_fill(cell.fill)
+    return is_key
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _is_key_fill(fill: Any) -> bool:
+    '''
+    Check whether the given fill has the key color (FFDDEBF7) used by the input templates
+
+    Args:
+        fill (Any): openpyxl fill
+
+    Returns:
+        bool: True if the fill has the key color
+    '''
+    return KEY_COLOR.lower() in str(fill.start_color.index).lower()
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _iter_scope_entries(rows: Iterable[Sequence[Tuple[Any, bool]]]) -> Iterator[Tuple[Any, Any, int, int]]:
+    '''
+    Slide a prev/current/next window along each row and yield the key-value pairs
+    found with the triplet rules described in _get_scope_data. Each cell is visited once
+
+    Args:
+        rows (Iterable[Sequence[Tuple[Any, bool]]]): Rows of (value, is key colored) tuples,
+        starting at row 1 and column 1
+
+    Returns:
+        Iterator of (key, value, row, col) tuples, where row and col are the coordinates of the value cell
+    '''
+    empty_cell = (None, False)
+    scanned = 0 # Cells visited, see count_scanned_cells
+
+    for row_index, row in enumerate(rows, start = 1):
+        prev_cell = empty_cell
+        cell = empty_cell
+        # Column 'col' is the current cell once the window has been filled. Columns past
+        # the end of the row are empty and non-colored, so one padding cell is enough
+        for col, next_cell in enumerate(itertools.chain(row, (empty_cell,))):
+            # Don't use the first column, since it has no previous cell
+            if col >= 2 and cell[1] and not prev_cell[1]:
+                if next_cell[0] is not None:
                     # If it has the same color, then it's the key, else the previous cell is the key
-                    if 'FFDDEBF7'.lower() in next_cell.fill.start_color.index.lower():
-                        key = next_cell.value
-                        #print("[get_scope_data] next cell is key (1)")
-                    else:
-                        key = prev_cell.value
-                        #print("[get_scope_data] prev cell is key (1)")
+                    key = next_cell[0] if next_cell[1] else prev_cell[0]
                 # If previous cell is not None, then it's a key, else ignore current cell
-                elif prev_cell.value is not None:
-                    key = prev_cell.value
-                    #print("[get_scope_data] prev cell is key (2)")
+                elif prev_cell[0] is not None:
+                    key = prev_cell[0]
                 else:
-                    continue
+                    key = None
 
-                print(f"[get_scope_data] Key: {key}, Value: {cell.value}")
-                # Extra step. Possibly temporary until better matching technique are explored:
-                # If key ends with " ", remove it
-                if key.endswith(' '):
-                    key = key[:-1]
-                result_dict[key] = cell.value
-            else:
-                pass # equivalent to 'continue' in this case because end of loop
+                if key is not None:
+                    yield key, cell[0], row_index, col
+
+            prev_cell = cell
+            cell = next_cell
+        scanned += col # The last column is the padding cell
+
+    count_scanned_cells(scanned)
+
+
+class ScopeData(dict):
+    '''
+    Scope data of a sheet, a key -> value dictionary (see _get_scope_data). The cell that each value
+    was read from is kept in the cells attribute (key -> coordinate, e.g. 'C5'), for exports that
+    need to point back to the input files. A key that occurs more than once in the sheet (e.g. once
+    per office in scope 2) keeps its last value, and all of its (value, coordinate) occurrences are
+    kept in the repeats attribute. Both attributes are pickled along with the data
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cells = {}
+        self.repeats = {}
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _scope_entries_to_dict(entries: Iterable[Tuple[Any, Any, int, int]]) -> Dict[str, list]:
+    '''
+    Collect the entries from _iter_scope_entries into a key -> value dictionary
+
+    Args:
+        entries (Iterable[Tuple[Any, Any, int, int]]): (key, value, row, col) tuples
+
+    Returns:
+        result_dict (ScopeData): Dictionary with the scope data
+    '''
+    result_dict = ScopeData()
+    debug = logger.isEnabledFor(logging.DEBUG) # Checked once, so that disabled debug output costs nothing per entry
+    for key, value, row, col in entries:
+        if debug:
+            logger.debug("Key: %s, Value: %s", key, value)
+        # Extra step. Possibly temporary until better matching technique are explored:
+        # If key ends with " ", remove it
+        if isinstance(key, str) and key.endswith(' '):
+            key = key[:-1]
+        cell = get_column_letter(col) + str(row)
+        if key in result_dict:
+            if key not in result_dict.repeats:
+                result_dict.repeats[key] = [(result_dict[key], result_dict.cells[key])]
+            result_dict.repeats[key].append((value, cell))
+        result_dict[key] = value
+        result_dict.cells[key] = cell
     return result_dict
 
 
+# Reader backends, selected with settings["Reader backend"]. Each backend is a function (file path or content, streaming)
+# that returns an iterator of (scope sheet name, scope data) tuples, or None if the file cannot be opened
+READER_BACKENDS = {
+    "openpyxl": _read_scope_sheets_openpyxl,
+    "xml": _read_scope_sheets_xml
+}
+
+
 # NOTE: Could definitely use some refactoring
-def write_data_to_summary(data_dict: Dict, wb: Workbook, matches: Dict, settings: Dict) -> Workbook:
+def write_data_to_summary(data_dict: Dict, wb: Workbook, matches: Dict, settings: Dict, save: bool = True, targets: Union[Dict, None] = None,
+                          run_report: Union[Dict, None] = None) -> Workbook:
     """
     Writes data from a dictionary to a summary workbook, using a matching dictionary.
+    The cells to write are computed by compute_summary_writes and written by apply_summary_writes.
+    If settings["Sharded summary"] is True, the cells to write are computed in worker processes, one shard of
+    summary sheets each (see compute_summary_writes_sharded), and merged into the single output file.
+    If settings["Use write map"] is True, the compiled write maps of the summary sheets are reused from the last run
+    and saved again (see load_summary_write_maps).
 
     Args:
         data_dict (dict): A dictionary containing the data to be written to the summary workbook.
         wb (openpyxl.Workbook): The summary workbook to write to.
         matches (dict): A dictionary matching keys in data_dict to sheet names in wb.
         settings (dict): A dictionary containing settings for data processing and output.
+        save (bool): If True, save the workbook as settings["Output file name"] and close it.
+        targets (dict, optional): Filled with the summary cell of each entry, see compute_summary_writes.
+        run_report (dict, optional): Run report to add the 'summary writes' and 'save summary' stages and the
+        measurements of each subsidiary to (see start_run_report).
 
     Returns:
         openpyxl.Workbook: The modified summary workbook.
     """
+    subsidiary_stats = None if run_report is None else run_report['subsidiaries']
+    with profile_stage(run_report, 'summary writes'):
+        write_maps = load_summary_write_maps(settings)
+        writes = None
+        if settings.get("Sharded summary", False):
+            # Imported here, since utils/shard.py imports this module
+            from .shard import compute_summary_writes_sharded
+            try:
+                writes = compute_summary_writes_sharded(data_dict = data_dict, matches = matches, settings = settings, targets = targets, write_maps = write_maps,
+                                                        subsidiary_stats = subsidiary_stats)
+            except (ValueError, KeyError, OSError, zipfile.BadZipFile) as e:
+                logger.warning("Could not compute the summary writes in shards, computing them in this process instead: %s", e)
+        if writes is None:
+            state = {'write_maps': write_maps, 'subsidiary stats': subsidiary_stats}
+            writes = compute_summary_writes(data_dict = data_dict, wb = wb, matches = matches, settings = settings, state = state, targets = targets)
+        save_summary_write_maps(write_maps, settings)
+    with profile_stage(run_report, 'save summary'):
+        return apply_summary_writes(writes = writes, wb = wb, settings = settings, save = save)
+
+
+def load_summary_write_maps(settings: Dict) -> Union[Dict[str, Any], None]:
+    """
+    Load the write maps of the summary file if settings["Use write map"] is True (see load_write_maps).
+    The write map file (settings["Write map file name"]) is kept next to the summary file.
 
-    summary_mismatches = wb['Mismatched Data'] # Load the mismatches sheet
-    mismatch_count = 0 # Keep track of how many mismatches are found
-    mismatch_dict = {} # Nested dict to store keys, items and subitems of mismatches
+    Args:
+        settings (dict): A dictionary containing settings for data processing and output.
 
-    for key in data_dict.keys():
-        print(f"[write_data_to_summary] Writing data from {key} to sheet {matches[key]['match']}")
+    Returns:
+        dict or None: Write map dictionary to pass to compute_summary_writes as state['write_maps'], or None if not used.
+    """
+    if not settings.get("Use write map", False):
+        return None
+    return load_write_maps(_get_write_map_path(settings), os.path.join(settings["Output file folder path"], settings["Summary file name"]), settings)
+
+
+def save_summary_write_maps(write_maps: Union[Dict[str, Any], None], settings: Dict) -> None:
+    """
+    Save the write maps loaded by load_summary_write_maps, with the labels compiled during the run.
+    Nothing is saved unless settings["Use write map"] is True.
+
+    Args:
+        write_maps (dict, optional): Write map dictionary, nothing is saved if None.
+        settings (dict): A dictionary containing settings for data processing and output.
+    """
+    if write_maps is not None and settings.get("Use write map", False):
+        save_write_maps(write_maps, _get_write_map_path(settings))
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _get_write_map_path(settings: Dict) -> str:
+    """
+    Get the path to the write map file, in the folder of the summary file.
+    """
+    return os.path.join(settings["Output file folder path"], settings.get("Write map file name", ".write_map.json"))
+
+
+def apply_summary_writes(writes: List[Tuple[str, int, int, Any]], wb: Workbook, settings: Dict, save: bool = True) -> int:
+    """
+    Writes a list of cell writes to the summary workbook. How they are saved depends on settings["Output mode"]:
+    - "openpyxl" (default): the writes are applied to wb, which is saved as a whole
+    - "patch": the summary file is copied and only the written cells are patched in its XML (see utils/xlsx_patch.py),
+      which keeps the save time proportional to the number of writes. Falls back to "openpyxl" if a value cannot be patched
+    If settings["Accumulate writes"] is True, the writes to the same cell are combined first (see accumulate_writes),
+    e.g. the values of every office of a scope 2 sheet. Otherwise (default) the last write to a cell wins.
+
+    Args:
+        writes (list): (sheet name, row, column, value) per write, see compute_summary_writes.
+        wb (openpyxl.Workbook): The summary workbook to write to.
+        settings (dict): A dictionary containing settings for data processing and output.
+        save (bool): If True, save the workbook as settings["Output file name"] and close it.
+
+    Returns:
+        int: Status code 0 if successful.
+    """
+    output_path = os.path.join(settings['Output file folder path'], settings["Output file name"])
+
+    if settings.get("Accumulate writes", False):
+        writes = accumulate_writes(writes, separator = settings.get("Accumulate separator", ", "))
+
+    if save and settings.get("Output mode", "openpyxl") == "patch":
+        summary_path = os.path.join(settings['Output file folder path'], settings["Summary file name"])
+        try:
+            # Sheets that only exist in memory (e.g. a new "Mismatched Data" sheet) are created with their current content
+            existing_sheets = set(read_sheet_names(summary_path))
+            new_sheet_writes = [
+                (sheet_name, cell.row, cell.column, cell.value)
+                for sheet_name in wb.sheetnames if sheet_name not in existing_sheets
+                for row in wb[sheet_name].iter_rows() for cell in row if cell.value is not None
+            ]
+            patch_workbook(summary_path, output_path, new_sheet_writes + writes)
+            wb.close()
+            return 0 # Status code 0 if successful
+        except PATCH_ERRORS as e:
+            logger.warning("Could not patch %s, saving the whole workbook instead: %s", summary_path, e)
+
+    for sheet_name, row, col, value in writes:
+        wb[sheet_name].cell(row = row, column = col).value = value
+
+    if save:
+        wb.save(output_path)
+        wb.close()
 
-        # load sheet from summary file which matches matches[key]['match']
-        summary_sheet = wb[matches[key]['match']]
-        max_row = summary_sheet.max_row
-        max_col = summary_sheet.max_column
+    return 0 # Status code 0 if successful
+
+
+def accumulate_writes(writes: List[Tuple[str, int, int, Any]], separator: str = ", ") -> List[Tuple[str, int, int, Any]]:
+    """
+    Combines the writes to the same cell into a single write, so that each cell is written once.
+    Numbers are summed, and other values are joined as text with the separator. Empty (None) values are left out.
+
+    Args:
+        writes (list): (sheet name, row, column, value) per write, see compute_summary_writes.
+        separator (str): Put between the values that are joined as text.
+
+    Returns:
+        List[Tuple[str, int, int, Any]]: One write per cell, in the order in which the cells were first written.
+    """
+    buffer = {} # (sheet name, row, column) -> values, in write order
+    for sheet_name, row, col, value in writes:
+        if (sheet_name, row, col) in buffer:
+            buffer[(sheet_name, row, col)].append(value)
+        else:
+            buffer[(sheet_name, row, col)] = [value]
+
+    return [(sheet_name, row, col, _combine_values(values, separator)) for (sheet_name, row, col), values in buffer.items()]
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _combine_values(values: List[Any], separator: str) -> Any:
+    '''
+    Combine the values written to one cell, see accumulate_writes
+
+    Args:
+        values (List[Any]): Values in write order
+        separator (str): Put between the values that are joined as text
+
+    Returns:
+        Any: The sum of the values if they are all numbers, else the values joined as text. None if all values are None
+    '''
+    values = [value for value in values if value is not None]
+    if len(values) == 0:
+        return None
+    if len(values) == 1:
+        return values[0]
+    if all(isinstance(value, numbers.Number) and not isinstance(value, bool) for value in values):
+        if all(isinstance(value, numbers.Integral) for value in values):
+            return sum(values)
+        return math.fsum(values)
+    return separator.join(str(value) for value in values)
 
-        match_count = 0 # Keep track of how many matches are found for a given subitem
-        match_dict = {} # Keep track of which row and column a given subitem is found in
-        write_key = None # Keep track of which match_dict entry to use when writing data
-        write_data = None # Keep track of which data to write to the summary sheet
-        special_case = None # Reset special_case
+
+def compute_summary_writes(data_dict: Dict, wb: Workbook, matches: Dict, settings: Dict, state: Union[Dict, None] = None, targets: Union[Dict, None] = None) -> List[Tuple[str, int, int, Any]]:
+    """
+    Computes which summary workbook cells to write the data from a dictionary to, using a matching dictionary.
+    Entries without a location in their summary sheet are listed in the 'Mismatched Data' sheet instead, with the
+    settings["Mismatch suggestions"] most similar labels of the summary sheet (see suggest_labels) as suggestions.
+    The location of each label is compiled once per summary sheet into a write map (see _compile_write_entries),
+    so that every later entry with the same label is a dictionary lookup.
+
+    Args:
+        data_dict (dict): A dictionary containing the data to be written to the summary workbook.
+        wb (openpyxl.Workbook): The summary workbook, only read. Only used to index the sheets that are not in state['label_indexes'] yet,
+        when a label is not in the write map of its sheet.
+        matches (dict): A dictionary matching keys in data_dict to sheet names in wb.
+        settings (dict): A dictionary containing settings for data processing and output.
+        state (dict, optional): Running state (mismatch rows, write maps, label and trigram indexes, special cases), updated in place. Pass the same
+        dictionary to compute the writes one subsidiary at a time with the same result as all at once. state['write_maps']
+        can be loaded from disk with load_write_maps, and is saved with save_write_maps. If state['subsidiary stats'] is a
+        dictionary, the time, number of writes and match outcomes of each subsidiary are added to it (see start_run_report).
+        targets (dict, optional): Filled with (input folder name, scope sheet, entry name) -> (sheet name, row, column)
+        of the summary cell that each entry is written to. Entries without a location are left out.
+
+    Returns:
+        List[Tuple[str, int, int, Any]]: (sheet name, row, column, value) per write, in write order.
+        Cells can be written more than once, see apply_summary_writes.
+    """
+
+    state = {} if state is None else state
+    writes = [] # Cells to write, in order
+    mismatch_count = state.get('mismatch_count', 0) # Keep track of how many mismatches are found
+    mismatch_dict = state.setdefault('mismatch_dict', {}) # Nested dict to store keys, items and subitems of mismatches
+    write_maps = state.get('write_maps') # Compiled write entry per label and summary sheet, see load_write_maps
+    if write_maps is None:
+        write_maps = state['write_maps'] = {'sheets': {}}
+    subsidiary_stats = state.get('subsidiary stats') # Only counted for the run report
+    debug = logger.isEnabledFor(logging.DEBUG) # Checked once, so that disabled debug output costs nothing per entry
+
+    for key in data_dict.keys():
+        sheet_name = matches[key]['match']
+        logger.info("Writing data from %s to sheet %s", key, sheet_name)
+        if subsidiary_stats is not None:
+            start = time.perf_counter()
+            write_count = len(writes)
+            outcomes = {'entries': 0, 'compiled labels': 0, 'exact': 0, 'substring': 0, 'special case': 0, 'mismatch': 0, 'multiple matches': 0}
+
+        # Sheets that are not in the write map yet (e.g. because there is no summary file on disk) are not hashed,
+        # and are not saved with the write map
+        write_map = write_maps['sheets'].setdefault(sheet_name, {'hash': None, 'labels': {}})['labels']
 
         for item in data_dict[key].keys():
+            # Compile the labels of the scope sheet that are new to the write map in a single pass over the label index
+            new_labels = {str(subitem) for subitem in data_dict[key][item].keys()} - write_map.keys()
+            if len(new_labels) > 0:
+                write_map.update(_compile_write_entries(sheet_name, sorted(new_labels), wb, state, settings))
+                if subsidiary_stats is not None:
+                    outcomes['compiled labels'] += len(new_labels)
+
             for subitem in data_dict[key][item].keys():
-                for row, col in itertools.product(range(1, max_row + 1), range(1, max_col + 1)):
-
-                    # Load cell value
-                    cell_value = summary_sheet.cell(row = row, column = col).value
-
-                    # Pre-process cell value
-                    if type(cell_value) == str:
-                        cell_value = _preprocess_cell(cell_value)
-
-                    # Try to match subitem to cell_value
-                    if subitem == cell_value:
-                        #print(f"[write_data_to_summary] Found match for {subitem} at row {row} and column {col}")
-                        match_count += 1
-                        match_dict[match_count] = {"row": row, "col": col}
-                    elif str(subitem) in str(cell_value):
-                        #print(f"[write_data_to_summary] {subitem} part of {cell_value} at row {row} and column {col}")
-                        match_count += 1
-                        match_dict[match_count] = {"row": row, "col": col}
-                    else:
-                        #print(f"[write_data_to_summary] No match for {subitem} at row {row} and column {col}")
-                        pass
+                entry = write_map[str(subitem)]
+                if subsidiary_stats is not None:
+                    outcomes['entries'] += 1
+                    outcomes[entry['outcome']] += 1
+                    if entry['count'] > 1:
+                        outcomes['multiple matches'] += 1
 
                 # Handle various amounts of matches
-                if match_count > 1:
+                if entry['count'] > 1:
                     if 'Scope 1'.lower() in item.lower():
-                        write_key = min(match_dict.keys()) # use match_dict entry with the lowest key
+                        target = entry['first'] # use the first match in the row-major scan order of the summary sheet
                     elif 'Scope 3'.lower() in item.lower():
-                        write_key = max(match_dict.keys()) # use match_dict entry with the highest key
+                        target = entry['last'] # use the last match
                     else:
-                        print(f"[write_data_to_summary] Multiple matches found for {subitem} in sheet {matches[key]['match']}") 
-                        pass # TODO # Handler (non-urgent)
-                elif match_count == 0:
-
-                    # Check if subitem is a special case
-                    special_case, match_count, write_key, match_dict = _check_if_special_case(item = subitem, match_count = match_count, match_dict = match_dict)
-                    
-                    if special_case:
-                        print(f"[write_data_to_summary] Special case: {special_case}")
+                        logger.warning("Multiple matches found for %s in sheet %s", subitem, sheet_name, extra = {"event": "multiple matches"})
+                        target = entry['first'] # TODO # Handler (non-urgent), use the first match for now
+                elif entry['count'] == 1:
+                    target = entry['first']
+                    if debug and 'special' in entry:
+                        logger.debug("Special case: %s", entry['special'])
+                else:
+                    # Register mismatch
+                    mismatch_count += 1
+                    logger.warning("No match found for %s (%s, %s) in sheet %s", subitem, key, item, sheet_name, extra = {"event": "mismatch"})
+                    if key not in mismatch_dict.keys():
+                        mismatch_dict[key] = {}
+                    if item not in mismatch_dict[key].keys():
+                        mismatch_dict[key][item] = {}
+                    if subitem not in mismatch_dict[key][item].keys():
+                        mismatch_dict[key][item][subitem] = mismatch_count
+                        # write to mismatch sheet
+                        writes.append(('Mismatched Data', mismatch_count + 1, 1, key))
+                        writes.append(('Mismatched Data', mismatch_count + 1, 2, item))
+                        writes.append(('Mismatched Data', mismatch_count + 1, 3, subitem))
+                        writes.append(('Mismatched Data', mismatch_count + 1, 4, "No match found"))
+                        if entry['suggestions']:
+                            writes.append(('Mismatched Data', mismatch_count + 1, 5, entry['suggestions']))
                     else:
-                        # Register mismatch
-                        mismatch_count += 1
-                        if key not in mismatch_dict.keys():
-                            mismatch_dict[key] = {}
-                        if item not in mismatch_dict[key].keys():
-                            mismatch_dict[key][item] = {}
-                        if subitem not in mismatch_dict[key][item].keys():
-                            mismatch_dict[key][item][subitem] = mismatch_count
-                            # write to mismatch sheet
-                            summary_mismatches.cell(row = mismatch_count+1, column = 1).value = key
-                            summary_mismatches.cell(row = mismatch_count+1, column = 2).value = item
-                            summary_mismatches.cell(row = mismatch_count+1, column = 3).value = subitem
-                            summary_mismatches.cell(row = mismatch_count+1, column = 4).value = "No match found"
-                        else:
-                            print(f"[write_data_to_summary] {subitem} already in mismatch_dict")
-                            pass # TODO # Handler? (this bit was never reached in testing)
-                        continue
+                        logger.debug("%s already in mismatch_dict", subitem)
+                        pass # TODO # Handler? (this bit was never reached in testing)
+                    continue
+
+                # A key that is repeated in the scope sheet (e.g. once per office) is written once per filled in
+                # occurrence, and apply_summary_writes combines the writes to the same cell
+                repeats = getattr(data_dict[key][item], 'repeats', {}) # Only ScopeData knows its repeated keys
+                if subitem in repeats:
+                    values = [value for value, _ in repeats[subitem] if value is not None] or [None]
                 else:
-                    write_key = list(match_dict.keys())[0] # use match_dict entry with the only key
+                    values = [data_dict[key][item][subitem]]
 
                 # Get data from dict, or generate if missing and settings allow
-                if data_dict[key][item][subitem] is not None:
-                    write_data = data_dict[key][item][subitem]
-                elif settings["Generate missing write data"]:
-                    write_data = "GENERATED: " + str(np.random.randint(0, 100))
-                else:
-                    write_data = None
-
-                # Write data to summary sheet if write_key is not None
-                if write_key is not None:
-                    summary_sheet.cell(row = match_dict[write_key]["row"], column = match_dict[write_key]["col"] + 1).value = write_data
-                    print(f"[write_data_to_summary] Writing {write_data} to row {match_dict[write_key]['row']} and column {match_dict[write_key]['col'] + 1} (sheet: {matches[key]['match']}, {item}, cell name: {subitem})")
-                    
-                    # Existing value workaround attempt
-                    # NOTE: this is the final major issue to be resolved
-                    # NOTE 2: workaround not needed if scope 2 contains sums at the end of the sheet
-                    '''
-                    # check if cell contains data
-                    if summary_sheet.cell(row = match_dict[write_key]["row"], column = match_dict[write_key]["col"] + 1).value is not None:
-                        print(f"Row {match_dict[write_key]['row']} and column {match_dict[write_key]['col'] + 1} already contains data: {cell_value}")
-                        if type(cell_value) == str:
-                            
-                            print(f'String trigger for: {summary_sheet.cell(row = match_dict[write_key]["row"], column = match_dict[write_key]["col"] + 1).value}')
-                        elif type(cell_value) == int or type(cell_value) == float:
-
-                            print(f'Int/float trigger for: {summary_sheet.cell(row = match_dict[write_key]["row"], column = match_dict[write_key]["col"] + 1).value}')
+                write_datas = []
+                for value in values:
+                    if value is not None:
+                        write_datas.append(value)
+                    elif settings["Generate missing write data"]:
+                        write_datas.append("GENERATED: " + str(random.randint(0, 99)))
                     else:
+                        write_datas.append(None)
 
-                        print(f"Cell data is None. Writing {write_data} to row {match_dict[write_key]['row']} and column {match_dict[write_key]['col'] + 1}")
-                    '''
-                else:
-                    print(f"[write_data_to_summary] Write key is None for {subitem} in sheet {matches[key]['match']}")
+                # Write data to the target cell of the summary sheet
+                for write_data in write_datas:
+                    writes.append((sheet_name, target[0], target[1], write_data))
+                    if debug:
+                        logger.debug("Writing %s to row %s and column %s (sheet: %s, %s, cell name: %s)", write_data, target[0], target[1], sheet_name, item, subitem)
+                if targets is not None:
+                    targets[(key, item, subitem)] = writes[-1][:3]
 
-                # Reset match_count and match_dict
-                match_count = 0
-                match_dict = {}
-          
-    wb.save(os.path.join(settings['Output file folder path'], settings["Output file name"]))
-    wb.close()
+        if subsidiary_stats is not None:
+            subsidiary_stats[key] = {'sheet': sheet_name, 'seconds': time.perf_counter() - start, 'writes': len(writes) - write_count, **outcomes}
+
+    state['mismatch_count'] = mismatch_count
+    return writes
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _compile_write_entries(sheet_name: str, labels: List[str], wb: Workbook, state: Dict, settings: Dict) -> Dict[str, Dict[str, Any]]:
+    """
+    Compile the write entries of the given labels in a summary sheet, with the special cases and the mismatch
+    suggestions already applied. The label index of the sheet is built (and kept in state['label_indexes']) on first use.
+
+    Args:
+        sheet_name (str): Name of the summary sheet.
+        labels (List[str]): Labels to compile, as strings.
+        wb (openpyxl.Workbook): The summary workbook, only used if the sheet is not in state['label_indexes'].
+        state (dict): Running state of compute_summary_writes.
+        settings (dict): A dictionary containing settings for data processing and output.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Label -> write entry, one of
+        - {'count': number of matching cells, 'first': [row, column], 'last': [row, column], 'outcome': 'exact' or 'substring'},
+          with the column to write to (the one after the label) of the first and last matching cell in row-major order.
+          The outcome is 'exact' if a cell of the sheet is the label itself
+        - {'count': 1, 'first': ..., 'last': ..., 'special': name of the special case, 'outcome': 'special case'}
+          for special cases (see _check_if_special_case)
+        - {'count': 0, 'suggestions': suggested labels as text, empty if there are none, 'outcome': 'mismatch'} for mismatches
+    """
+    label_indexes = state.setdefault('label_indexes', {}) # Label position index per summary sheet, built once per sheet
+    trigram_indexes = state.setdefault('trigram_indexes', {}) # Suggestion index per summary sheet, built on its first mismatch
+    if 'special_cases' not in state:
+        state['special_cases'] = get_special_cases() # Resolved once per state, so that the labels do not check the file for changes
+    suggestion_count = settings.get("Mismatch suggestions", 3)
+    suggestion_min_score = settings.get("Mismatch suggestion min score", 0.3)
+
+    if sheet_name not in label_indexes:
+        label_indexes[sheet_name] = build_label_index(wb[sheet_name])
+    label_index = label_indexes[sheet_name]
+
+    entries = {}
+    label_matches = find_label_matches(label_index, labels)
+    for label in labels:
+        label_match = label_matches.get(label)
+        if label_match is not None:
+            entries[label] = {
+                'count': label_match['count'],
+                'first': [label_match['first'][0], label_match['first'][1] + 1],
+                'last': [label_match['last'][0], label_match['last'][1] + 1],
+                'outcome': 'exact' if label.strip() in label_index else 'substring'
+            }
+            continue
+
+        # Check if label is a special case
+        special_case, _, write_key, _ = _check_if_special_case(item = label, match_count = 0, match_dict = {}, special_cases = state['special_cases'])
+        if special_case:
+            target = [special_case['row'], special_case['col'] + 1]
+            entries[label] = {'count': 1, 'first': target, 'last': target, 'special': write_key, 'outcome': 'special case'}
+            continue
+
+        suggestions = []
+        if suggestion_count > 0:
+            if sheet_name not in trigram_indexes:
+                trigram_indexes[sheet_name] = build_trigram_index(label_index)
+            suggestions = suggest_labels(trigram_indexes[sheet_name], label, top_k = suggestion_count, min_score = suggestion_min_score)
+        entries[label] = {'count': 0, 'suggestions': '; '.join(
+            f'{text} ({get_column_letter(col)}{row}, {score})' for text, score, (row, col) in suggestions
+        ), 'outcome': 'mismatch'}
+
+    return entries
 
-    return 0 # Status code 0 if successful
-    
 
 # Will contain several steps, but for now just removes trailing spaces
 # The underscore (_) prefix means that this function is private and is
@@ -499,14 +1280,20 @@ def _preprocess_cell(cell: str) -> str:
 
 # The underscore (_) prefix means that this function is private and is
 # only used by modules in this package
-def _check_if_special_case(item: str, match_dict: Dict, match_count: int) -> Tuple[Dict, int, str, Dict]:
+def _check_if_special_case(item: str, match_dict: Dict, match_count: int, json_path: str = 'scope_2_dict.json',
+                           special_cases: Union[Tuple[Dict[str, Dict[str, Any]], Tuple], None] = None) -> Tuple[Dict, int, str, Dict]:
     """
     Check if the given item matches any of the special cases defined in scope_2_dict.json.
+    A special case matches if all of its keywords are part of the (lowercase) item. The special
+    cases are tried in the order they are defined in, and the first match is used.
 
     Args:
         item (str): The item to check.
         match_dict (Dict): A dictionary containing the matches found so far.
         match_count (int): The number of matches found so far.
+        json_path (str): Path to the special case dictionary, only used if special_cases is None.
+        special_cases (Tuple, optional): Compiled special cases from get_special_cases. Pass them when checking
+        many items, so that the file is not checked for changes once per item.
 
     Returns:
         A tuple containing the following four elements:
@@ -518,51 +1305,64 @@ def _check_if_special_case(item: str, match_dict: Dict, match_count: int) -> Tup
     """
     special_case = None
     write_key = None
-    
-    # Load scope 2 special case dictionary (scope_2_dict.json)
-    with open('scope_2_dict.json') as f:
-        scope_2_dict = json.load(f)
-
-    # Electricity
-    if all(x in item.lower() for x in ['källa', 'inköpt el']):
-        print(f"[_check_if_special_case] Found 'källa' and 'inköpt el' in subitem: {item}. Using special case 1")
-        special_case = scope_2_dict["1"]
-        # Note that the write_key is not an int in this case
-        match_dict[special_case["name"]] = {"row": special_case["row"], "col": special_case["col"]}
-        write_key = special_case["name"]
-        match_count += 1
-        print(f"{match_count} matches found for {item}")
-    elif all(x in item.lower() for x in ['kwh', 'elanvändning']):
-        print(f"[_check_if_special_case]  Found 'kwh' and 'elanvändning' in subitem: {item}, using special case 2")
-        special_case = scope_2_dict["2"]
-        match_dict[special_case["name"]] = {"row": special_case["row"], "col": special_case["col"]}
-        write_key = special_case["name"]
-        match_count += 1
-    # Heat
-    elif all(x in item.lower() for x in ['källa', 'värme']):
-        print(f"[_check_if_special_case] Found 'källa' and 'värme' in subitem: {item}, using special case 3")
-        special_case = scope_2_dict["3"]
-        match_dict[special_case["name"]] = {"row": special_case["row"], "col": special_case["col"]}
-        write_key = special_case["name"]
-        match_count += 1
-    elif all(x in item.lower() for x in ['kwh', 'värme']):
-        print(f"f[_check_if_special_case] Found 'kwh' and 'värme' in subitem: {item}, using special case 4")
-        special_case = scope_2_dict["4"]
-        match_dict[special_case["name"]] = {"row": special_case["row"], "col": special_case["col"]}
-        write_key = special_case["name"]
-        match_count += 1
-    # Cooling
-    elif all(x in item.lower() for x in ['källa', 'kyla']):
-        print(f"[_check_if_special_case] Found 'källa' and 'kyla' in subitem: {item}, using special case 5")
-        special_case = scope_2_dict["5"]
-        match_dict[special_case["name"]] = {"row": special_case["row"], "col": special_case["col"]}
-        write_key = special_case["name"]
-        match_count += 1
-    elif all(x in item.lower() for x in ['kwh', 'kyla']):
-        print(f"[_check_if_special_case] Found 'kwh' and 'kyla' in subitem: {item}, using special case 6")
-        special_case = scope_2_dict["6"]
-        match_dict[special_case["name"]] = {"row": special_case["row"], "col": special_case["col"]}
-        write_key = special_case["name"]
-        match_count += 1
-
-    return special_case, match_count, write_key, match_dict
\ No newline at end of file
+
+    if special_cases is None:
+        special_cases = get_special_cases(json_path)
+    special_cases, automaton = special_cases
+
+    # Find all keywords in the item in a single pass, then pick the first special case they cover
+    found_keywords = _search_automaton(automaton, str(item).lower())
+    for case_id, case in special_cases.items():
+        if case["keywords"] <= found_keywords:
+            logger.debug("Found %s in subitem: %s, using special case %s", sorted(case['keywords']), item, case_id)
+            special_case = case["entry"]
+            # Note that the write_key is not an int in this case
+            match_dict[special_case["name"]] = {"row": special_case["row"], "col": special_case["col"]}
+            write_key = special_case["name"]
+            match_count += 1
+            break
+
+    return special_case, match_count, write_key, match_dict
+
+
+def get_special_cases(json_path: str = 'scope_2_dict.json') -> Tuple[Dict[str, Dict[str, Any]], Tuple]:
+    """
+    Get the compiled special case dictionary. It is only read and compiled again when the file has changed
+    since the last call (see _load_special_cases).
+
+    Args:
+        json_path (str): Path to the special case dictionary.
+
+    Returns:
+        A tuple of the special cases and the keyword automaton, see _load_special_cases.
+    """
+    return _load_special_cases(os.path.abspath(json_path), os.stat(json_path).st_mtime_ns)
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+@functools.lru_cache(maxsize = 8)
+def _load_special_cases(json_path: str, mtime: int) -> Tuple[Dict[str, Dict[str, Any]], Tuple]:
+    """
+    Load and compile the special case dictionary. Cached per path and modification time, so the
+    file is only read again when it changes.
+
+    Args:
+        json_path (str): Absolute path to the special case dictionary.
+        mtime (int): Modification time of the file, only used as part of the cache key.
+
+    Returns:
+        A tuple containing the following two elements:
+        - special_cases (Dict): Special case id -> {"keywords": set of lowercase keywords, "entry": special case}
+        - automaton (Tuple): Aho-Corasick automaton over all keywords (see utils/label_index.py)
+    """
+    special_cases = {}
+    for case_id, entry in load_json(json_path).items():
+        keywords = {keyword.lower() for keyword in entry.get("keywords", [])}
+        if len(keywords) == 0:
+            logger.warning("Special case %s in %s has no keywords and is ignored", case_id, json_path)
+            continue
+        special_cases[case_id] = {"keywords": keywords, "entry": entry}
+
+    automaton = _build_automaton({keyword for case in special_cases.values() for keyword in case["keywords"]})
+    return special_cases, automaton
@@ -0,0 +1,463 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+from openpyxl import Workbook
+
+from typing import List, Dict, Union, Tuple, Any, Iterator, Set
+
+from .util import discover_input_files, match_lists, compute_summary_writes, apply_summary_writes, accumulate_writes, \
+    load_summary_write_maps, save_summary_write_maps, _get_file_jobs, _get_read_settings, _get_memory_budget, _read_input_files, _is_input_file_name
+from .xlsx_patch import patch_workbook, PATCH_ERRORS
+from .export import build_activity_table, export_activity_data
+from .match_store import save_match_store
+from .memory import plan_reads
+
+
+logger = logging.getLogger(__name__)
+
+# inotify event masks, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+# Files are only re-read once they have been written and closed, or moved into place (e.g. Excel saves to a temporary file first)
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+# struct inotify_event: int wd, uint32_t mask, uint32_t cookie, uint32_t len, followed by len bytes of name
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def run_watch(settings: Dict, wb: Workbook, summary_sheets: List[str], input_folder_names: List[str], matches: Dict, store: Union[Dict, None] = None) -> None:
+    '''
+    Summary:
+        Write the summary file once, then keep watching the input folder and update the summary file whenever
+        subsidiary workbooks are added, changed or removed, until interrupted (Ctrl+C):
+        - changes are noticed with inotify on Linux, or by checking the files every settings["Watch poll interval (s)"]
+          seconds elsewhere (settings["Watch backend"]: "auto", "inotify" or "poll")
+        - a burst of saves is handled as one change, once the folder has been quiet for settings["Watch debounce (s)"] seconds
+        - only the changed files are read again, the other files are kept in memory
+        - the input folders are only matched again when folders are added or removed
+        - only the writes of the subsidiaries whose data or matched sheet changed are computed again
+        - only the summary cells whose value changed are written. With settings["Output mode"] set to "patch", only
+          the sheets that contain them are rewritten in the output file
+
+    Args:
+        settings (Dict): Script settings dictionary
+        wb (openpyxl.Workbook): The summary workbook, with the "Mismatched Data" sheet
+        summary_sheets (List[str]): Sheets that the input folders are matched to, without the "Mismatched Data" sheet
+        input_folder_names (List[str]): Input folders that matches was computed for
+        matches (Dict): Matches between the input folders and the summary sheets, see match_lists
+        store (Dict, optional): Match store to reuse and update, see load_match_store
+    '''
+    input_path = settings["Input file folder path"]
+    changes = _watch_changes(input_path, settings)
+
+    watch_state = {
+        'file data': {}, # File path -> scope data
+        'summary sheets': list(summary_sheets), # Sheets to match the input folders to
+        'folder names': set(input_folder_names), # Input folders that the matches are for
+        'matches': matches, # See match_lists
+        'subsidiary writes': {}, # Input folder name -> writes of its data, see _compute_subsidiary_writes
+        'cells': {}, # (sheet name, row, column) -> value written in the last update
+        'original values': {}, # (sheet name, row, column) -> value in the summary file, before anything was written
+        'label indexes': {}, # See compute_summary_writes
+        'trigram indexes': {}, # See compute_summary_writes
+        'write maps': load_summary_write_maps(settings), # See compute_summary_writes, compiled labels are kept between updates
+        'written': False # Whether the output file has been written yet
+    }
+    _update_summary(watch_state, settings, wb, store, changed_paths = set())
+    logger.info("Watching %s for changes, press Ctrl+C to stop", input_path)
+    try:
+        for changed_paths in changes:
+            _update_summary(watch_state, settings, wb, store, changed_paths)
+    except KeyboardInterrupt:
+        logger.info("Stopped watching %s", input_path)
+    finally:
+        changes.close()
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _update_summary(watch_state: Dict[str, Any], settings: Dict, wb: Workbook, store: Union[Dict, None], changed_paths: Set[str]) -> None:
+    '''
+    Read the new and changed input files, recompute the summary writes of the subsidiaries they belong to and write the cells
+    that changed since the last update
+
+    Args:
+        watch_state (Dict[str, Any]): State kept between updates, see run_watch
+        settings (Dict): Script settings dictionary
+        wb (openpyxl.Workbook): The summary workbook
+        store (Dict, optional): Match store to reuse and update
+        changed_paths (Set[str]): Paths that changed since the last update
+    '''
+    start = time.perf_counter()
+    file_data = watch_state['file data']
+
+    input_files = discover_input_files(path = settings["Input file folder path"], settings = settings)
+    if set(input_files.keys()) != watch_state['folder names']:
+        watch_state['matches'] = match_lists(list(input_files.keys()), watch_state['summary sheets'], filter_doubles = True, store = store)
+        watch_state['folder names'] = set(input_files.keys())
+        if store is not None:
+            save_match_store(store, settings["Match store file name"])
+    matches = watch_state['matches']
+    file_jobs = _get_file_jobs([file_path for file_paths in input_files.values() for file_path in file_paths], matches)
+
+    # Read the files that are new or changed, and forget the ones that are gone
+    job_paths = {file_path for _, file_path in file_jobs}
+    for file_path in list(file_data):
+        if file_path not in job_paths:
+            del file_data[file_path]
+    files_to_read = [file_path for _, file_path in file_jobs if file_path not in file_data or file_path in changed_paths]
+    workers, streaming, backend = _get_read_settings(settings)
+    workers, streaming_files = plan_reads(files_to_read, workers, streaming, backend, _get_memory_budget(settings))
+    for file_path, (scope_data, warning) in _read_input_files(files_to_read, workers, streaming, backend, streaming_files = streaming_files).items():
+        file_data[file_path] = scope_data
+        if warning is not None:
+            event, message = warning
+            logger.warning(message, extra = {"event": event, "data": {"file": file_path}})
+
+    # Same as get_input_data: the last file of a folder wins
+    input_data = {}
+    sources = {}
+    for input_data_key, file_path in file_jobs:
+        input_data[input_data_key] = file_data[file_path]
+        sources[input_data_key] = file_path
+
+    # Recompute the writes of the subsidiaries whose file was read again, or whose file or matched sheet changed
+    subsidiary_writes = watch_state['subsidiary writes']
+    for input_data_key in list(subsidiary_writes):
+        if input_data_key not in input_data:
+            del subsidiary_writes[input_data_key]
+    read_paths = set(files_to_read)
+    state = {'label_indexes': watch_state['label indexes'], 'trigram_indexes': watch_state['trigram indexes'], 'write_maps': watch_state['write maps']}
+    for input_data_key, file_path in sources.items():
+        previous = subsidiary_writes.get(input_data_key)
+        if previous is None or file_path in read_paths or previous['file'] != file_path or previous['sheet'] != matches[input_data_key]['match']:
+            subsidiary_writes[input_data_key] = _compute_subsidiary_writes(input_data_key, input_data[input_data_key], file_path, wb, matches, settings, state)
+    watch_state['write maps'] = state['write_maps']
+    save_summary_write_maps(watch_state['write maps'], settings)
+
+    # Same writes as computing them for every subsidiary at once: the mismatch rows follow on from the previous subsidiaries
+    writes = []
+    targets = {}
+    mismatch_count = 0
+    for input_data_key in input_data:
+        for sheet_name, row, col, value in subsidiary_writes[input_data_key]['writes']:
+            writes.append((sheet_name, row + mismatch_count if sheet_name == 'Mismatched Data' else row, col, value))
+        mismatch_count += subsidiary_writes[input_data_key]['mismatch count']
+        targets.update(subsidiary_writes[input_data_key]['targets'])
+    if settings.get("Accumulate writes", False):
+        writes = accumulate_writes(writes, separator = settings.get("Accumulate separator", ", "))
+    cells = {}
+    for sheet_name, row, col, value in writes:
+        cells[(sheet_name, row, col)] = value
+
+    # Cells that are no longer written get back the value they had in the summary file
+    original_values = watch_state['original values']
+    for cell in cells:
+        if cell not in original_values:
+            original_values[cell] = wb[cell[0]].cell(row = cell[1], column = cell[2]).value
+    previous_cells = watch_state['cells']
+    changed_writes = [cell + (value,) for cell, value in cells.items() if cell not in previous_cells or previous_cells[cell] != value]
+    changed_writes += [cell + (original_values[cell],) for cell in previous_cells if cell not in cells]
+
+    if len(changed_writes) == 0 and watch_state['written']:
+        logger.info("No changes to the summary file (%d input files read)", len(files_to_read))
+        return
+
+    if _write_changes(changed_writes, writes, wb, settings, full = not watch_state['written']):
+        watch_state['cells'] = cells
+        watch_state['written'] = True
+        sheet_names = sorted({sheet_name for sheet_name, _, _, _ in changed_writes})
+        logger.info("Updated %d cells in %s (%d input files read) in %.1f s", len(changed_writes), ', '.join(sheet_names), len(files_to_read), time.perf_counter() - start)
+
+    if settings.get("Export format", "none") != "none":
+        export_activity_data(build_activity_table(input_data, sources, targets), settings)
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _compute_subsidiary_writes(input_data_key: str, scope_data: Dict, file_path: str, wb: Workbook, matches: Dict, settings: Dict, state: Dict) -> Dict[str, Any]:
+    '''
+    Compute the summary writes of one subsidiary, with its mismatch rows numbered from the first row of the "Mismatched Data" sheet
+
+    Args:
+        input_data_key (str): Input folder name
+        scope_data (Dict): Scope data of the input folder, see get_input_data
+        file_path (str): Input file that the data was read from
+        wb (openpyxl.Workbook): The summary workbook
+        matches (Dict): Matches between the input folders and the summary sheets
+        settings (Dict): Script settings dictionary
+        state (Dict): State of compute_summary_writes to share between the subsidiaries (write maps, label and trigram indexes)
+
+    Returns:
+        Dict[str, Any]: The file and the matched sheet that the writes were computed for, the writes, the number of
+        mismatch rows they use and the targets of the entries (see compute_summary_writes)
+    '''
+    state['mismatch_count'] = 0
+    state['mismatch_dict'] = {}
+    targets = {}
+    writes = compute_summary_writes({input_data_key: scope_data}, wb, matches, settings, state = state, targets = targets)
+    return {'file': file_path, 'sheet': matches[input_data_key]['match'], 'writes': writes, 'mismatch count': state['mismatch_count'], 'targets': targets}
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _write_changes(changed_writes: List[Tuple[str, int, int, Any]], writes: List[Tuple[str, int, int, Any]], wb: Workbook, settings: Dict, full: bool) -> bool:
+    '''
+    Write the changed cells to the output file. With settings["Output mode"] set to "patch", the existing output
+    file is patched. Otherwise, or if the output file cannot be patched, the whole workbook is saved
+
+    Args:
+        changed_writes (List[Tuple[str, int, int, Any]]): Cells that changed since the last update
+        writes (List[Tuple[str, int, int, Any]]): Every cell to write, see compute_summary_writes
+        wb (openpyxl.Workbook): The summary workbook
+        settings (Dict): Script settings dictionary
+        full (bool): If True, there is no output file to update yet
+
+    Returns:
+        bool: True if the output file was written
+    '''
+    output_path = os.path.join(settings['Output file folder path'], settings["Output file name"])
+    try:
+        if full:
+            apply_summary_writes(writes, wb, settings)
+            return True
+
+        if settings.get("Output mode", "openpyxl") == "patch":
+            try:
+                patch_workbook(output_path, output_path, changed_writes)
+                return True
+            except PATCH_ERRORS as e:
+                logger.warning("Could not patch %s, saving the whole workbook instead: %s", output_path, e)
+                changed_writes = writes # The workbook has not been written to in patch mode
+
+        for sheet_name, row, col, value in changed_writes:
+            wb[sheet_name].cell(row = row, column = col).value = value
+        wb.save(output_path)
+        return True
+    except OSError as e:
+        # E.g. the output file is open in Excel, the next change tries again
+        logger.error("Could not write %s: %s", output_path, e)
+        return False
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _watch_changes(path: str, settings: Dict) -> Iterator[Set[str]]:
+    '''
+    Watch a folder for changed input files, with the backend in settings["Watch backend"]
+
+    Args:
+        path (str): Input folder to watch
+        settings (Dict): Script settings dictionary
+
+    Returns:
+        Iterator[Set[str]]: Paths that changed, once per burst of changes
+    '''
+    backend = settings.get("Watch backend", "auto")
+    debounce = settings.get("Watch debounce (s)", 2.0)
+    if backend not in ("auto", "inotify", "poll"):
+        raise ValueError(f'Unknown watch backend "{backend}", expected one of {["auto", "inotify", "poll"]}')
+
+    if backend != "poll" and sys.platform.startswith('linux'):
+        try:
+            return _watch_inotify(path, settings, debounce)
+        except OSError as e:
+            if backend == "inotify":
+                raise
+            logger.warning("Could not use inotify, checking for changes every %s s instead: %s", settings.get("Watch poll interval (s)", 1.0), e)
+    elif backend == "inotify":
+        raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+
+    return _watch_polling(path, settings, settings.get("Watch poll interval (s)", 1.0), debounce)
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _watch_inotify(path: str, settings: Dict, debounce: float) -> Iterator[Set[str]]:
+    '''
+    Set up inotify watches on the input folder and every folder below it, through the C library
+
+    Args:
+        path (str): Input folder to watch
+        settings (Dict): Script settings dictionary
+        debounce (float): Seconds without events that end a burst of changes
+
+    Returns:
+        Iterator[Set[str]]: Paths that changed, once per burst of changes
+
+    Raises:
+        OSError: If inotify is not available
+    '''
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError(errno.ENOSYS, 'inotify is not available')
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+    fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+    watches = {} # Watch descriptor -> folder
+
+    def add_watches(folder: str) -> None:
+        for directory, _, _ in os.walk(folder):
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                logger.warning("Could not watch %s: %s", directory, os.strerror(ctypes.get_errno()))
+            else:
+                watches[wd] = directory
+
+    try:
+        add_watches(path)
+    except Exception:
+        os.close(fd)
+        raise
+
+    return _inotify_changes(fd, watches, add_watches, path, settings, debounce)
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _inotify_changes(fd: int, watches: Dict[int, str], add_watches: Any, path: str, settings: Dict, debounce: float) -> Iterator[Set[str]]:
+    '''
+    Read inotify events and group them into bursts of changes to input files. Events for other files
+    (e.g. the summary and output files in the input folder itself, or Excel lock files) are ignored
+
+    Args:
+        fd (int): inotify file descriptor, closed when the iterator is closed
+        watches (Dict[int, str]): Watch descriptor -> folder, updated as folders are created and removed
+        add_watches (Callable[[str], None]): Watches a new folder and every folder below it
+        path (str): Input folder
+        settings (Dict): Script settings dictionary
+        debounce (float): Seconds without events that end a burst of changes
+
+    Returns:
+        Iterator[Set[str]]: Paths that changed, once per burst of changes
+    '''
+    try:
+        while True:
+            changed_paths = set()
+            timeout = None # Wait for the first event of a burst without a time limit
+            while True:
+                ready, _, _ = select.select([fd], [], [], timeout)
+                if len(ready) == 0:
+                    break # Quiet for the debounce time after a change
+                try:
+                    data = os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+
+                offset = 0
+                while offset < len(data):
+                    wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                    name = os.fsdecode(data[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + length].rstrip(b'\0'))
+                    offset += _EVENT_HEADER.size + length
+
+                    folder = watches.get(wd)
+                    if mask & IN_Q_OVERFLOW:
+                        logger.warning("Missed some changes, reading every input file again", extra = {"event": "watch overflow"})
+                        changed_paths.add(path)
+                        changed_paths.update(file_path for file_paths in discover_input_files(path, settings).values() for file_path in file_paths)
+                    elif mask & IN_IGNORED:
+                        watches.pop(wd, None)
+                    elif folder is None:
+                        continue
+                    elif mask & IN_ISDIR:
+                        full_path = os.path.join(folder, name)
+                        if mask & (IN_CREATE | IN_MOVED_TO):
+                            add_watches(full_path)
+                        changed_paths.add(full_path)
+                    elif os.path.normpath(folder) != os.path.normpath(path) and _is_input_file_name(name, settings):
+                        changed_paths.add(os.path.join(folder, name))
+                timeout = debounce if len(changed_paths) > 0 else None
+            yield changed_paths
+    finally:
+        os.close(fd)
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _watch_polling(path: str, settings: Dict, interval: float, debounce: float) -> Iterator[Set[str]]:
+    '''
+    Check the size and modification time of the input files every interval seconds
+
+    Args:
+        path (str): Input folder to watch
+        settings (Dict): Script settings dictionary
+        interval (float): Seconds between checks
+        debounce (float): Seconds without changes that end a burst of changes
+
+    Returns:
+        Iterator[Set[str]]: Paths that changed, once per burst of changes
+    '''
+    # Taken now rather than on the first change, so that changes made during the first update are not missed
+    return _polling_changes(_snapshot(path, settings), path, settings, interval, debounce)
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _polling_changes(snapshot: Dict[str, Tuple[int, int]], path: str, settings: Dict, interval: float, debounce: float) -> Iterator[Set[str]]:
+    '''
+    Compare snapshots of the input files every interval seconds and group the changes into bursts
+
+    Args:
+        snapshot (Dict[str, Tuple[int, int]]): Snapshot to compare the first check with, see _snapshot
+        path (str): Input folder to watch
+        settings (Dict): Script settings dictionary
+        interval (float): Seconds between checks
+        debounce (float): Seconds without changes that end a burst of changes
+
+    Returns:
+        Iterator[Set[str]]: Paths that changed, once per burst of changes
+    '''
+    while True:
+        changed_paths = set()
+        last_change = None
+        while last_change is None or time.monotonic() - last_change < debounce:
+            time.sleep(interval)
+            new_snapshot = _snapshot(path, settings)
+            changed = {file_path for file_path in snapshot.keys() | new_snapshot.keys() if snapshot.get(file_path) != new_snapshot.get(file_path)}
+            snapshot = new_snapshot
+            if len(changed) > 0:
+                changed_paths |= changed
+                last_change = time.monotonic()
+        yield changed_paths
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _snapshot(path: str, settings: Dict) -> Dict[str, Tuple[int, int]]:
+    '''
+    Get the size and modification time of every input file
+
+    Args:
+        path (str): Input folder
+        settings (Dict): Script settings dictionary
+
+    Returns:
+        Dict[str, Tuple[int, int]]: File path -> (size, modification time in nanoseconds)
+    '''
+    snapshot = {}
+    for file_paths in discover_input_files(path, settings).values():
+        for file_path in file_paths:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            snapshot[file_path] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
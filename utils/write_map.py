@@ -0,0 +1,142 @@
+import os
+import json
+import hashlib
+import zipfile
+import logging
+
+from typing import Dict, Any, Union
+
+from .xlsx_patch import _find_workbook_part, _read_sheet_parts
+
+
+logger = logging.getLogger(__name__)
+
+# Bump when the label matching, the special case rules or the entry format change, so that older maps are not reused
+WRITE_MAP_VERSION = 2
+
+
+def load_write_maps(map_path: str, summary_path: str, settings: Dict, special_cases_path: str = 'scope_2_dict.json') -> Union[Dict[str, Any], None]:
+    '''
+    Summary:
+        Load the compiled write maps of the summary sheets from disk. The map of a sheet is only reused if the
+        sheet is unchanged, i.e. if the hash of its XML (and of the shared strings) is the same as when it was
+        compiled. A change to the special cases (scope_2_dict.json) or to the mismatch suggestion settings
+        invalidates every sheet. A missing, unreadable or outdated file gives empty maps
+
+    Args:
+        map_path (str): Path to the write map file
+        summary_path (str): Path to the summary file
+        settings (Dict): Script settings dictionary
+        special_cases_path (str): Path to the special case dictionary
+
+    Returns:
+        Dict[str, Any] or None: Write map dictionary with the structure below, or None if the summary file
+        cannot be hashed (e.g. because it does not exist)
+        {
+            'version': WRITE_MAP_VERSION,
+            'special cases': sha256 of the special case dictionary,
+            'suggestions': [settings["Mismatch suggestions"], settings["Mismatch suggestion min score"]],
+            'sheets': {
+                'summary sheet name': {
+                    'hash': sha256 of the sheet,
+                    'labels': {'label': write entry} # See compute_summary_writes
+                }
+            }
+        }
+    '''
+    try:
+        sheet_hashes = hash_summary_sheets(summary_path)
+    except (OSError, KeyError, zipfile.BadZipFile) as e:
+        logger.warning('Could not hash the sheets of %s, the write map is not used: %r', summary_path, e)
+        return None
+
+    write_maps = {
+        'version': WRITE_MAP_VERSION,
+        'special cases': _hash_special_cases(special_cases_path),
+        'suggestions': [settings.get("Mismatch suggestions", 3), settings.get("Mismatch suggestion min score", 0.3)],
+        'sheets': {}
+    }
+    stored = {}
+    try:
+        with open(map_path, 'r', encoding = 'utf-8') as f:
+            stored = json.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning('Could not read %s, compiling the write map again: %r', map_path, e)
+
+    stored_sheets = {}
+    if isinstance(stored, dict) and all(stored.get(field) == write_maps[field] for field in ('version', 'special cases', 'suggestions')):
+        stored_sheets = stored.get('sheets', {})
+
+    reused = 0
+    for sheet_name, sheet_hash in sheet_hashes.items():
+        sheet_map = stored_sheets.get(sheet_name)
+        if isinstance(sheet_map, dict) and sheet_map.get('hash') == sheet_hash:
+            reused += 1
+        else:
+            sheet_map = {'hash': sheet_hash, 'labels': {}}
+        write_maps['sheets'][sheet_name] = sheet_map
+
+    logger.info('%d of %d summary sheets served from the write map', reused, len(sheet_hashes))
+    return write_maps
+
+
+def save_write_maps(write_maps: Union[Dict[str, Any], None], map_path: str) -> None:
+    '''
+    Summary:
+        Save the write maps to disk as JSON. Sheets that were not hashed (see compute_summary_writes) are left out.
+        The file is replaced atomically
+
+    Args:
+        write_maps (Dict[str, Any], optional): Write map dictionary (see load_write_maps)
+        map_path (str): Path to the write map file
+    '''
+    if write_maps is None:
+        return
+
+    output = dict(write_maps)
+    output['sheets'] = {sheet_name: sheet_map for sheet_name, sheet_map in write_maps['sheets'].items() if sheet_map['hash'] is not None}
+    temp_path = map_path + '.tmp'
+    try:
+        with open(temp_path, 'w', encoding = 'utf-8') as f:
+            json.dump(output, f, ensure_ascii = False)
+        os.replace(temp_path, map_path)
+    except Exception as e:
+        logger.warning('Could not write %s: %r', map_path, e)
+
+
+def hash_summary_sheets(summary_path: str) -> Dict[str, str]:
+    '''
+    Summary:
+        Hash every sheet of the summary file from its raw XML, without parsing it. The shared strings are
+        part of each hash, since the sheet XML only refers to them by index
+
+    Args:
+        summary_path (str): Path to the summary file
+
+    Returns:
+        Dict[str, str]: Sheet name -> sha256 hex digest
+    '''
+    with zipfile.ZipFile(summary_path) as zf:
+        names = set(zf.namelist())
+        shared_strings = hashlib.sha256(zf.read('xl/sharedStrings.xml') if 'xl/sharedStrings.xml' in names else b'').digest()
+        sheet_hashes = {}
+        for sheet_name, part in _read_sheet_parts(zf, _find_workbook_part(zf)).items():
+            digest = hashlib.sha256(shared_strings)
+            digest.update(zf.read(part))
+            sheet_hashes[sheet_name] = digest.hexdigest()
+    return sheet_hashes
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _hash_special_cases(special_cases_path: str) -> Union[str, None]:
+    '''
+    Hash the special case dictionary, or None if it cannot be read
+    '''
+    try:
+        with open(special_cases_path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
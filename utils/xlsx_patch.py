@@ -0,0 +1,532 @@
+import os
+import re
+import math
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+
+from xml.sax.saxutils import escape, quoteattr
+from typing import List, Dict, Tuple, Any, Iterable
+
+from openpyxl.utils import get_column_letter, column_index_from_string
+
+
+MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PACKAGE_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+WORKSHEET_TYPE = REL_NS + '/worksheet'
+CALC_CHAIN_TYPE = REL_NS + '/calcChain'
+WORKSHEET_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+
+# Same characters that openpyxl refuses to write
+ILLEGAL_CHARACTERS_RE = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
+
+# Errors that patch_workbook raises for files or values it cannot patch (e.g. a file that is not a valid .xlsx,
+# malformed sheet XML or a value without an XML form). Callers catch them to fall back to a full openpyxl save
+PATCH_ERRORS = (ValueError, OSError, KeyError, zipfile.BadZipFile, ET.ParseError)
+
+_TAG_START_RE = r'<{prefix}{tag}\b([^>]*?)(/?)>'
+_ROW_NUMBER_RE = re.compile(r'\sr="(\d+)"')
+_CELL_REF_RE = re.compile(r'\sr="([A-Z]+)(\d+)"')
+_STYLE_RE = re.compile(r'\ss="(\d+)"')
+_SPANS_RE = re.compile(r'\sspans="[^"]*"')
+
+
+def read_sheet_names(file_path: str) -> List[str]:
+    '''
+    Summary:
+        Read the sheet names of a workbook from its workbook part, without loading any sheet
+
+    Args:
+        file_path (str): Path to the .xlsx file
+
+    Returns:
+        List[str]: Sheet names in workbook order
+    '''
+    with zipfile.ZipFile(file_path) as zf:
+        workbook_part = _find_workbook_part(zf)
+        return list(_read_sheet_parts(zf, workbook_part).keys())
+
+
+def patch_workbook(source_path: str, output_path: str, writes: Iterable[Tuple[str, int, int, Any]]) -> None:
+    '''
+    Summary:
+        Write cell values into a copy of a workbook by patching only the affected <c> elements of the
+        affected xl/worksheets/sheetN.xml parts. Every other part of the file is copied unchanged, so the
+        time spent scales with the number of written cells rather than the size of the workbook.
+        - later writes to the same cell replace earlier ones
+        - existing cells keep their style, new rows and cells are inserted in order
+        - strings are written as inline strings, so the shared strings part is left untouched
+        - strings starting with '=' are written as formulas, like openpyxl does. The calculation chain
+          is dropped if a formula cell is overwritten, and a full recalculation on load is requested
+          if a formula is written
+        - sheets that do not exist yet are created
+
+    Args:
+        source_path (str): Path to the workbook to patch
+        output_path (str): Path to write the patched workbook to, may be the same as source_path
+        writes (Iterable[Tuple[str, int, int, Any]]): (sheet name, row, column, value) per cell, 1-based
+
+    Raises:
+        ValueError: If a value cannot be written without changing other parts of the workbook
+        (e.g. dates, which need a number format), or the sheet XML uses a layout that is not
+        supported. Nothing is written in that case
+    '''
+    cells_per_sheet = {}
+    for sheet_name, row, col, value in writes:
+        cells_per_sheet.setdefault(sheet_name, {})[(row, col)] = value
+
+    with zipfile.ZipFile(source_path) as zf:
+        names = set(zf.namelist())
+        workbook_part = _find_workbook_part(zf)
+        workbook_rels_part = _rels_part(workbook_part)
+        sheet_parts = _read_sheet_parts(zf, workbook_part)
+
+        patched = {} # Part name -> new content
+        removed = set()
+        formula_overwritten = False
+        formula_written = False
+
+        for sheet_name, cells in cells_per_sheet.items():
+            if sheet_name in sheet_parts:
+                part = sheet_parts[sheet_name]
+                xml = zf.read(part).decode('utf-8')
+            else:
+                part = _new_sheet_part(names | set(patched))
+                xml = f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet xmlns="{MAIN_NS}"><dimension ref="A1"/><sheetData/></worksheet>'
+                _add_sheet(zf, patched, workbook_part, workbook_rels_part, sheet_name, part)
+            xml, overwritten, written = _patch_sheet_xml(xml, cells)
+            patched[part] = xml.encode('utf-8')
+            formula_overwritten = formula_overwritten or overwritten
+            formula_written = formula_written or written
+
+        if formula_overwritten:
+            removed |= _remove_calc_chain(zf, patched, workbook_part, workbook_rels_part)
+        if formula_written:
+            workbook_xml = _read_part(zf, patched, workbook_part)
+            patched[workbook_part] = _request_full_calc(workbook_xml).encode('utf-8')
+
+        temp_path = output_path + '.tmp'
+        try:
+            with zipfile.ZipFile(temp_path, 'w', compression = zipfile.ZIP_DEFLATED) as out:
+                for info in zf.infolist():
+                    if info.filename in removed:
+                        continue
+                    data = patched.pop(info.filename, None)
+                    if data is None:
+                        data = zf.read(info)
+                    out.writestr(info, data, compress_type = info.compress_type)
+                # Parts that did not exist in the source file
+                for part, data in patched.items():
+                    out.writestr(part, data)
+            os.replace(temp_path, output_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _patch_sheet_xml(xml: str, cells: Dict[Tuple[int, int], Any]) -> Tuple[str, bool, bool]:
+    '''
+    Patch the cells of one worksheet part. Only the rows that contain written cells are rebuilt,
+    the rest of the XML is kept as it is
+
+    Args:
+        xml (str): Worksheet part
+        cells (Dict[Tuple[int, int], Any]): (row, column) -> value
+
+    Returns:
+        Tuple[str, bool, bool]: The patched worksheet part, whether a formula cell was overwritten
+        and whether a formula was written
+    '''
+    match = re.search(r'<(\w+:)?sheetData\b([^>]*?)(/?)>', xml)
+    if match is None:
+        raise ValueError('Worksheet part has no sheetData element')
+    prefix = match.group(1) or ''
+    if match.group(3) == '/':
+        body_start = body_end = match.end()
+        head = xml[:match.start()] + f'<{prefix}sheetData{match.group(2)}>'
+        tail = f'</{prefix}sheetData>' + xml[match.end():]
+    else:
+        body_start = match.end()
+        body_end = xml.find(f'</{prefix}sheetData>', body_start)
+        head = xml[:body_start]
+        tail = xml[body_end:]
+    body = xml[body_start:body_end]
+
+    cells_per_row = {}
+    for (row, col), value in cells.items():
+        cells_per_row.setdefault(row, {})[col] = value
+
+    formula_overwritten = False
+    formula_written = any(_is_formula(value) for value in cells.values())
+
+    pieces = []
+    position = 0
+    pending_rows = sorted(cells_per_row)
+    row_start_re = re.compile(_TAG_START_RE.format(prefix = prefix, tag = 'row'))
+    for row_match in row_start_re.finditer(body):
+        row_number = _ROW_NUMBER_RE.search(' ' + row_match.group(1))
+        if row_number is None:
+            raise ValueError('Row without an r attribute')
+        row_number = int(row_number.group(1))
+
+        # New rows that go before this one
+        while len(pending_rows) > 0 and pending_rows[0] < row_number:
+            new_row = pending_rows.pop(0)
+            pieces.append(body[position:row_match.start()])
+            position = row_match.start()
+            pieces.append(_row_xml(prefix, new_row, '', '', cells_per_row[new_row])[0])
+
+        if row_match.group(2) == '/':
+            row_end = row_match.end()
+            row_content = ''
+        else:
+            content_end = body.find(f'</{prefix}row>', row_match.end())
+            row_end = content_end + len(f'</{prefix}row>')
+            row_content = body[row_match.end():content_end]
+
+        if len(pending_rows) > 0 and pending_rows[0] == row_number:
+            pending_rows.pop(0)
+            pieces.append(body[position:row_match.start()])
+            row_xml, overwritten = _row_xml(prefix, row_number, row_match.group(1), row_content, cells_per_row[row_number])
+            pieces.append(row_xml)
+            position = row_end
+            formula_overwritten = formula_overwritten or overwritten
+
+        if len(pending_rows) == 0:
+            break
+
+    pieces.append(body[position:])
+    for new_row in pending_rows:
+        pieces.append(_row_xml(prefix, new_row, '', '', cells_per_row[new_row])[0])
+
+    head = _update_dimension(head, prefix, cells.keys())
+    return head + ''.join(pieces) + tail, formula_overwritten, formula_written
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _row_xml(prefix: str, row: int, attributes: str, content: str, cells: Dict[int, Any]) -> Tuple[str, bool]:
+    '''
+    Rebuild one <row> element with the written cells merged into its existing cells in column order
+
+    Args:
+        prefix (str): Namespace prefix of the worksheet elements, including the colon
+        row (int): Row number
+        attributes (str): Attributes of the existing row element, '' for a new row
+        content (str): Content of the existing row element, '' for a new row
+        cells (Dict[int, Any]): Column -> value
+
+    Returns:
+        Tuple[str, bool]: The row element and whether a formula cell was overwritten
+    '''
+    if attributes == '':
+        attributes = f' r="{row}"'
+    else:
+        # The spans hint may no longer be correct
+        attributes = _SPANS_RE.sub('', attributes)
+
+    formula_overwritten = False
+    pieces = []
+    position = 0
+    pending_cols = sorted(cells)
+    cell_start_re = re.compile(_TAG_START_RE.format(prefix = prefix, tag = 'c'))
+    for cell_match in cell_start_re.finditer(content):
+        if len(pending_cols) == 0:
+            break
+        cell_ref = _CELL_REF_RE.search(' ' + cell_match.group(1))
+        if cell_ref is None:
+            raise ValueError(f'Cell without an r attribute in row {row}')
+        col = column_index_from_string(cell_ref.group(1))
+
+        while len(pending_cols) > 0 and pending_cols[0] < col:
+            new_col = pending_cols.pop(0)
+            pieces.append(content[position:cell_match.start()])
+            position = cell_match.start()
+            pieces.append(_cell_xml(prefix, row, new_col, cells[new_col], ''))
+
+        if len(pending_cols) > 0 and pending_cols[0] == col:
+            pending_cols.pop(0)
+            if cell_match.group(2) == '/':
+                cell_end = cell_match.end()
+                old_content = ''
+            else:
+                content_end = content.find(f'</{prefix}c>', cell_match.end())
+                cell_end = content_end + len(f'</{prefix}c>')
+                old_content = content[cell_match.end():content_end]
+
+            formula = re.search(_TAG_START_RE.format(prefix = prefix, tag = 'f'), old_content)
+            if formula is not None:
+                if 't="shared"' in formula.group(1) and 'ref="' in formula.group(1):
+                    raise ValueError(f'Cannot overwrite the shared formula in {cell_ref.group(1)}{row}, other cells depend on it')
+                formula_overwritten = True
+
+            style = _STYLE_RE.search(' ' + cell_match.group(1))
+            pieces.append(content[position:cell_match.start()])
+            pieces.append(_cell_xml(prefix, row, col, cells[col], '' if style is None else f' s="{style.group(1)}"'))
+            position = cell_end
+
+    pieces.append(content[position:])
+    for new_col in pending_cols:
+        pieces.append(_cell_xml(prefix, row, new_col, cells[new_col], ''))
+
+    return f'<{prefix}row{attributes}>' + ''.join(pieces) + f'</{prefix}row>', formula_overwritten
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _cell_xml(prefix: str, row: int, col: int, value: Any, style: str) -> str:
+    '''
+    Build a <c> element for a value, the same way openpyxl stores it
+
+    Args:
+        prefix (str): Namespace prefix of the worksheet elements, including the colon
+        row (int): Row number
+        col (int): Column number
+        value (Any): None, bool, int, float or str
+        style (str): Style attribute to keep (' s="N"'), or ''
+
+    Returns:
+        str: The cell element
+
+    Raises:
+        ValueError: If the value cannot be written as is
+    '''
+    ref = f'{get_column_letter(col)}{row}'
+    if value is None:
+        return f'<{prefix}c r="{ref}"{style}/>'
+    if isinstance(value, bool):
+        return f'<{prefix}c r="{ref}"{style} t="b"><{prefix}v>{int(value)}</{prefix}v></{prefix}c>'
+    if isinstance(value, (int, float)):
+        if isinstance(value, float) and not math.isfinite(value):
+            raise ValueError(f'Cannot write {value} to {ref}')
+        number = repr(float(value)) if isinstance(value, float) else str(int(value))
+        return f'<{prefix}c r="{ref}"{style}><{prefix}v>{number}</{prefix}v></{prefix}c>'
+    if isinstance(value, str):
+        if ILLEGAL_CHARACTERS_RE.search(value):
+            raise ValueError(f'Cannot write {value!r} to {ref}, it contains characters that are not allowed in a worksheet')
+        if _is_formula(value):
+            return f'<{prefix}c r="{ref}"{style}><{prefix}f>{escape(value[1:])}</{prefix}f><{prefix}v></{prefix}v></{prefix}c>'
+        space = ' xml:space="preserve"' if value != value.strip() else ''
+        return f'<{prefix}c r="{ref}"{style} t="inlineStr"><{prefix}is><{prefix}t{space}>{escape(value)}</{prefix}t></{prefix}is></{prefix}c>'
+    raise ValueError(f'Cannot write a value of type {type(value).__name__} to {ref} without changing the styles of the workbook')
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _is_formula(value: Any) -> bool:
+    '''
+    Check if a value is written as a formula (same rule as openpyxl)
+    '''
+    return isinstance(value, str) and len(value) > 1 and value.startswith('=')
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _update_dimension(head: str, prefix: str, cells: Iterable[Tuple[int, int]]) -> str:
+    '''
+    Extend the <dimension> reference of a worksheet part so that it includes the written cells
+
+    Args:
+        head (str): Worksheet part up to the content of sheetData
+        prefix (str): Namespace prefix of the worksheet elements, including the colon
+        cells (Iterable[Tuple[int, int]]): Written (row, column) pairs
+
+    Returns:
+        str: head with the updated dimension, or unchanged if it has none
+    '''
+    match = re.search(f'<{prefix}dimension\\b[^>]*?\\sref="([A-Z]+)(\\d+)(?::([A-Z]+)(\\d+))?"', head)
+    if match is None:
+        return head
+
+    min_col, min_row = column_index_from_string(match.group(1)), int(match.group(2))
+    if match.group(3) is None:
+        max_col, max_row = min_col, min_row
+    else:
+        max_col, max_row = column_index_from_string(match.group(3)), int(match.group(4))
+    for row, col in cells:
+        min_row, max_row = min(min_row, row), max(max_row, row)
+        min_col, max_col = min(min_col, col), max(max_col, col)
+
+    ref = f'{get_column_letter(min_col)}{min_row}'
+    if (min_row, min_col) != (max_row, max_col):
+        ref += f':{get_column_letter(max_col)}{max_row}'
+    return head[:match.start(1)] + ref + head[match.end(4) if match.group(3) is not None else match.end(2):]
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _find_workbook_part(zf: zipfile.ZipFile) -> str:
+    '''
+    Find the workbook part through the package relationships (normally xl/workbook.xml)
+    '''
+    root = ET.fromstring(zf.read('_rels/.rels'))
+    for relationship in root.iter(f'{{{PACKAGE_REL_NS}}}Relationship'):
+        if relationship.get('Type', '').endswith('/officeDocument'):
+            return relationship.get('Target').lstrip('/')
+    raise ValueError('Package has no workbook part')
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _rels_part(part: str) -> str:
+    '''
+    Get the name of the relationships part of a part, e.g. xl/workbook.xml -> xl/_rels/workbook.xml.rels
+    '''
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, '_rels', name + '.rels')
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _resolve_target(source_part: str, target: str) -> str:
+    '''
+    Resolve a relationship target relative to the part that contains the relationship
+    '''
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source_part), target))
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _read_sheet_parts(zf: zipfile.ZipFile, workbook_part: str) -> Dict[str, str]:
+    '''
+    Map the sheet names of a workbook to their worksheet parts
+
+    Args:
+        zf (zipfile.ZipFile): Opened workbook
+        workbook_part (str): Name of the workbook part
+
+    Returns:
+        Dict[str, str]: Sheet name -> part name, in workbook order. Chartsheets are left out
+    '''
+    relationships = ET.fromstring(zf.read(_rels_part(workbook_part)))
+    targets = {}
+    for relationship in relationships.iter(f'{{{PACKAGE_REL_NS}}}Relationship'):
+        if relationship.get('Type') == WORKSHEET_TYPE:
+            targets[relationship.get('Id')] = _resolve_target(workbook_part, relationship.get('Target'))
+
+    workbook = ET.fromstring(zf.read(workbook_part))
+    sheet_parts = {}
+    for sheet in workbook.iter(f'{{{MAIN_NS}}}sheet'):
+        relationship_id = sheet.get(f'{{{REL_NS}}}id')
+        if relationship_id in targets:
+            sheet_parts[sheet.get('name')] = targets[relationship_id]
+    if len(sheet_parts) == 0:
+        raise ValueError(f'No worksheets found in {workbook_part} (Strict Open XML workbooks are not supported)')
+    return sheet_parts
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _read_part(zf: zipfile.ZipFile, patched: Dict[str, bytes], part: str) -> str:
+    '''
+    Read a part, taking earlier patches into account
+    '''
+    return (patched[part] if part in patched else zf.read(part)).decode('utf-8')
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _new_sheet_part(names: Iterable[str]) -> str:
+    '''
+    Get an unused worksheet part name, xl/worksheets/sheetN.xml
+    '''
+    names = set(names)
+    number = 1
+    while f'xl/worksheets/sheet{number}.xml' in names:
+        number += 1
+    return f'xl/worksheets/sheet{number}.xml'
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _add_sheet(zf: zipfile.ZipFile, patched: Dict[str, bytes], workbook_part: str, workbook_rels_part: str, sheet_name: str, part: str) -> None:
+    '''
+    Register a new worksheet part in the workbook part, its relationships and the content types
+
+    Args:
+        zf (zipfile.ZipFile): Opened workbook
+        patched (Dict[str, bytes]): Part name -> new content, updated in place
+        workbook_part (str): Name of the workbook part
+        workbook_rels_part (str): Name of the relationships part of the workbook part
+        sheet_name (str): Name of the new sheet
+        part (str): Name of the new worksheet part
+    '''
+    rels_xml = _read_part(zf, patched, workbook_rels_part)
+    used_ids = set(re.findall(r'\sId="([^"]*)"', rels_xml))
+    number = len(used_ids) + 1
+    while f'rId{number}' in used_ids:
+        number += 1
+    relationship_id = f'rId{number}'
+    target = posixpath.relpath(part, posixpath.dirname(workbook_part))
+    rels_xml = rels_xml.replace('</Relationships>', f'<Relationship Id="{relationship_id}" Type="{WORKSHEET_TYPE}" Target="{target}"/></Relationships>')
+    patched[workbook_rels_part] = rels_xml.encode('utf-8')
+
+    workbook_xml = _read_part(zf, patched, workbook_part)
+    sheets = re.search(r'</(\w+:)?sheets>', workbook_xml)
+    if sheets is None:
+        raise ValueError('Workbook part has no sheets element')
+    prefix = sheets.group(1) or ''
+    sheet_ids = [int(sheet_id) for sheet_id in re.findall(r'\ssheetId="(\d+)"', workbook_xml)]
+    rel_prefix = re.search(f'xmlns:(\\w+)="{re.escape(REL_NS)}"', workbook_xml)
+    if rel_prefix is None:
+        id_attribute = f'xmlns:r="{REL_NS}" r:id="{relationship_id}"'
+    else:
+        id_attribute = f'{rel_prefix.group(1)}:id="{relationship_id}"'
+    sheet_xml = f'<{prefix}sheet name={quoteattr(sheet_name)} sheetId="{max(sheet_ids, default = 0) + 1}" {id_attribute}/>'
+    workbook_xml = workbook_xml[:sheets.start()] + sheet_xml + workbook_xml[sheets.start():]
+    patched[workbook_part] = workbook_xml.encode('utf-8')
+
+    content_types_xml = _read_part(zf, patched, '[Content_Types].xml')
+    content_types_xml = content_types_xml.replace('</Types>', f'<Override PartName="/{part}" ContentType="{WORKSHEET_CONTENT_TYPE}"/></Types>')
+    patched['[Content_Types].xml'] = content_types_xml.encode('utf-8')
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _remove_calc_chain(zf: zipfile.ZipFile, patched: Dict[str, bytes], workbook_part: str, workbook_rels_part: str) -> set:
+    '''
+    Drop the calculation chain (Excel rebuilds it on load), since it may list cells that no longer
+    contain a formula
+
+    Returns:
+        set: Names of the removed parts
+    '''
+    rels_xml = _read_part(zf, patched, workbook_rels_part)
+    relationship = re.search(f'<Relationship\\b[^>]*?Type="{re.escape(CALC_CHAIN_TYPE)}"[^>]*?/>', rels_xml)
+    if relationship is None:
+        return set()
+    target = re.search(r'\sTarget="([^"]*)"', relationship.group(0)).group(1)
+    part = _resolve_target(workbook_part, target)
+    patched[workbook_rels_part] = (rels_xml[:relationship.start()] + rels_xml[relationship.end():]).encode('utf-8')
+
+    content_types_xml = _read_part(zf, patched, '[Content_Types].xml')
+    content_types_xml = re.sub(f'<Override\\b[^>]*?PartName="/{re.escape(part)}"[^>]*?/>', '', content_types_xml)
+    patched['[Content_Types].xml'] = content_types_xml.encode('utf-8')
+    return {part}
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _request_full_calc(workbook_xml: str) -> str:
+    '''
+    Set fullCalcOnLoad in the workbook part, so that formulas written without a cached value are calculated when opened
+    '''
+    calc_pr = re.search(r'<(\w+:)?calcPr\b([^>]*?)(/?)>', workbook_xml)
+    if calc_pr is not None:
+        attributes = re.sub(r'\sfullCalcOnLoad="[^"]*"', '', calc_pr.group(2)).rstrip() + ' fullCalcOnLoad="1"'
+        return workbook_xml[:calc_pr.start(2)] + attributes + workbook_xml[calc_pr.end(2):]
+
+    # calcPr follows these elements in the schema
+    last_end = None
+    for tag in ('sheets', 'functionGroups', 'externalReferences', 'definedNames'):
+        for match in re.finditer(f'</(\\w+:)?{tag}>|<(\\w+:)?{tag}\\b[^>]*?/>', workbook_xml):
+            last_end = match.end() if last_end is None else max(last_end, match.end())
+    if last_end is None:
+        raise ValueError('Workbook part has no sheets element')
+    prefix = (re.search(r'<(\w+:)?sheets\b', workbook_xml).group(1) or '')
+    return workbook_xml[:last_end] + f'<{prefix}calcPr fullCalcOnLoad="1"/>' + workbook_xml[last_end:]
@@ -0,0 +1,402 @@
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+from typing import List, Dict, Tuple, Any, Union, Callable, Iterator, Set
+
+from openpyxl.formula.translate import Translator
+from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+from openpyxl.utils.cell import coordinate_to_tuple, range_boundaries
+from openpyxl.utils.datetime import from_excel, from_ISO8601, CALENDAR_WINDOWS_1900, CALENDAR_MAC_1904
+from openpyxl.worksheet.formula import ArrayFormula, DataTableFormula
+
+from .xlsx_patch import MAIN_NS, REL_NS, PACKAGE_REL_NS, _find_workbook_part, _read_sheet_parts, _rels_part, _resolve_target
+
+try:
+    # lxml parses faster and is used when it is installed
+    from lxml.etree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+
+SHARED_STRINGS_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml'
+CONTENT_TYPES_NS = 'http://schemas.openxmlformats.org/package/2006/content-types'
+STYLES_TYPE = REL_NS + '/styles'
+
+_SHEET_DATA_TAG = f'{{{MAIN_NS}}}sheetData'
+_ROW_TAG = f'{{{MAIN_NS}}}row'
+_CELL_TAG = f'{{{MAIN_NS}}}c'
+_VALUE_TAG = f'{{{MAIN_NS}}}v'
+_FORMULA_TAG = f'{{{MAIN_NS}}}f'
+_INLINE_STRING_TAG = f'{{{MAIN_NS}}}is'
+_TEXT_TAG = f'{{{MAIN_NS}}}t'
+_RUN_TAG = f'{{{MAIN_NS}}}r'
+_MERGE_CELL_RE = re.compile(rb'<(?:\w+:)?mergeCell\b[^>]*?\sref="([^"]+)"')
+_CHUNK_SIZE = 64 * 1024
+
+
+def iter_sheet_rows(zf: zipfile.ZipFile, sheet_filter: Callable[[str], bool], key_color: str) -> Iterator[Tuple[str, Iterator[List[Tuple[Any, bool]]]]]:
+    '''
+    Summary:
+        Stream the cells of the selected sheets of an .xlsx file straight from the sheet XML, without building
+        openpyxl cell or style objects. The styles.xml cellXfs -> fills table is resolved once per file, and only
+        the parts of the selected sheets are parsed (drawings, pivot caches and other sheets are never read).
+        Each sheet part is parsed as it is decompressed and its rows are dropped once they are yielded, so
+        memory use does not grow with the size of the sheet.
+        Values are the same as openpyxl.load_workbook gives: shared and inline strings, numbers cast to int or
+        float, dates for date formatted cells, booleans, and formulas as '=...' (shared formulas translated).
+        Cells inside a merged range, apart from its top-left cell, are empty and not colored, like MergedCell
+        The zip file is closed when the iterator is exhausted or closed, so the rows of each sheet have to be
+        read before the next sheet is taken
+
+    Args:
+        zf (zipfile.ZipFile): Opened .xlsx file
+        sheet_filter (Callable[[str], bool]): Returns True for the names of the sheets to read
+        key_color (str): aRGB fill color to look for, e.g. 'FFDDEBF7'
+
+    Returns:
+        Iterator of (sheet name, rows) per selected sheet, in workbook order. The rows are lists of
+        (value, is key colored) tuples starting at row 1 and column 1; missing rows are empty lists
+    '''
+    try:
+        workbook_part = _find_workbook_part(zf)
+        sheet_parts = _read_sheet_parts(zf, workbook_part)
+        selected = [(sheet_name, part) for sheet_name, part in sheet_parts.items() if sheet_filter(sheet_name)]
+        if len(selected) == 0:
+            return
+
+        colored_styles, date_styles, timedelta_styles = _read_styles(zf, workbook_part, key_color)
+        shared_strings = _read_shared_strings(zf)
+        epoch = _read_epoch(zf, workbook_part)
+
+        for sheet_name, part in selected:
+            yield sheet_name, _iter_rows(zf, part, shared_strings, colored_styles, date_styles, timedelta_styles, epoch)
+    finally:
+        zf.close()
+
+
+def read_merged_ranges(zf: zipfile.ZipFile, sheet_filter: Callable[[str], bool]) -> Dict[str, Dict[int, List[Tuple[int, int, int]]]]:
+    '''
+    Summary:
+        Find the merged ranges of the selected sheets of an .xlsx file, for readers that do not apply them
+        themselves (openpyxl in read-only mode). The zip file is left open
+
+    Args:
+        zf (zipfile.ZipFile): Opened .xlsx file
+        sheet_filter (Callable[[str], bool]): Returns True for the names of the sheets to read
+
+    Returns:
+        Dict[str, Dict[int, List[Tuple[int, int, int]]]]: Sheet name -> row -> (first column, last column,
+        column to skip) per merged range in that row, see _read_merged_cells. Sheets without merged ranges are left out
+    '''
+    merged_ranges = {}
+    for sheet_name, part in _read_sheet_parts(zf, _find_workbook_part(zf)).items():
+        if sheet_filter(sheet_name):
+            merged = _read_merged_cells(zf, part)
+            if len(merged) > 0:
+                merged_ranges[sheet_name] = merged
+    return merged_ranges
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _iter_rows(zf: zipfile.ZipFile, part: str, shared_strings: List[str], colored_styles: List[bool], date_styles: Set[int],
+               timedelta_styles: Set[int], epoch: Any) -> Iterator[List[Tuple[Any, bool]]]:
+    '''
+    Parse the rows of one worksheet part (see iter_sheet_rows), following openpyxl's WorkSheetParser.parse_cell.
+    The part is parsed straight from the zip file, and each row is cleared once it has been yielded
+
+    Args:
+        zf (zipfile.ZipFile): Opened .xlsx file
+        part (str): Name of the worksheet part
+        shared_strings (List[str]): Shared string table
+        colored_styles (List[bool]): Per cellXfs index, whether its fill has the key color
+        date_styles (Set[int]): cellXfs indices with a date number format
+        timedelta_styles (Set[int]): cellXfs indices with a time interval number format
+        epoch (datetime): Date system of the workbook
+
+    Returns:
+        Iterator of rows of (value, is key colored) tuples
+    '''
+    merged = _read_merged_cells(zf, part)
+    shared_formulae = {}
+    empty_cell = (None, False)
+
+    row_counter = 0
+    sheet_data = None
+    with zf.open(part) as source:
+        for event, element in iterparse(source, events = ('start', 'end')):
+            tag = element.tag
+            if event == 'start':
+                if tag == _SHEET_DATA_TAG:
+                    sheet_data = element
+                continue
+            if tag == _SHEET_DATA_TAG:
+                break # The rest of the sheet (merged cells are read above) is not needed
+            if tag != _ROW_TAG:
+                continue
+
+            row_number = element.get('r')
+            if row_number is None:
+                row_number = row_counter + 1
+            else:
+                row_number = int(float(row_number)) if not row_number.isdigit() else int(row_number)
+            if row_number <= row_counter:
+                raise ValueError(f'Row {row_number} is out of order')
+            # Missing rows are empty
+            while row_counter < row_number - 1:
+                row_counter += 1
+                yield []
+            row_counter = row_number
+
+            merged_ranges = merged.get(row_number)
+            cells = []
+            col_counter = 0
+            for cell in element:
+                if cell.tag != _CELL_TAG:
+                    continue
+                coordinate = cell.get('r')
+                if coordinate is None:
+                    col_counter += 1
+                else:
+                    col_counter = coordinate_to_tuple(coordinate)[1]
+                col = col_counter
+
+                style_id = int(cell.get('s', 0))
+                value = _cell_value(cell, style_id, coordinate, shared_strings, date_styles, timedelta_styles, epoch, shared_formulae)
+                colored = colored_styles[style_id] if style_id < len(colored_styles) else False
+
+                if merged_ranges is not None and any(min_col <= col <= max_col and col != skip_col for min_col, max_col, skip_col in merged_ranges):
+                    value, colored = empty_cell
+
+                if col > len(cells):
+                    cells.extend([empty_cell] * (col - 1 - len(cells)))
+                    cells.append((value, colored))
+                else:
+                    cells[col - 1] = (value, colored)
+
+            yield cells
+
+            element.clear()
+            if sheet_data is not None:
+                sheet_data.clear() # Drop the parsed rows, so that memory use does not grow with the sheet
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _cell_value(cell: Any, style_id: int, coordinate: str, shared_strings: List[str], date_styles: Set[int],
+                timedelta_styles: Set[int], epoch: Any, shared_formulae: Dict[str, Translator]) -> Any:
+    '''
+    Get the value of a <c> element the same way openpyxl does when it loads a workbook (data_only=False)
+    '''
+    data_type = cell.get('t', 'n')
+
+    formula = cell.find(_FORMULA_TAG)
+    if formula is not None:
+        formula_type = formula.get('t')
+        value = '='
+        if formula.text is not None:
+            value += formula.text
+        if formula_type == 'array':
+            return ArrayFormula(ref = formula.get('ref'), text = value)
+        if formula_type == 'shared':
+            index = formula.get('si')
+            if index in shared_formulae:
+                return shared_formulae[index].translate_formula(coordinate)
+            if value != '=':
+                shared_formulae[index] = Translator(value, coordinate)
+            return value
+        if formula_type == 'dataTable':
+            return DataTableFormula(**formula.attrib)
+        return value
+
+    if data_type == 'inlineStr':
+        inline_string = cell.find(_INLINE_STRING_TAG)
+        return None if inline_string is None else _text_content(inline_string)
+
+    value = cell.findtext(_VALUE_TAG, None) or None
+    if value is None:
+        return None
+    if data_type == 'n':
+        value = float(value) if '.' in value or 'E' in value or 'e' in value else int(value)
+        if style_id in date_styles:
+            try:
+                return from_excel(value, epoch, timedelta = style_id in timedelta_styles)
+            except (OverflowError, ValueError):
+                return '#VALUE!'
+        return value
+    if data_type == 's':
+        return shared_strings[int(value)]
+    if data_type == 'b':
+        return bool(int(value))
+    if data_type == 'd':
+        return from_ISO8601(value)
+    return value # 'str' and 'e'
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _text_content(element: Any) -> str:
+    '''
+    Get the text of a shared or inline string without formatting (the plain text, then the rich text runs)
+    '''
+    snippets = []
+    plain = element.find(_TEXT_TAG)
+    if plain is not None and plain.text is not None:
+        snippets.append(plain.text)
+    for run in element.iterfind(_RUN_TAG):
+        text = run.find(_TEXT_TAG)
+        if text is not None and text.text is not None:
+            snippets.append(text.text)
+    return ''.join(snippets)
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _read_merged_cells(zf: zipfile.ZipFile, part: str) -> Dict[int, List[Tuple[int, int, int]]]:
+    '''
+    Find the merged ranges of a worksheet part. They are listed after the cells, so they are found with
+    a search over the raw XML before the cells are parsed. The part is searched in chunks as it is
+    decompressed, so it is never held in memory as a whole
+
+    Returns:
+        Dict[int, List[Tuple[int, int, int]]]: Row -> (first column, last column, column to skip) per merged range
+        in that row. The column to skip is the top-left cell of the range, which keeps its value, or 0
+    '''
+    merged = {}
+    tail = b''
+    with zf.open(part) as source:
+        for chunk in iter(lambda: source.read(_CHUNK_SIZE), b''):
+            data = tail + chunk
+            # A tag can be cut off at the end of the chunk, so everything from the last '<' is searched with the next chunk
+            cut = data.rfind(b'<')
+            tail = data[cut:] if cut != -1 else b''
+            if b'mergeCell' not in data:
+                continue
+            for match in _MERGE_CELL_RE.finditer(data, 0, cut if cut != -1 else len(data)):
+                min_col, min_row, max_col, max_row = range_boundaries(match.group(1).decode('ascii'))
+                for row in range(min_row, max_row + 1):
+                    merged.setdefault(row, []).append((min_col, max_col, min_col if row == min_row else 0))
+    return merged
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _read_styles(zf: zipfile.ZipFile, workbook_part: str, key_color: str) -> Tuple[List[bool], Set[int], Set[int]]:
+    '''
+    Resolve the cell styles (cellXfs) of a workbook once: whether their fill has the key color,
+    and whether their number format is a date or time interval format (same rules as openpyxl).
+    The styles part is located through the workbook relationships, like the worksheet parts
+
+    Returns:
+        Tuple[List[bool], Set[int], Set[int]]: Per cellXfs index whether it is key colored,
+        the date formatted indices and the time interval formatted indices
+    '''
+    styles_part = _find_styles_part(zf, workbook_part)
+    if styles_part is None or styles_part not in zf.namelist():
+        return [False], set(), set()
+    root = ET.fromstring(zf.read(styles_part))
+
+    key_color = key_color.lower()
+    colored_fills = []
+    fills = root.find(f'{{{MAIN_NS}}}fills')
+    for fill in ([] if fills is None else fills.iterfind(f'{{{MAIN_NS}}}fill')):
+        color = _fill_color(fill)
+        colored_fills.append(color is not None and key_color in color.lower())
+
+    custom_formats = {}
+    number_formats = root.find(f'{{{MAIN_NS}}}numFmts')
+    for number_format in ([] if number_formats is None else number_formats.iterfind(f'{{{MAIN_NS}}}numFmt')):
+        custom_formats[int(number_format.get('numFmtId'))] = number_format.get('formatCode')
+
+    colored_styles = []
+    date_styles = set()
+    timedelta_styles = set()
+    cell_xfs = root.find(f'{{{MAIN_NS}}}cellXfs')
+    for index, xf in enumerate([] if cell_xfs is None else cell_xfs.iterfind(f'{{{MAIN_NS}}}xf')):
+        fill_id = int(xf.get('fillId', 0))
+        colored_styles.append(colored_fills[fill_id] if fill_id < len(colored_fills) else False)
+
+        number_format_id = int(xf.get('numFmtId', 0))
+        if number_format_id in custom_formats:
+            number_format = custom_formats[number_format_id]
+        else:
+            number_format = builtin_format_code(number_format_id)
+        if is_date_format(number_format):
+            date_styles.add(index)
+        if is_timedelta_format(number_format):
+            timedelta_styles.add(index)
+
+    if len(colored_styles) == 0:
+        colored_styles = [False]
+    return colored_styles, date_styles, timedelta_styles
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _find_styles_part(zf: zipfile.ZipFile, workbook_part: str) -> Union[str, None]:
+    '''
+    Find the styles part through the workbook relationships (normally xl/styles.xml), None if there is none
+    '''
+    relationships = ET.fromstring(zf.read(_rels_part(workbook_part)))
+    for relationship in relationships.iter(f'{{{PACKAGE_REL_NS}}}Relationship'):
+        if relationship.get('Type') == STYLES_TYPE:
+            return _resolve_target(workbook_part, relationship.get('Target'))
+    return None
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _fill_color(fill: Any) -> Any:
+    '''
+    Get the foreground color of a pattern fill the way openpyxl's PatternFill.start_color.index gives it:
+    the indexed, theme or auto value if set, else the aRGB value. None for gradient fills
+    '''
+    pattern_fill = fill.find(f'{{{MAIN_NS}}}patternFill')
+    if pattern_fill is None:
+        return None
+    color = pattern_fill.find(f'{{{MAIN_NS}}}fgColor')
+    if color is None:
+        return '00000000'
+    for attribute in ('indexed', 'theme', 'auto'):
+        if color.get(attribute) is not None:
+            return color.get(attribute)
+    rgb = color.get('rgb', '00000000')
+    return '00' + rgb if len(rgb) == 6 else rgb
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _read_shared_strings(zf: zipfile.ZipFile) -> List[str]:
+    '''
+    Read the shared string table, located through the content types like openpyxl does
+    '''
+    content_types = ET.fromstring(zf.read('[Content_Types].xml'))
+    part = None
+    for override in content_types.iter(f'{{{CONTENT_TYPES_NS}}}Override'):
+        if override.get('ContentType') == SHARED_STRINGS_CONTENT_TYPE:
+            part = override.get('PartName').lstrip('/')
+            break
+    if part is None or part not in zf.namelist():
+        return []
+
+    strings = []
+    string_tag = f'{{{MAIN_NS}}}si'
+    with zf.open(part) as source:
+        for _, element in iterparse(source):
+            if element.tag == string_tag:
+                strings.append(_text_content(element).replace('x005F_', ''))
+                element.clear()
+    return strings
+
+
+# The underscore (_) prefix means that this function is private and is
+# only used by modules in this package
+def _read_epoch(zf: zipfile.ZipFile, workbook_part: str) -> Any:
+    '''
+    Get the date system of the workbook (1900 or 1904)
+    '''
+    properties = ET.fromstring(zf.read(workbook_part)).find(f'{{{MAIN_NS}}}workbookPr')
+    if properties is not None and properties.get('date1904') in ('1', 'true'):
+        return CALENDAR_MAC_1904
+    return CALENDAR_WINDOWS_1900